@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+#  .______________________   __________                     .__
+#  |   \______   \_   ___ \  \______   \ ____   ____   ____ |  |__
+#  |   ||     ___/    \  \/   |    |  _// __ \ /    \_/ ___\|  |  \
+#  |   ||    |   \     \____  |    |   \  ___/|   |  \  \___|   Y  \
+#  |___||____|    \______  /  |______  /\___  >___|  /\___  >___|  /
+#                        \/          \/     \/     \/     \/     \/
+
+"""
+Benchmarks the size and pickling time of value messages sent between
+processes as name-keyed dictionaries against the `ValueIds` payloads, using
+the values declared in the default `values.json`, and the CPU time modules
+spend queueing metrics one at a time against the `MetricsPusher` batches.
+
+Usage: `SIGNIFIER=$PWD python bench/ipc_bench.py`
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import random
+import multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.pusher import MetricsPusher
+from src.valueids import ValueIds
+
+ROUNDS = 20000
+METRICS = 30
+METRIC_PUSHES = 2000
+VALUES_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'sys', 'config_defaults', 'values.json')
+
+
+def roundtrip(encode, decode, message) -> tuple:
+    """
+    Returns the pickled size of a message and the microseconds taken to
+    encode, pickle, unpickle and decode it.
+    """
+    size = len(pickle.dumps(encode(message), pickle.HIGHEST_PROTOCOL))
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        decode(pickle.loads(pickle.dumps(encode(message), pickle.HIGHEST_PROTOCOL)))
+    return size, (time.perf_counter() - start) / ROUNDS * 1e6
+
+
+def bench(label: str, message: dict, encode, decode):
+    plain_size, plain_us = roundtrip(lambda m: m, lambda m: m, message)
+    packed_size, packed_us = roundtrip(encode, decode, message)
+    print(f'{label:<22} {len(message):>3} values  '
+          f'dict {plain_size:>5} B {plain_us:>6.1f} us  '
+          f'packed {packed_size:>5} B {packed_us:>6.1f} us')
+
+
+def drain(metrics_q):
+    while metrics_q.get() is not None:
+        pass
+
+
+def queue_metrics(value_ids: ValueIds, batched: bool) -> float:
+    """
+    Returns the CPU microseconds taken to queue each update of `METRICS`
+    metrics, half from `values.json` and half module statistics, for a
+    separate process to drain.
+    """
+    names = value_ids.names[:METRICS // 2] + [f'module_stat_{i}' for i in range(METRICS // 2)]
+    metrics_q = mp.Queue()
+    consumer = mp.Process(target=drain, args=(metrics_q,))
+    consumer.start()
+    pusher = MetricsPusher(metrics_q, value_ids, 'bench', period=0)
+    rng = random.Random(0)
+    start = time.process_time()
+    for _ in range(METRIC_PUSHES):
+        values = {name: rng.random() for name in names}
+        if batched:
+            pusher.update_dict(values)
+            pusher.queue()
+        else:
+            for item in values.items():
+                metrics_q.put_nowait(item)
+    metrics_q.put(None)
+    consumer.join()
+    return (time.process_time() - start) / METRIC_PUSHES * 1e6
+
+
+if __name__ == '__main__':
+    with open(VALUES_PATH, encoding='utf8') as file:
+        value_ids = ValueIds(json.load(file))
+    rng = random.Random(0)
+    sources = {info.name: rng.random() for info in value_ids.info
+               if info.module == 'analysis' and info.role == 'sources'}
+    outputs = {info.name: {"value": rng.random(), "duration": 20} for info in value_ids.info
+               if info.role == 'destinations'}
+    bench('analysis sources', sources, value_ids.pack, value_ids.unpack)
+    bench('mapped destinations', outputs, value_ids.pack_outputs, value_ids.unpack_outputs)
+    print(f'{"metrics queue":<22} {METRICS:>3} values  '
+          f'single {queue_metrics(value_ids, False):>7.1f} us  '
+          f'batched {queue_metrics(value_ids, True):>7.1f} us')
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+#     _____                       .__                 __________                     .__
+#    /     \ _____  ______ ______ |__| ____    ____   \______   \ ____   ____   ____ |  |__
+#   /  \ /  \\__  \ \____ \\____ \|  |/    \  / ___\   |    |  _// __ \ /    \_/ ___\|  |  \
+#  /    Y    \/ __ \|  |_> >  |_> >  |   |  \/ /_/  >  |    |   \  ___/|   |  \  \___|   Y  \
+#  \____|__  (____  /   __/|   __/|__|___|  /\___  /   |______  /\___  >___|  /\___  >___|  /
+#          \/     \/|__|   |__|           \//_____/           \/     \/     \/     \/     \/
+
+"""
+Benchmarks the compiled `RuleSet` mapping engine against the mapper's
+original per-rule loop, checking both produce the same outputs. Each rule
+count is run with busy sources and with mostly idle sources, which the
+compiled engine skips.
+
+Usage: `SIGNIFIER=$PWD python bench/mapping_bench.py [rule counts...]`
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import scale
+from src.utils import SmoothedValue
+from src.ruleset import RuleSet
+
+TICKS = 2000
+SOURCES = 24
+RULE_COUNTS = [5, 50, 200, 500]
+# Chance of each source updating per tick, for busy and mostly idle sources
+ACTIVITY = [0.6, 0.02]
+
+
+def legacy_mappings(rules: list, sources: dict, prev_dest_values: dict) -> dict:
+    """
+    The mapper's per-rule loop before rules were compiled, returning the
+    new destination outputs for one tick.
+    """
+    new_destinations = {module: {} for module in prev_dest_values}
+    for r in rules:
+        rule_source = r["source"]
+        rule_dest = r["destination"]
+        if (source_value := sources.get(rule_source["name"])) is not None:
+            source_value = scale(
+                source_value,
+                rule_source.get("range", [0, 1]),
+                rule_dest.get("range", [0, 1]),
+                "clamp" if rule_source.get("clamp", False) else None,
+                "invert" if rule_source.get("invert", False) else None
+            )
+            prev_value = prev_dest_values[rule_dest["module"]].get(rule_dest["name"])
+            if prev_value is not None and prev_value == source_value:
+                continue
+            if prev_value is not None and (smoothing := rule_dest.get("smoothing")) is not None:
+                output_value = SmoothedValue(
+                    init=prev_value, amount=tuple(smoothing)).update(source_value)
+            else:
+                output_value = source_value
+            prev_dest_values[rule_dest["module"]][rule_dest["name"]] = output_value
+            new_destinations[rule_dest["module"]][rule_dest["name"]] = output_value
+    return new_destinations
+
+
+def compiled_mappings(rule_set: RuleSet, updates: dict) -> dict:
+    """
+    One tick of the compiled engine, returning outputs in the same format.
+    """
+    rule_set.update_sources(updates)
+    new_destinations = {}
+    changed, outputs = rule_set.evaluate()
+    for i, value in zip(changed.tolist(), outputs.tolist()):
+        module, name, _, _ = rule_set.outputs[i]
+        new_destinations.setdefault(module, {})[name] = value
+    return new_destinations
+
+
+def random_rules(count: int, rng: random.Random) -> list:
+    """
+    Generates mapping rules in the `rules.json` format.
+    """
+    rules = []
+    for _ in range(count):
+        s_min = rng.choice([0, 0, 0.1, 0.3])
+        d_min = rng.choice([0, 0.01, 0.2])
+        destination = {
+            "module": rng.choice(["leds", "composition"]),
+            "name": f"dest_{rng.randrange(count * 8)}",
+            "range": [d_min, rng.choice([d_min, 0.5, 1])],
+            "duration": rng.choice([None, 20, [50, 600]])}
+        if rng.random() < 0.8:
+            destination["smoothing"] = [rng.uniform(0.05, 0.95), rng.uniform(0.05, 0.95)]
+        rules.append({
+            "source": {
+                "module": "analysis",
+                "name": f"source_{rng.randrange(SOURCES)}",
+                "range": [s_min, rng.choice([s_min, 0.4, 0.8, 1])],
+                "clamp": rng.random() < 0.5,
+                "invert": rng.random() < 0.2},
+            "destination": destination})
+    return rules
+
+
+def source_ticks(rng: random.Random, activity: float) -> list:
+    """
+    Generates a sequence of source updates, each source updating with the
+    chance of `activity` each tick.
+    """
+    return [{f"source_{s}": rng.random() for s in range(SOURCES) if rng.random() < activity}
+            for _ in range(TICKS)]
+
+
+def compare(legacy: dict, compiled: dict) -> int:
+    """
+    Returns the number of outputs that differ between the two engines.
+    """
+    errors = 0
+    for module in set(legacy) | set(compiled):
+        a, b = legacy.get(module, {}), compiled.get(module, {})
+        for name in set(a) | set(b):
+            if name not in a or name not in b or abs(a[name] - b[name]) > 1e-9:
+                errors += 1
+    return errors
+
+
+def bench(count: int, activity: float):
+    rng = random.Random(count)
+    rules = random_rules(count, rng)
+    ticks = source_ticks(rng, activity)
+    # Legacy loop over the accumulated source dictionary, as the mapper did
+    sources = {}
+    prev_dest_values = {"leds": {}, "composition": {}}
+    legacy_outputs = []
+    start = time.perf_counter()
+    for updates in ticks:
+        sources.update(updates)
+        legacy_outputs.append(legacy_mappings(rules, sources, prev_dest_values))
+    legacy_secs = time.perf_counter() - start
+    rule_set = RuleSet(rules)
+    compiled_outputs = []
+    evaluated = 0
+    start = time.perf_counter()
+    for updates in ticks:
+        compiled_outputs.append(compiled_mappings(rule_set, updates))
+        evaluated += rule_set.evaluated
+    compiled_secs = time.perf_counter() - start
+    errors = sum(compare(a, b) for a, b in zip(legacy_outputs, compiled_outputs))
+    print(f'{count:>6} rules  activity {activity:>4}  '
+          f'legacy {legacy_secs / TICKS * 1e6:>9.1f} us/tick  '
+          f'compiled {compiled_secs / TICKS * 1e6:>8.1f} us/tick  '
+          f'x{legacy_secs / compiled_secs:>5.1f}  '
+          f'evaluated {evaluated / TICKS:>6.1f}/tick  mismatches {errors}')
+
+
+if __name__ == '__main__':
+    for count in [int(c) for c in sys.argv[1:]] or RULE_COUNTS:
+        for activity in ACTIVITY:
+            bench(count, activity)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+#    _________                     __                         __________                     .__
+#   /   _____/_____   ____   _____/  |________ __ __  _____   \______   \ ____   ____   ____ |  |__
+#   \_____  \\____ \_/ __ \_/ ___\   __\_  __ \  |  \/     \   |    |  _// __ \ /    \_/ ___\|  |  \
+#   /        \  |_> >  ___/\  \___|  |  |  | \/  |  /  Y Y  \  |    |   \  ___/|   |  \  \___|   Y  \
+#  /_______  /   __/ \___  >\___  >__|  |__|  |____/|__|_|  /  |______  /\___  >___|  /\___  >___|  /
+#          \/|__|        \/     \/                        \/          \/     \/     \/     \/     \/
+
+"""
+Benchmarks the analysis module's spectral features, reporting the time
+taken per period and the share of one core used at 48 kHz, and checks the
+features of test tones. The beat tracker is checked against the simulated
+kick drum loop at several tempos, and the loudness time scales against
+levels computed from the full history of periods.
+
+Usage: `SIGNIFIER=$PWD python bench/spectrum_bench.py [fft sizes...]`
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.tempo import BeatTracker
+from src.loudness import Loudness
+from src.spectrum import Spectrum
+from src.simulation import synthetic_audio
+
+SAMPLE_RATE = 48000
+PERIOD = 1024
+SECONDS = 20
+FFT_SIZES = [1024, 2048, 4096]
+TONES = [100, 1000, 8000]
+TEMPOS = [90, 120, 128, 140, 174]
+LOUDNESS_SECS = 130
+
+
+def tone(frequency: float, seconds=1) -> np.ndarray:
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (np.sin(2 * np.pi * frequency * t) * 32767).astype("<i2")
+
+
+def bench(fft_size: int):
+    spectrum = Spectrum(SAMPLE_RATE, fft_size)
+    for frequency in TONES:
+        samples = tone(frequency)
+        for start in range(0, len(samples) - PERIOD, PERIOD):
+            values = spectrum.process(samples[start:start + PERIOD])
+        print(f'{fft_size:>6} fft  {frequency:>5} Hz tone  ' + '  '.join(
+            f'{name} {value:.3f}' for name, value in zip(spectrum.names, values)))
+    rng = np.random.default_rng(fft_size)
+    samples = (rng.standard_normal(SAMPLE_RATE * SECONDS) * 4000).astype("<i2")
+    periods = len(samples) // PERIOD
+    start = time.perf_counter()
+    for i in range(periods):
+        spectrum.process(samples[i * PERIOD:(i + 1) * PERIOD])
+    secs = (time.perf_counter() - start) / periods
+    print(f'{fft_size:>6} fft  {secs * 1e6:>7.1f} us/period  '
+          f'{secs / (PERIOD / SAMPLE_RATE) * 100:.2f}% of one core\n')
+
+
+def bench_tempo(bpm: int):
+    spectrum = Spectrum(SAMPLE_RATE)
+    tracker = BeatTracker(SAMPLE_RATE / PERIOD)
+    samples = synthetic_audio(SAMPLE_RATE, SECONDS, bpm)
+    periods = len(samples) // PERIOD
+    onsets = 0
+    phase_error = []
+    secs = 0
+    for i in range(periods):
+        flux = spectrum.process(samples[i * PERIOD:(i + 1) * PERIOD])[-1]
+        start = time.perf_counter()
+        onset, tracked_bpm, phase = tracker.process(flux)
+        secs += time.perf_counter() - start
+        onsets += onset
+        # Beats should land at the start of the phase once the tracker settles
+        if onset and i > periods // 2:
+            phase_error.append(min(phase, 1 - phase))
+    print(f'{bpm:>6} bpm  tracked {tracked_bpm:>6.1f}  onsets {int(onsets):>3}/{SECONDS * bpm // 60:<3}  '
+          f'phase error at onsets {np.mean(phase_error):.3f}  {secs / periods * 1e6:>5.1f} us/period')
+
+
+def bench_loudness():
+    loudness = Loudness(SAMPLE_RATE / PERIOD)
+    rng = np.random.default_rng(0)
+    periods = int(LOUDNESS_SECS * SAMPLE_RATE / PERIOD)
+    # Noise changing level every 20 periods
+    amplitudes = np.repeat(rng.uniform(0.01, 0.5, periods // 20 + 1), 20)[:periods]
+    mean_squares = np.zeros(periods)
+    secs = 0
+    for i in range(periods):
+        samples = (rng.standard_normal(PERIOD) * amplitudes[i] * 32767).clip(-32768, 32767).astype("<i2")
+        mean_squares[i] = np.mean(samples.astype(float) ** 2) / 32768 ** 2
+        start = time.perf_counter()
+        values = loudness.process(samples)
+        secs += time.perf_counter() - start
+    # Each scale covers the periods up to the last window completed by the scale below
+    step = 1
+    for index, level in enumerate(loudness.levels):
+        span = step * level.size
+        end = periods // step * step
+        levels = np.sqrt(mean_squares[end - span:end])
+        expected = [np.sqrt(np.mean(levels ** 2)), levels.max(), np.percentile(levels, 90)]
+        print(f'{loudness.names[index * 3][4:]:>6}  ' + '  '.join(
+            f'{name[:3]} {value:.4f} (full history {exact:.4f})'
+            for name, value, exact in zip(loudness.names[index * 3:], values[index * 3:index * 3 + 3],
+                                          expected)))
+        step = span
+    print(f'loudness  {secs / periods * 1e6:>5.1f} us/period')
+
+
+if __name__ == '__main__':
+    for fft_size in [int(n) for n in sys.argv[1:]] or FFT_SIZES:
+        bench(fft_size)
+    for bpm in TEMPOS:
+        bench_tempo(bpm)
+    bench_loudness()
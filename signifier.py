@@ -23,23 +23,24 @@ import sys
 import json
 import time
 import signal
+import argparse
 import subprocess
 from dictdiffer import diff as dict_diff
 import multiprocessing as mp
-
-
-# Imports appear unused, but are dynamically loaded by module dictionary
-from src.leds import Leds
-from src.mapper import Mapper
-from src.metrics import Metrics
-from src.analysis import Analysis
-from src.bluetooth import Bluetooth
-from src.composition import Composition
+from multiprocessing.connection import wait
 
 from src.utils import SigLog
 from src.utils import plural
 from src.utils import Stopwatch
+from src.utils import queue_pipe
 from src.utils import load_config_files
+from src.registry import get_module_class
+from src.valuebus import ValueBus
+from src.valueids import ValueIds
+from src.recording import Replay
+from src.recording import REPLAY_FINISHED
+from src.configwatcher import fingerprint
+from src.configwatcher import ConfigWatcher
 
 
 SigLog.roll_over()
@@ -50,7 +51,7 @@ SIG_PATH = os.getenv('SIGNIFIER')
 SITE_PATH = os.path.join(SIG_PATH, 'site')
 CONFIG_PATH = os.path.join(SIG_PATH, 'cfg')
 SIG_SCRIPTS = os.path.join(SIG_PATH, 'scripts')
-DEFAULTS_PATH = os.path.join(SIG_PATH, 'sys', 'default_configs')
+DEFAULTS_PATH = os.path.join(SIG_PATH, 'sys', 'config_defaults')
 CONFIG_UPDATE_SECS = 2
 CONFIG_FILES = {'config':'config.json',
                 'values':'values.json',
@@ -59,57 +60,74 @@ configs = {name:{'file':file, 'modules':None}\
     for (name, file) in CONFIG_FILES.items()}
 
 config_update_time = time.time()
+config_watcher = None
+config_hashes = {}
 process_loop_sleep = 0.001
 metrics_q = mp.Queue(maxsize=500)
+value_bus = None
+simulation = None
+replay = None
 
 module_objects = {}
-module_types = {'leds':Leds, 
-                'mapper':Mapper,
-                'metrics':Metrics,
-                'analysis':Analysis,
-                'bluetooth':Bluetooth,
-                'composition':Composition}
 
 
 def check_config_update():
     """
     Checks config files from the Signifier config path and updates any modules
-    with updated configuration values.
+    with updated configuration values. Only files reported as changed by the
+    config watcher are re-parsed, and only modules whose settings fingerprint
+    differs are diffed and updated.
     """
     global CONFIG_UPDATE_SECS, config_update_time, module_objects, configs
 
+    if (config_watcher.fileno() is None and
+            time.time() < config_update_time + CONFIG_UPDATE_SECS):
+        return None
+    config_update_time = time.time()
+    if len(changed_files := config_watcher.changed()) == 0:
+        return None
+    new_configs = load_config_files(
+        {name: configs[name] for name in changed_files},
+        CONFIG_FILES, CONFIG_PATH, DEFAULTS_PATH)
+    if simulation is not None and 'config' in changed_files:
+        simulation.apply(new_configs['config']['modules'])
+    if replay is not None and 'config' in changed_files:
+        replay.apply(new_configs['config']['modules'])
     updated_modules = set()
-    if time.time() > config_update_time + CONFIG_UPDATE_SECS:
-        config_update_time = time.time()
-        new_configs = load_config_files(configs, CONFIG_FILES, CONFIG_PATH, DEFAULTS_PATH)
-        values_config_changed = False
-        # Find differences in current and new config
-        for config, values in configs.items():
-            modules = values['modules']
-            for module, settings in modules.items():
-                diff = list(
-                    dict_diff(settings, new_configs[config]['modules'][module]))
-                if len(diff) > 0:
-                    print()
-                    logger.info(f'Config change: [{module}]: {diff}')
-                    updated_modules.add(module)
-                    if config == 'values':
-                        values_config_changed = True
-        # Find and update all metrics modules if values config has changed
-        if values_config_changed:
-            for module in module_objects.values():
-                if type(module).__name__.lower() == module_types['metrics']:
-                    updated_modules.add(module)
-        # Tell modules with updated configs to reload with new settings
-        if updated_modules is not None and len(updated_modules) > 0:
-            configs = new_configs
-            logger.info(f'Updating modules: {updated_modules}')
-            for m in updated_modules:
-                if m in module_objects:
-                    module_objects[m].update_config(configs)
-            print()
-        CONFIG_UPDATE_SECS = configs['config']['modules']['general'].get(
-                'config_update_secs', 2)
+    values_config_changed = False
+    # Find modules with changed settings in each modified config file
+    for config in changed_files:
+        new_modules = new_configs[config]['modules']
+        new_hashes = fingerprint(new_modules)
+        for module in set(new_hashes) | set(config_hashes[config]):
+            if new_hashes.get(module) != config_hashes[config].get(module):
+                diff = list(dict_diff(
+                    configs[config]['modules'].get(module, {}),
+                    new_modules.get(module, {})))
+                print()
+                logger.info(f'Config change: [{module}]: {diff}')
+                updated_modules.add(module)
+                if config == 'values':
+                    values_config_changed = True
+        config_hashes[config] = new_hashes
+    configs = {**configs, **{name: new_configs[name] for name in changed_files}}
+    # Every module falls back to some general settings, so check them all for changes
+    if 'general' in updated_modules:
+        updated_modules |= set(module_objects)
+    # Find and update all metrics modules if values config has changed
+    if values_config_changed:
+        for name, module in module_objects.items():
+            if module.module_config.get('module_type') == 'metrics':
+                updated_modules.add(name)
+    # Tell modules with updated configs to reload with new settings
+    if len(updated_modules) > 0:
+        logger.info(f'Updating modules: {updated_modules}')
+        for m in updated_modules:
+            if m in module_objects:
+                module_objects[m].update_config(configs)
+        print()
+    CONFIG_UPDATE_SECS = configs['config']['modules']['general'].get(
+            'config_update_secs', 2)
 
 
 def module_callback(module, message):
@@ -119,6 +137,8 @@ def module_callback(module, message):
     for logging purposes of callback details.
     """
     logger.info(f'Message from [{module}]: "{message}"')
+    if message == REPLAY_FINISHED and replay is not None:
+        exit_handler.shutdown()
     # The analysis module has detect silence for X seconds, indicating a critical
     # ASIO underrun, which silently crashes PyGame's audio engine and requires a restart.
     if 'underrun' in message:
@@ -180,6 +200,10 @@ class ExitHandler:
                         if module.status.name not in ['closed', 'empty', 'disabled', 'failed']:
                             still_waiting = True
                     time.sleep(process_loop_sleep)
+                if value_bus is not None:
+                    value_bus.close(unlink=True)
+                if simulation is not None:
+                    simulation.close()
                 logger.info("Signifier shutdown complete!")
                 self.exiting = False
                 sys.exit()
@@ -195,6 +219,18 @@ class ExitHandler:
 #          \/     \/        \/
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Melbourne Music Week Signifier.')
+    parser.add_argument('--simulate', nargs='?', type=float, const=0, metavar='SECONDS',
+                        help='run with hardware stand-ins for SECONDS (default from '
+                             'config), then write a throughput and latency report')
+    parser.add_argument('--replay', metavar='PATH',
+                        help='replay recorded source values through the mapper '
+                             'instead of running the analysis and Bluetooth modules')
+    parser.add_argument('--speed', type=float, default=1, metavar='FACTOR',
+                        help='replay speed relative to the recording, or 0 to '
+                             'replay as fast as possible (default 1)')
+    args = parser.parse_args()
+
     main_thread = mp.current_process()
     exit_handler = ExitHandler()
 
@@ -205,27 +241,59 @@ if __name__ == '__main__':
     config_data = configs['config']['modules']
     logger.setLevel(config_data['general'].get('log_level'))
     process_loop_sleep = config_data['general'].get('process_loop_sleep')
-    
-    # Write current hostname to config file
-    if config_data['general']['hostname'] != HOSTNAME:
+
+    if args.simulate is not None:
+        from src.simulation import Simulation
+        simulation = Simulation(config_data, args.simulate)
+        simulation.apply(config_data)
+    if args.replay is not None:
+        try:
+            replay = Replay(args.replay, args.speed)
+        except FileNotFoundError as exception:
+            logger.critical(exception)
+            exit_handler.shutdown()
+        replay.apply(config_data)
+
+    # Write current hostname to config file, unless overridden for a simulation or replay
+    if (simulation is None and replay is None
+            and config_data['general']['hostname'] != HOSTNAME):
         config_data['general']['hostname'] = HOSTNAME
         with open(os.path.join(CONFIG_PATH, configs['config']['file']),
                   'w', encoding='utf8') as c:
             json.dump(config_data, c, ensure_ascii=False, indent=4)
 
+    config_watcher = ConfigWatcher(CONFIG_FILES, CONFIG_PATH)
+    config_hashes = {name: fingerprint(config['modules']) for name, config in configs.items()}
+
     print()
     logger.info(f'Starting Signifier on [{HOSTNAME}] as user [{os.getenv("USER")}]')
 
+    # Shared memory for module values, falling back to pipes if unavailable
+    if config_data['general'].get('value_bus', True):
+        try:
+            value_bus = ValueBus(configs['values']['modules'])
+        except OSError as exception:
+            logger.warning(f'Could not create value bus, using pipes instead: {exception}')
+
+    # IDs of the values declared at startup, used for all values sent between processes
+    value_ids = ValueIds(configs['values']['modules'])
+
     # Define and load modules
     for name, settings in configs['config']['modules'].items():
-        if (module_class := module_types.get(settings.get('module_type', ''))) is not None:
-            module_objects[name] = module_class(name, configs, metrics=metrics_q, callback=module_callback)
+        if (module_class := get_module_class(settings.get('module_type', ''))) is not None:
+            module_objects[name] = module_class(name, configs, metrics=metrics_q,
+                value_bus=value_bus, value_ids=value_ids, callback=module_callback)
         elif name != 'general':
             logger.warning(f'[{name}] module has no module_type, so cannot be started. '
                            f'Check config.json!')
     # Provide any mapper modules the module pipe from each module except its own
     for mapper_name, mapper_module in module_objects.items():
         if type(mapper_module).__name__.lower() == 'mapper':
+            # Modules sharing the main process with the mapper skip pickling
+            if mapper_module.host == 'thread':
+                for name, module in module_objects.items():
+                    if module.host == 'thread' and name != mapper_name:
+                        module.mapping_pipe, module.module_pipe = queue_pipe()
             mapper_module.pipes = {name: module.module_pipe
                 for name, module in module_objects.items()
                 if mapper_name != name}
@@ -233,9 +301,22 @@ if __name__ == '__main__':
     logger.info(f'Signifier initialised with ({len(module_objects)}) '
                 f'module{plural(module_objects)}. Starting main program loop...')
 
-    # Main update loop
+    # Main update loop, blocking until a module reports, a process exits or a deadline passes
     while True:
-        for m in module_objects.values():
-            m.monitor_process()
+        handles = [h for m in module_objects.values() for h in m.wait_objects()]
+        deadlines = [d for m in module_objects.values()
+                     if (d := m.next_deadline()) is not None]
+        if config_watcher.fileno() is not None:
+            handles.append(config_watcher.fileno())
+        else:
+            deadlines.append(config_update_time + CONFIG_UPDATE_SECS - time.time())
+        if simulation is not None:
+            if simulation.remaining() <= 0:
+                exit_handler.shutdown()
+            deadlines.append(simulation.remaining())
+        wait_start = time.monotonic()
+        ready = wait(handles, max(0, min(deadlines)) if len(deadlines) > 0 else None)
+        wait_times = (wait_start, time.monotonic(), ready)
         check_config_update()
-        time.sleep(process_loop_sleep)
+        for m in module_objects.values():
+            m.monitor_process(wait_times)
@@ -7,27 +7,50 @@
 
 """
 Signifier module to process audio streams, sending values to the input pool.
+
+Each period read from the input device gives the peak amplitude and, if the
+`spectrum` config is enabled, the RMS level, band levels, spectral centroid
+and spectral flux computed by `src.spectrum.Spectrum`. Band levels are
+published as `analysis_<band>` sources, which need declaring in
+`values.json` to be sent over the value bus. With the `tempo` config also
+enabled, the flux drives the onset, BPM and beat phase sources of
+`src.tempo.BeatTracker`. The `loudness` config adds the RMS, loudest and
+percentile levels of `src.loudness.Loudness` over each of its time scales,
+published as sources such as `analysis_rms_10s` and `analysis_p90_60s`.
 """
 
 from __future__ import annotations
 
+import math
 import time
 
-import alsaaudio
 import numpy as np
-import multiprocessing as mp
 
+from src.utils import LazyModule
+from src.capture import AudioCapture
+from src.loudness import Loudness
+from src.loudness import DEFAULT_PERCENTILE
+from src.loudness import DEFAULT_SCALES_SECS
 from src.sigmodule import SigModule
 from src.sigprocess import ModuleProcess
+from src.spectrum import Spectrum
+from src.spectrum import DEFAULT_FFT_SIZE
+from src.tempo import BeatTracker
+from src.tempo import DEFAULT_BPM_RANGE
+
+alsaaudio = LazyModule("alsaaudio")
 
 
 THRESHOLD = 2e-08
+# Longest wait for a captured period before checking the device has stalled
+CAPTURE_WAIT_SECS = 1
 
 
 class Analysis(SigModule):
     """
     Audio analysis manager module.
     """
+    hot_config = {"log_level", "gain", "underrun_detection_secs", "spectrum", "tempo", "loudness"}
 
     def __init__(self, name: str, config: dict, *args, **kwargs) -> None:
         super().__init__(name, config, *args, **kwargs)
@@ -37,10 +60,10 @@ class Analysis(SigModule):
         Called by the module's `initialise()` method to return a
         module-specific object.
         """
-        self.process = AnalysisProcess(self)
+        self.process = self.hosted(AnalysisProcess)(self)
 
 
-class AnalysisProcess(ModuleProcess, mp.Process):
+class AnalysisProcess(ModuleProcess):
     """
     Perform audio analysis on an input device.
     """
@@ -57,68 +80,220 @@ class AnalysisProcess(ModuleProcess, mp.Process):
         self.gain = parent.module_config.get("gain", 2)
         self.underrun_secs = parent.module_config.get("underrun_detection_secs", 20)
         self.silence_start = None
+        self.capture = None
         # Mapping and metrics
         self.peak_name = f"{self.module_name}_peak"
         self.source_values = {self.peak_name: 0}
+        self.spectrum = None
+        self.spectrum_names = []
+        self.tempo = None
+        self.tempo_names = []
+        self.loudness = None
+        self.loudness_names = []
+        self.feature_settings = None
         if self.parent_pipe.writable:
             self.parent_pipe.send("initialised")
 
+    def apply_hot_config(self, rules_config: dict):
+        """
+        Applies updated analysis parameters without reopening the input device.
+        """
+        self.gain = self.config.get("gain", 2)
+        self.underrun_secs = self.config.get("underrun_detection_secs", 20)
+        try:
+            self.set_features()
+        except ValueError as exception:
+            self.logger.error(f"Keeping current analysis features: {exception}")
+
+    def set_features(self):
+        """
+        Creates the spectral analyser, beat tracker and loudness scales from
+        the `spectrum`, `tempo` and `loudness` configs, replacing the current
+        ones only if all are valid and any config has changed. Sources of
+        disabled features are removed.
+        """
+        settings = (self.config.get("spectrum") or {}, self.config.get("tempo") or {},
+                    self.config.get("loudness") or {})
+        if settings == self.feature_settings:
+            return
+        spectrum_settings, tempo_settings, loudness_settings = settings
+        spectrum = None
+        tempo = None
+        loudness = None
+        if spectrum_settings.get("enabled", False):
+            spectrum = Spectrum(self.sample_rate,
+                                spectrum_settings.get("fft_size", DEFAULT_FFT_SIZE),
+                                spectrum_settings.get("bands"))
+        if tempo_settings.get("enabled", False):
+            if spectrum is None:
+                raise ValueError("Tempo tracking needs the spectrum enabled")
+            tempo = BeatTracker(self.sample_rate / self.buffer_size,
+                                tempo_settings.get("bpm_range", DEFAULT_BPM_RANGE),
+                                tempo_settings.get("sensitivity", 1.5),
+                                tempo_settings.get("min_onset_ms", 100) / 1000)
+        if loudness_settings.get("enabled", False):
+            loudness = Loudness(self.sample_rate / self.buffer_size,
+                                loudness_settings.get("scales_secs", DEFAULT_SCALES_SECS),
+                                loudness_settings.get("percentile", DEFAULT_PERCENTILE))
+        for name in self.spectrum_names + self.tempo_names + self.loudness_names:
+            self.source_values.pop(name, None)
+        self.spectrum = spectrum
+        self.tempo = tempo
+        self.loudness = loudness
+        self.spectrum_names = [] if spectrum is None else [
+            f"{self.module_name}_{name}" for name in spectrum.names]
+        self.tempo_names = [] if tempo is None else [
+            f"{self.module_name}_{name}" for name in tempo.names]
+        self.loudness_names = [] if loudness is None else [
+            f"{self.module_name}_{name}" for name in loudness.names]
+        self.feature_settings = settings
+
+    def wait_objects(self) -> list:
+        """
+        Wakes the analysis loop as soon as the capture thread reads a period.
+        """
+        if self.capture is None:
+            return super().wait_objects()
+        return super().wait_objects() + [self.capture.wake_fd]
+
     def pre_shutdown(self):
         """
         Module-specific Process shutdown preparation.
         """
-        self.input_audio.close()
+        if self.capture is not None:
+            self.capture.stop()
+        if self.input_audio is not None:
+            self.input_audio.close()
 
     def pre_run(self) -> bool:
         """
         Module-specific Process run preparation.
         """
         self.prev_empty = 0
-        self.input_audio = alsaaudio.PCM(
-            type=alsaaudio.PCM_CAPTURE,
-            mode=alsaaudio.PCM_NORMAL,
-            rate=self.sample_rate,
-            channels=1,
-            format=alsaaudio.PCM_FORMAT_S16_LE,
-            periodsize=self.buffer_size,
-            device=self.input_device,
-        )
+        try:
+            self.set_features()
+        except ValueError as exception:
+            self.failed(exception)
+            return False
+        if self.simulate:
+            from src.simulation import SimulatedPCM
+            self.input_audio = SimulatedPCM(
+                self.sample_rate, self.buffer_size, self.simulation.get("audio_file"))
+            read_error = OSError
+        else:
+            # Non-blocking, so the capture thread polls the device along with its stop pipe
+            self.input_audio = alsaaudio.PCM(
+                type=alsaaudio.PCM_CAPTURE,
+                mode=alsaaudio.PCM_NONBLOCK,
+                rate=self.sample_rate,
+                channels=1,
+                format=alsaaudio.PCM_FORMAT_S16_LE,
+                periodsize=self.buffer_size,
+                device=self.input_device,
+            )
+            read_error = alsaaudio.ALSAAudioError
+        # Periods are read on their own thread, so slow analysis never delays a read
+        slots = math.ceil(self.config.get("capture_buffer_secs", 1) * self.sample_rate
+                          / self.buffer_size)
+        self.capture = AudioCapture(self.input_audio, self.buffer_size, slots, read_error)
+        self.capture.start()
+        self.prev_process_time = time.time()
+        self.capture_stats_time = time.monotonic()
+        self.max_depth = 0
         return True
 
     def mid_run(self):
         """
         Module-specific Process run commands. Where the bulk of the module's
-        computation occurs.
-        """
-        length = 0
-        while not length:
-            try:
-                length, data = self.input_audio.read()
-            except alsaaudio.ALSAAudioError as exception:
-                self.failed(exception)
-                return None
-
-            buffer = np.frombuffer(data, dtype="<i2")
-            if buffer is not None and len(buffer) != 0:
-                # Calculate peak amplitude
-                peak = np.amax(np.abs(buffer))
-                peak = max(0.0, min(1.0, (1 / self.output_volume) * (peak / 16400) * self.gain ))
-                if peak != self.source_values[self.peak_name]:
-                    # Set silence start time to identifying unhandled ALSA underruns
-                    self.silence_start = time.time() if peak == 0 else None
-                    self.source_values[self.peak_name] = peak
-                    self.metrics_pusher.update(self.peak_name, peak)
-                # Alert main thread if underrun detected  
-                elif peak < THRESHOLD and self.silence_start is not None:
-                    if time.time() > self.silence_start + self.underrun_secs:
-                        if self.parent_pipe.writable:
-                            print(f'Underrun!!')
-                            self.parent_pipe.send(f'underrun {round(time.time() - self.silence_start)} seconds')
-                            self.event.set()
-                self.metrics_pusher.update(f"{self.module_name}_buffer_size", length)
-                self.metrics_pusher.update(
-                    f"{self.module_name}_buffer_ms",
-                    int((time.time() - self.prev_process_time) * 1000),
-                )
-                self.prev_process_time = time.time()
-                buffer = None
+        computation occurs.\n
+        Analyses each period waiting in the capture ring, woken by the
+        capture thread through its wake pipe.
+        """
+        if self.capture.error is not None:
+            self.failed(self.capture.error)
+            return None
+        depth = self.capture.depth()
+        self.max_depth = max(self.max_depth, depth)
+        for buffer, buffer_time in self.capture.periods():
+            self.analyse_period(buffer, buffer_time)
+        if depth == 0 and time.time() > self.prev_process_time + self.underrun_secs:
+            # The device has stopped delivering periods altogether
+            self.report_underrun(self.prev_process_time)
+        if time.monotonic() > self.capture_stats_time + self.stats_period:
+            self.capture_stats_time = time.monotonic()
+            self.metrics_pusher.update(f"{self.module_name}_capture_depth", self.max_depth)
+            self.metrics_pusher.update(f"{self.module_name}_capture_dropped", self.capture.dropped)
+            self.metrics_pusher.update(f"{self.module_name}_capture_overruns", self.capture.overruns)
+            self.max_depth = 0
+        return CAPTURE_WAIT_SECS
+
+    def analyse_period(self, buffer: np.ndarray, buffer_time: float):
+        """
+        Computes the source values of a captured period.
+        """
+        # Calculate peak amplitude
+        peak = np.amax(np.abs(buffer))
+        peak = max(0.0, min(1.0, (1 / self.output_volume) * (peak / 16400) * self.gain ))
+        if peak != self.source_values[self.peak_name]:
+            # Set silence start time to identifying unhandled ALSA underruns
+            self.silence_start = time.time() if peak == 0 else None
+            self.source_values[self.peak_name] = peak
+            self.trace_source(self.peak_name, buffer_time)
+            self.metrics_pusher.update(self.peak_name, peak)
+        # Alert main thread if underrun detected
+        elif peak < THRESHOLD and self.silence_start is not None:
+            if time.time() > self.silence_start + self.underrun_secs:
+                self.report_underrun(self.silence_start)
+        if self.spectrum is not None:
+            self.publish_spectrum(buffer, buffer_time)
+        if self.loudness is not None:
+            self.publish_loudness(buffer, buffer_time)
+        self.metrics_pusher.update(f"{self.module_name}_buffer_size", len(buffer))
+        self.metrics_pusher.update(
+            f"{self.module_name}_buffer_ms",
+            int((time.time() - self.prev_process_time) * 1000),
+        )
+        self.prev_process_time = time.time()
+
+    def report_underrun(self, since: float):
+        """
+        Tells the module an underrun has lasted since `since`, and stops the
+        process so it can be restarted.
+        """
+        if self.parent_pipe.writable:
+            print(f'Underrun!!')
+            self.parent_pipe.send(f'underrun {round(time.time() - since)} seconds')
+            self.event.set()
+
+    def publish_spectrum(self, buffer: np.ndarray, buffer_time: float):
+        """
+        Computes the spectral features of a period and updates their source
+        values, along with the onset and tempo if enabled. Levels are scaled
+        by the input gain like the peak amplitude.
+        """
+        level_scale = self.gain / self.output_volume
+        values = self.spectrum.process(buffer)
+        values[:self.spectrum.level_count] = np.minimum(
+            1.0, values[:self.spectrum.level_count] * level_scale)
+        self.update_sources(self.spectrum_names, values, buffer_time)
+        if self.tempo is not None:
+            self.update_sources(self.tempo_names, self.tempo.process(values[-1]), buffer_time)
+
+    def publish_loudness(self, buffer: np.ndarray, buffer_time: float):
+        """
+        Adds a period to the loudness scales and updates the source values
+        of the scales it changed, scaled by the input gain.
+        """
+        values = self.loudness.process(buffer)
+        count = self.loudness.updated * 3
+        values[:count] = np.minimum(1.0, values[:count] * (self.gain / self.output_volume))
+        self.update_sources(self.loudness_names[:count], values[:count], buffer_time)
+
+    def update_sources(self, names: list, values: np.ndarray, buffer_time: float):
+        """
+        Sets the source values of a feature array computed from a period.
+        """
+        for name, value in zip(names, values.tolist()):
+            self.source_values[name] = value
+            self.trace_source(name, buffer_time)
+            self.metrics_pusher.update(name, value)
@@ -14,21 +14,20 @@ from __future__ import annotations
 import time
 
 import numpy as np
-import multiprocessing as mp
-from bleson import get_provider, Observer
-from bleson import logger as blelogger
 
+from src.utils import LazyModule
 from src.utils import lerp, db_to_amp
 from src.sigmodule import SigModule
 from src.sigprocess import ModuleProcess
 
-blelogger.set_level(blelogger.ERROR)
+bleson = LazyModule("bleson")
 
 
 class Bluetooth(SigModule):
     """
     Bluetooth scanner manager module.
     """
+    hot_config = {"log_level", "scan_dur", "signal_threshold", "remove_after"}
 
     def __init__(self, name: str, config: dict, *args, **kwargs) -> None:
         super().__init__(name, config, *args, **kwargs)
@@ -38,10 +37,10 @@ class Bluetooth(SigModule):
         Called by the module's `initialise()` method to return a
         module-specific object.
         """
-        self.process = BluetoothProcess(self)
+        self.process = self.hosted(BluetoothProcess)(self)
 
 
-class BluetoothProcess(ModuleProcess, mp.Process):
+class BluetoothProcess(ModuleProcess):
     """
     Perform audio analysis on an input device.
     """
@@ -73,15 +72,36 @@ class BluetoothProcess(ModuleProcess, mp.Process):
             if mac in self.devices:
                 self.devices.pop(mac)
 
+    def apply_hot_config(self, rules_config: dict):
+        """
+        Applies updated scanning parameters to the scanner and tracked devices.
+        """
+        self.remove_after = self.config.get("remove_after", 15)
+        self.duration = self.config.get("scan_dur", 3)
+        self.signal_threshold = self.config.get("signal_threshold", 0.002)
+        for device in self.devices.values():
+            device.duration = self.duration
+            device.remove_after = self.remove_after
+
     def pre_run(self) -> bool:
         """
         Module-specific Process run preparation.
         """
+        if self.simulate:
+            from src.simulation import SimulatedAdapter
+            from src.simulation import SimulatedObserver
+            self.adapter = SimulatedAdapter()
+            self.observer = SimulatedObserver(
+                self.adapter, self.simulation.get("ble_devices", 6))
+            self.observer.on_advertising_data = self.scan_callback
+            return True
+        bleson.logger.set_level(bleson.logger.ERROR)
         try:
-            self.adapter = get_provider().get_adapter()
+            self.adapter = bleson.get_provider().get_adapter()
         except InterruptedError as exception:
             self.failed(exception)
-        self.observer = Observer(self.adapter)
+            return False
+        self.observer = bleson.Observer(self.adapter)
         self.observer.on_advertising_data = self.scan_callback
         return True
 
@@ -117,6 +137,8 @@ class BluetoothProcess(ModuleProcess, mp.Process):
             f"{self.module_name}_activity_std": np.std(activity_array),
             f"{self.module_name}_activity_max": np.amax(activity_array),
         }
+        # Scanning blocks for the scan duration, so run again immediately
+        return 0
 
     def pre_shutdown(self):
         """
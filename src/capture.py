@@ -0,0 +1,174 @@
+#  _________                __
+#  \_   ___ \_____  _______/  |_ __ _________   ____
+#  /    \  \/\__  \ \____ \   __\  |  \_  __ \_/ __ \
+#  \     \____/ __ \|  |_> >  | |  |  /|  | \/\  ___/
+#   \______  (____  /   __/|__| |____/ |__|    \___  >
+#          \/     \/|__|                           \/
+
+"""
+Audio capture thread reading periods from an input device into a ring
+buffer, so slow analysis, metrics or IPC in the analysis module's loop
+never delays the next read and causes an overrun on the device.
+
+Devices opened with `PCM_NONBLOCK` are polled through their poll
+descriptors along with a stop pipe, so the thread reads every available
+period as soon as it arrives and stops immediately when asked, rather than
+after its current read returns.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import errno
+import select
+from threading import Thread
+
+import numpy as np
+
+from src.utils import SigLog
+
+logger = SigLog.get_logger('Sig.Capture', level='INFO')
+
+# Seconds to wait for the capture thread to finish its current read
+CAPTURE_JOIN_SECS = 1
+
+
+class AudioCapture(Thread):
+    """
+    Reads periods from a PCM capture device, such as an `alsaaudio.PCM` or
+    `SimulatedPCM`, into a preallocated ring of `slots` periods. Devices
+    with `polldescriptors()` must be opened non-blocking, while reads from
+    other devices block until a period is available.\n
+    The capture thread is the only writer of `written` and the consumer the
+    only writer of `consumed`, so neither needs a lock. Each captured period
+    writes a byte to the wake pipe, so the consumer can block on `wake_fd`
+    with the rest of its wait objects.\n
+    Periods arriving while the ring is full are dropped and counted in
+    `dropped`, while reads reporting a device overrun are counted in
+    `overruns`. Read errors stop the thread, leaving the exception in
+    `error` for the consumer to handle.
+    """
+
+    def __init__(self, pcm, period: int, slots: int, read_error=Exception) -> None:
+        super().__init__(name='AudioCapture', daemon=True)
+        self.pcm = pcm
+        self.read_error = read_error
+        self.ring = np.zeros((max(2, slots), period), dtype="<i2")
+        self.lengths = np.zeros(len(self.ring), dtype=np.intp)
+        self.stamps = np.zeros(len(self.ring))
+        self.written = 0
+        self.consumed = 0
+        self.dropped = 0
+        self.overruns = 0
+        self.error = None
+        self.running = True
+        self.wake_fd, self.wake_write_fd = os.pipe()
+        self.stop_fd, self.stop_write_fd = os.pipe()
+        for fd in (self.wake_fd, self.wake_write_fd, self.stop_fd, self.stop_write_fd):
+            os.set_blocking(fd, False)
+
+    def run(self):
+        """
+        Reads periods until stopped or the device fails.
+        """
+        try:
+            if hasattr(self.pcm, "polldescriptors"):
+                self.poll_periods()
+            else:
+                while self.running:
+                    self.store(*self.pcm.read())
+        except self.read_error as exception:
+            self.error = exception
+            self.wake()
+
+    def poll_periods(self):
+        """
+        Waits on the device's poll descriptors and the stop pipe, reading
+        every available period each time the device is ready.
+        """
+        poller = select.poll()
+        for fd, events in self.pcm.polldescriptors():
+            poller.register(fd, events)
+        poller.register(self.stop_fd, select.POLLIN)
+        while self.running:
+            poller.poll()
+            while self.running and self.store(*self.pcm.read()):
+                pass
+
+    def store(self, length: int, data: bytes) -> bool:
+        """
+        Stores a period read from the device in the ring, returning `False`
+        if no period was available.
+        """
+        stamp = time.monotonic()
+        if length == 0 or length == -errno.EAGAIN:
+            return False
+        if length < 0:
+            # Other negative lengths are errors, such as `-EPIPE` after an overrun
+            self.overruns += 1
+            return True
+        if self.written - self.consumed >= len(self.ring):
+            self.dropped += 1
+            return True
+        slot = self.written % len(self.ring)
+        samples = np.frombuffer(data, dtype="<i2")[:self.ring.shape[1]]
+        self.ring[slot, :len(samples)] = samples
+        self.lengths[slot] = len(samples)
+        self.stamps[slot] = stamp
+        self.written += 1
+        self.wake()
+        return True
+
+    def wake(self):
+        """
+        Wakes the consumer. Wakes are skipped while the pipe is full, as the
+        consumer takes every waiting period on each wake.
+        """
+        try:
+            os.write(self.wake_write_fd, b'\0')
+        except BlockingIOError:
+            pass
+
+    def depth(self) -> int:
+        """
+        Returns the number of captured periods waiting to be consumed.
+        """
+        return self.written - self.consumed
+
+    def periods(self):
+        """
+        Clears pending wakes and yields each waiting period as a
+        `(samples, capture time)` tuple, releasing its slot once the
+        consumer asks for the next.
+        """
+        try:
+            while os.read(self.wake_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.consumed < self.written:
+            slot = self.consumed % len(self.ring)
+            yield self.ring[slot, :self.lengths[slot]], float(self.stamps[slot])
+            self.consumed += 1
+
+    def stop(self):
+        """
+        Stops the capture thread and closes its pipes. Blocking devices
+        stop once their current read returns.
+        """
+        self.running = False
+        try:
+            os.write(self.stop_write_fd, b'\0')
+        except BlockingIOError:
+            pass
+        if self.is_alive():
+            self.join(CAPTURE_JOIN_SECS)
+        if self.is_alive():
+            logger.warning('Capture thread did not finish its read before closing.')
+            return
+        for fd in (self.wake_fd, self.wake_write_fd, self.stop_fd, self.stop_write_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
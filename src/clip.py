@@ -16,7 +16,9 @@ import time
 import bisect
 import random
 
-from pygame.mixer import Sound, Channel
+from src.utils import LazyModule
+
+pg = LazyModule("pygame")
 
 
 class Clip:
@@ -30,7 +32,7 @@ class Clip:
         self.name = name
         self.logger = logger
         self.path = os.path.join(root, name)
-        self.length = Sound(self.path).get_length()
+        self.length = pg.mixer.Sound(self.path).get_length()
         self.category = None
         self.looping = None
         self.sound = None
@@ -124,7 +126,7 @@ class Clip:
     # ---------------
     # Clip utilities
     # ---------------
-    def set_channel(self, chan: tuple) -> Channel:
+    def set_channel(self, chan: tuple) -> pg.mixer.Channel:
         """
         Binds supplied (index, Channel) tuple to Clip.
         """
@@ -142,7 +144,7 @@ class Clip:
         """
         Loads the Clip's audio file into memory as a new Sound object and assign it a mixer Channel.
         """
-        self.sound = Sound(self.path)
+        self.sound = pg.mixer.Sound(self.path)
         self.index = chan[0]
         self.set_channel(chan)
         if not self.sound or not self.channel:
@@ -152,7 +154,7 @@ class Clip:
         return self
 
 
-    def remove_channel(self) -> Channel:
+    def remove_channel(self) -> pg.mixer.Channel:
         """
         Removes Channel and index number from Clip, returning the Channel object.
         """
@@ -12,35 +12,35 @@ Signifier module to manage the audio clip playback.
 from __future__ import annotations
 
 import os
-import sys
 import random
 import schedule
 
-from threading import Thread
-
 from src.sigprocess import ModuleProcess
 from src.sigmodule import SigModule
 from src.clip import Clip
 import src.clipUtils as clipUtils
 from src.utils import plural
+from src.utils import LazyModule
+
 
+# Seconds between checks for finished clips and pending jobs
+CLIP_EVENT_SECS = 0.05
 
 # Allows PyGame to run without a screen
 os.environ["SDL_VIDEODRIVER"] = "dummy"
-# Silence PyGame greeting mesage -- currently not working
-stdout = sys.__stdout__
-stderr = sys.__stderr__
-sys.stdout = open(os.devnull, "w")
-sys.stderr = open(os.devnull, "w")
-import pygame as pg
-sys.stdout = stdout
-sys.stderr = stderr
+# Silence PyGame greeting message
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+# PyGame is only imported once the composition module starts its mixer
+pg = LazyModule("pygame")
 
 
 class Composition(SigModule):
     """
     Audio playback composition manager module.
     """
+    default_host = "thread"
+    hot_config = {"log_level", "jobs", "mix_volume",
+                  "fade_in_ms", "fade_out_ms"}
 
     def __init__(self, name: str, config: dict, *args, **kwargs) -> None:
         super().__init__(name, config, *args, **kwargs)
@@ -51,10 +51,10 @@ class Composition(SigModule):
         Called by the module's `initialise()` method to return a
         module-specific object.
         """
-        self.process = CompositionProcess(self)
+        self.process = self.hosted(CompositionProcess)(self)
 
 
-class CompositionProcess(ModuleProcess, Thread):
+class CompositionProcess(ModuleProcess):
     """
     Controls the playback of an audio clip library.
     """
@@ -132,6 +132,26 @@ class CompositionProcess(ModuleProcess, Thread):
                           f'collection{plural(self.collections)}.')
         return True
 
+    def apply_hot_config(self, rules_config: dict):
+        """
+        Applies updated fades, mix volume and job schedules without
+        reinitialising the audio mixer.
+        """
+        self.fade_in = self.config.get("fade_in_ms", 1000)
+        self.fade_out = self.config.get("fade_out_ms", 2000)
+        mix_volume = self.config.get("mix_volume", 0.5)
+        if mix_volume != self.mix_volume:
+            self.mix_volume = mix_volume
+            # Channels otherwise keep the old volume until the next collection
+            if pg.mixer.get_init():
+                for i in range(pg.mixer.get_num_channels()):
+                    pg.mixer.Channel(i).set_volume(self.mix_volume)
+        if self.jobs != self.config["jobs"]:
+            self.jobs = self.config["jobs"]
+            # Rescheduling only resets job timers, it does not run them
+            self.stop_job()
+            self.start_jobs()
+
     def pre_run(self) -> bool:
         """
         Module-specific Process run preparation.
@@ -150,6 +170,7 @@ class CompositionProcess(ModuleProcess, Thread):
             self.check_clip_events()
         except pg.error as exception:
             self.failed(exception)
+        return CLIP_EVENT_SECS
 
 
     def pre_shutdown(self):
@@ -0,0 +1,135 @@
+#  _________                _____.__          __      __         __         .__
+#  \_   ___ \  ____   _____/ ____\__| ____   /  \    /  \_____ _/  |_  ____ |  |__   ___________
+#  /    \  \/ /  _ \ /    \   __\|  |/ ___\  \   \/\/   /\__  \\   __\/ ___\|  |  \_/ __ \_  __ \
+#  \     \___(  <_> )   |  \  |  |  / /_/  >  \        /  / __ \|  | \  \___|   Y  \  ___/|  | \/
+#   \______  /\____/|___|  /__|  |__\___  /    \__/\  /  (____  /__|  \___  >___|  /\___  >__|
+#          \/            \/        /_____/          \/        \/          \/     \/     \/
+
+"""
+Watches the Signifier config files for changes, using inotify where available
+and falling back to comparing file modification stats.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import struct
+import ctypes
+import ctypes.util
+
+from src.utils import SigLog
+
+logger = SigLog.get_logger('Sig.Config', level='INFO')
+
+# Events from linux/inotify.h signalling a file has been rewritten or replaced
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class ConfigWatcher:
+    """
+    Reports which config files have changed since the previous check.\n
+    On Linux an inotify descriptor on the config directory is exposed through
+    `fileno()`, so the supervisor can block on it and pick up edits as soon as
+    they are written. Otherwise `fileno()` returns `None` and each call to
+    `changed()` compares the files' modification time and size instead.
+    """
+
+    def __init__(self, config_files: dict, config_path: str) -> None:
+        self.config_path = config_path
+        self.config_files = config_files
+        self.config_names = {file: name for name, file in config_files.items()}
+        self.file_stats = {name: self.stat(file) for file, name in self.config_names.items()}
+        self.inotify_fd = None
+        self.open_inotify()
+
+    def open_inotify(self):
+        """
+        Attempts to create an inotify watch on the config directory.
+        """
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            if libc.inotify_add_watch(fd, self.config_path.encode(), WATCH_MASK) < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+            self.inotify_fd = fd
+            logger.debug(f'Watching [{self.config_path}] for config changes with inotify.')
+        except (OSError, AttributeError, TypeError) as exception:
+            logger.warning(f'Config inotify unavailable, polling file stats instead: {exception}')
+
+    def fileno(self):
+        """
+        Returns the inotify file descriptor, or `None` if files are polled.
+        """
+        return self.inotify_fd
+
+    def stat(self, file: str) -> tuple:
+        """
+        Returns the modification time and size of a config file.
+        """
+        try:
+            stat = os.stat(os.path.join(self.config_path, file))
+            return (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None
+
+    def changed(self) -> set:
+        """
+        Returns the set of config names whose files have changed on disk
+        since the previous call.
+        """
+        if self.inotify_fd is not None:
+            candidates = self.read_events()
+        else:
+            candidates = set(self.config_names.values())
+        changed = set()
+        for name in candidates:
+            if (stat := self.stat(self.config_files[name])) != self.file_stats[name]:
+                self.file_stats[name] = stat
+                changed.add(name)
+        return changed
+
+    def read_events(self) -> set:
+        """
+        Drains pending inotify events, returning the config names they name.
+        """
+        names = set()
+        while True:
+            try:
+                data = os.read(self.inotify_fd, 4096)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                file = data[offset:offset + length].rstrip(b'\0').decode(errors='ignore')
+                offset += length
+                if (name := self.config_names.get(file)) is not None:
+                    names.add(name)
+
+    def close(self):
+        """
+        Closes the inotify file descriptor.
+        """
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+
+def fingerprint(modules: dict) -> dict:
+    """
+    Returns a dictionary of content hashes for each module's settings, so
+    unchanged modules can be skipped without diffing their settings.
+    """
+    if modules is None:
+        return {}
+    return {module: hash(json.dumps(settings, sort_keys=True))
+            for module, settings in modules.items()}
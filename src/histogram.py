@@ -0,0 +1,112 @@
+#    ___ ___ .__          __
+#   /   |   \|__| _______/  |_  ____   ________________    _____
+#  /    ~    \  |/  ___/\   __\/  _ \ / ___\_  __ \__  \  /     \
+#  \    Y    /  |\___ \  |  | (  <_> ) /_/  >  | \// __ \|  Y Y  \
+#   \___|_  /|__/____  > |__|  \____/\___  /|__|  (____  /__|_|  /
+#         \/         \/             /_____/            \/      \/
+
+"""
+Fixed-bucket histograms for timing module Process loops, cheap enough to
+update on every loop iteration and exported to Prometheus as histograms.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left
+
+# Upper bounds in seconds, from 50 µs (an idle loop) to 1 s (a blocked loop)
+TIMING_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                  0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values over a fixed set of buckets.\n
+    Counts are kept per bucket and only made cumulative in `snapshot()`,
+    so each observation is a bisect and two additions.
+    """
+
+    def __init__(self, buckets=TIMING_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        """
+        Adds a value to the histogram.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> dict:
+        """
+        Returns the histogram in the format exported to Prometheus, with
+        cumulative `(upper bound, count)` pairs ending with `+Inf`.
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {"buckets": buckets, "sum": round(self.sum, 6), "count": self.count}
+
+    def reset(self):
+        """
+        Clears all observations.
+        """
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+# Stages of a module Process loop timed when `loop_timing` is enabled
+LOOP_STAGES = ("mid_run", "jitter", "poll_control", "ipc_send", "ipc_recv")
+# Hops of a traced value from its origin in a source module to the LED
+# acknowledgement, each observed by the process at the end of the hop
+TRACE_HOPS = ("source", "to_mapper", "mapper", "to_leds", "leds_queue", "serial_ack", "total")
+
+
+class StageTimer:
+    """
+    Collection of histograms timing named stages, exported as
+    `<prefix>_<stage>_seconds` histograms.
+    """
+
+    def __init__(self, prefix: str, stages: tuple) -> None:
+        self.prefix = prefix
+        self.histograms = {stage: Histogram() for stage in stages}
+
+    def observe(self, stage: str, value: float):
+        """
+        Adds a duration in seconds to the named stage's histogram.
+        """
+        self.histograms[stage].observe(value)
+
+    def snapshots(self) -> dict:
+        """
+        Returns a dictionary of metric names and histogram snapshots for the
+        stages with observations.
+        """
+        return {f"{self.prefix}_{stage}_seconds": histogram.snapshot()
+                for stage, histogram in self.histograms.items() if histogram.count}
+
+    def reset(self):
+        """
+        Clears all stage histograms.
+        """
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+
+def quantile(snapshot: dict, q: float) -> float:
+    """
+    Returns the upper bound of the bucket holding the `q` quantile of a
+    histogram snapshot, or `None` if the snapshot has no observations.
+    """
+    target = q * snapshot["count"]
+    for bound, count in snapshot["buckets"]:
+        if count >= target and count > 0:
+            return bound
+    return None
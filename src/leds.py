@@ -14,19 +14,21 @@ from asyncio.log import logger
 
 import time
 
-import multiprocessing as mp
-from serial import SerialException
-from pySerialTransfer import pySerialTransfer as Arduino
-
 from src.utils import scale
+from src.utils import LazyModule
 from src.sigmodule import SigModule
 from src.sigprocess import ModuleProcess
 
+# Serial libraries are only imported by the LED process itself
+serial = LazyModule("serial")
+Arduino = LazyModule("pySerialTransfer.pySerialTransfer")
+
 
 class Leds(SigModule):
     """
     Arduino serial communications manager module.
     """
+    hot_config = {"log_level", "update_ms", "duration_multiplier", "values"}
 
     def __init__(self, name: str, config: dict, *args, **kwargs) -> None:
         super().__init__(name, config, *args, **kwargs)
@@ -36,10 +38,10 @@ class Leds(SigModule):
         Called by the module's `initialise()` method to return a
         module-specific object.
         """
-        self.process = LedsProcess(self)
+        self.process = self.hosted(LedsProcess)(self)
 
 
-class LedsProcess(ModuleProcess, mp.Process):
+class LedsProcess(ModuleProcess):
     """
     Process to handle threaded duplex serial communication with the Arduino.
     """
@@ -54,9 +56,17 @@ class LedsProcess(ModuleProcess, mp.Process):
         self.update_ms = self.config.get("update_ms", 30)
         self.dur_multiplier = self.config.get("duration_multiplier", 3)
         self.rx_packet = ReceivePacket
+        for k, v in self.module_values["destinations"].items():
+            self.destinations[k] = LedValue(k, v, self)
+        if self.parent_pipe.writable:
+            self.parent_pipe.send("initialised")
 
+    def pre_run(self) -> bool:
+        """
+        Module-specific Process run preparation. The serial port is opened
+        here so only the LED process holds the connection and its libraries.
+        """
         time.sleep(0.5)
-
         if not self.open_connection(self.port):
             self.logger.error(f'Port [{self.port}] invalid. Trying backup '
                               f'port [{self.backup_port}]...'
@@ -64,18 +74,22 @@ class LedsProcess(ModuleProcess, mp.Process):
             if not self.open_connection(self.backup_port):
                 self.failed(f"Unable to open serial port. "
                             f"Terminating [{self.module_name}].")
-        else:
-            for k, v in self.module_values["destinations"].items():
-                self.destinations[k] = LedValue(k, v, self)
-            if self.parent_pipe.writable:
-                self.parent_pipe.send("initialised")
+                return False
+        self.start_time = time.time()
+        return True
 
-    def pre_run(self) -> bool:
+    def apply_hot_config(self, rules_config: dict):
         """
-        Module-specific Process run preparation.
+        Updates LED parameter ranges, defaults and durations without
+        reopening the serial connection.
         """
-        self.start_time = time.time()
-        return True
+        self.update_ms = self.config.get("update_ms", 30)
+        self.dur_multiplier = self.config.get("duration_multiplier", 3)
+        for k, v in self.module_values.get("destinations", {}).items():
+            if k in self.destinations:
+                self.destinations[k].update_config(v, self)
+            else:
+                self.destinations[k] = LedValue(k, v, self)
 
     def mid_run(self):
         """
@@ -108,8 +122,18 @@ class LedsProcess(ModuleProcess, mp.Process):
                         self.logger.error(f'Arduino: STOP_BYTE_ERROR')
                     else:
                         self.logger.error(f'{self.link.status}')
-        except SerialException as exception:
+        except serial.SerialException as exception:
             self.failed(exception)
+        # Arduino sends a ready packet every loop, this is only a fallback timeout
+        return self.update_ms / 1000
+
+    def wait_objects(self) -> list:
+        """
+        Wakes the LED process as soon as the Arduino sends serial data.
+        """
+        if self.link is not None and self.link.connection.is_open:
+            return super().wait_objects() + [self.link.connection]
+        return super().wait_objects()
 
     def process_packet(self):
         """
@@ -160,7 +184,9 @@ class LedsProcess(ModuleProcess, mp.Process):
         and returns `True`.
         """
         try:
-            self.link = Arduino.SerialTransfer(port, baud=self.baud)
+            # The simulated Arduino is a pseudo-terminal, which is not listed as a serial port
+            options = {"restrict_ports": False} if self.simulate else {}
+            self.link = Arduino.SerialTransfer(port, baud=self.baud, **options)
             self.link.open()
             self.logger.debug(f"Arduino serial connection opened.")
             return True
@@ -202,14 +228,33 @@ class LedValue:
         self.duration = parent.update_ms * parent.dur_multiplier
         self.packet = SendPacket(self.command, self.default, self.duration)
         self.metrics_pusher = parent.metrics_pusher
+        self.latency = parent.latency
         self.updated = True
         self.confirmed = False
+        # Latency traces of the pending value and the last sent packet
+        self.trace = None
+        self.sent_trace = None
 
     def __repr__(self) -> str:
         return (
             f'{self.packet}'
         )
 
+    def update_config(self, config: dict, parent: LedsProcess):
+        """
+        Applies an updated parameter config, rescaling the current value.
+        The Arduino receives the new packet on its next ready signal.
+        """
+        value = scale(self.packet.value, (self.min, self.max), (0, 1), "clamp")
+        self.command = config["command"]
+        self.min = config.get("min", 0)
+        self.max = config.get("max", 255)
+        self.default = config.get("default", 0)
+        self.duration = parent.update_ms * parent.dur_multiplier
+        value = int(scale(value, (0, 1), (self.min, self.max), "clamp"))
+        self.packet = SendPacket(self.command, value, self.duration)
+        self.updated = True
+
     def set_default(self):
         self.packet = SendPacket(self.command, self.default, self.duration)
         self.updated = True
@@ -224,6 +269,11 @@ class LedValue:
         if value != self.packet.value:
                 self.packet = SendPacket(self.command, value, duration)
                 self.updated = True
+                self.trace = None
+                if (trace := kwargs.get("trace")) is not None:
+                    received_time = time.monotonic()
+                    self.latency.observe("to_leds", received_time - trace[2])
+                    self.trace = (trace[0], trace[1], received_time)
         
     def send(self, send_function, *args) -> bool:
         """
@@ -238,14 +288,28 @@ class LedValue:
                 self.metrics_pusher.update(self.name, self.packet.value)
                 self.updated = False
                 self.confirmed = False
+                if self.trace is not None:
+                    sent_time = time.monotonic()
+                    self.latency.observe("leds_queue", sent_time - self.trace[2])
+                    self.sent_trace = (self.trace[0], self.trace[1], sent_time)
+                    self.trace = None
                 return True
         return False
 
     def confirm(self, rx):
+        """
+        Marks the sent packet as confirmed if the Arduino's acknowledgement
+        matches it, completing the latency trace of the packet's value.
+        """
         if (self.command == rx.command.decode("utf-8") and
                 self.packet.value == rx.valA and self.packet.duration == rx.valB):
             self.confirmed = True
             self.metrics_pusher.update(self.name, self.packet.value)
+            if self.sent_trace is not None:
+                confirm_time = time.monotonic()
+                self.latency.observe("serial_ack", confirm_time - self.sent_trace[2])
+                self.latency.observe("total", confirm_time - self.sent_trace[1])
+                self.sent_trace = None
         return None
         
 
@@ -0,0 +1,179 @@
+#  .____                    .___
+#  |    |    ____  __ __  __| _/____   ____   ______ ______
+#  |    |   /  _ \|  |  \/ __ |/    \_/ __ \ /  ___//  ___/
+#  |    |__(  <_> )  |  / /_/ |   |  \  ___/ \___ \ \___ \
+#  |_______ \____/|____/\____ |___|  /\___  >____  >____  >
+#          \/                \/    \/     \/     \/     \/
+
+"""
+Short and long-term loudness of the audio input, as the RMS level, the
+loudest period's level and a percentile of period levels over each of a
+list of time scales, such as 100 ms, 1 s, 10 s and 60 s.
+
+Time scales are a cascade of rings. The shortest scale keeps the levels of
+its latest periods, and each longer scale keeps the totals of the latest
+completed windows of the scale below, so no raw history is stored and no
+window is rescanned. Percentiles come from histograms of period levels in
+fixed decibel bins, kept as running sums like the mean squares.
+"""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+from src.utils import SigLog
+from src.spectrum import FULL_SCALE
+
+logger = SigLog.get_logger('Sig.Loudness', level='INFO')
+
+DEFAULT_SCALES_SECS = [0.1, 1, 10, 60]
+DEFAULT_PERCENTILE = 90
+# Range and resolution in dB relative to full scale of the level histograms
+FLOOR_DB = -72
+BIN_DB = 0.5
+BINS = int(-FLOOR_DB / BIN_DB)
+EPSILON = 1e-12
+# Share of a time scale its realised span may differ by before warning
+SPAN_TOLERANCE = 0.05
+
+
+def scale_label(secs: float) -> str:
+    """
+    Returns the name suffix of a time scale, such as `100ms` or `10s`.
+    """
+    if secs < 1:
+        return f"{secs * 1000:g}ms"
+    return f"{secs:g}s"
+
+
+class LoudnessLevel:
+    """
+    Ring of the latest `size` windows of the time scale below, with running
+    totals of their summed mean squares, period counts and level histograms.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.sums = np.zeros(size)
+        self.counts = np.zeros(size)
+        self.peaks = np.zeros(size)
+        self.hists = np.zeros((size, BINS))
+        self.hist = np.zeros(BINS)
+        self.cumulative = np.zeros(BINS)
+        self.sum = 0.0
+        self.count = 0.0
+        self.pos = 0
+
+    def add(self, total: float, count: float, peak: float, hist: np.ndarray) -> bool:
+        """
+        Replaces the oldest window with a new one, returning `True` when
+        the ring holds `size` windows added since the last time it did.
+        """
+        pos = self.pos
+        self.sum += total - self.sums[pos]
+        self.count += count - self.counts[pos]
+        self.sums[pos] = total
+        self.counts[pos] = count
+        self.peaks[pos] = peak
+        self.hist -= self.hists[pos]
+        self.hist += hist
+        self.hists[pos] = hist
+        self.pos = (pos + 1) % self.size
+        if self.pos:
+            return False
+        # Drops the rounding errors of the running sum once per cycle
+        self.sum = self.sums.sum()
+        return True
+
+
+class Loudness:
+    """
+    Computes the RMS level, loudest period level and `percentile` level of
+    a stream of audio periods, at `frame_rate` periods per second, over
+    each time scale in `scales_secs`. `process()` returns the values of
+    every scale in the order of `names`.\n
+    Levels are the RMS amplitude relative to full scale, matching the
+    levels of `src.spectrum.Spectrum`. The shortest scale is updated every
+    period, and each longer scale every time a window of the scale below
+    completes, so a 60 s scale above a 10 s scale moves every 10 seconds.
+    `updated` holds the number of scales updated by the latest period,
+    shortest first.\n
+    Each scale covers a whole number of windows of the scale below, sized
+    from the realised span below rather than the configured one, and the
+    shortest a whole number of periods. Realised spans in seconds are kept
+    in `spans`, and a warning is logged for any more than `SPAN_TOLERANCE`
+    from its configured scale, beyond the half period lost to rounding.
+    """
+
+    def __init__(self, frame_rate: float, scales_secs=DEFAULT_SCALES_SECS,
+                 percentile=DEFAULT_PERCENTILE) -> None:
+        if not scales_secs:
+            raise ValueError('Loudness needs at least one time scale')
+        if any(low >= high for low, high in zip(scales_secs, scales_secs[1:])) or scales_secs[0] <= 0:
+            raise ValueError(f'Loudness time scales must be positive and ascending: {scales_secs}')
+        if not 0 < percentile < 100:
+            raise ValueError(f'Loudness percentile ({percentile}) must be between 0 and 100')
+        self.quantile = percentile / 100
+        self.names = [f"{stat}_{scale_label(secs)}" for secs in scales_secs
+                      for stat in ("rms", "max", f"p{percentile:g}")]
+        self.levels = []
+        self.spans = []
+        span = 1 / frame_rate
+        for secs in scales_secs:
+            size = max(1, round(secs / span))
+            span *= size
+            self.levels.append(LoudnessLevel(size))
+            self.spans.append(span)
+            if abs(span - secs) > max(SPAN_TOLERANCE * secs, 0.5 / frame_rate):
+                logger.warning(f'Loudness scale of ({secs:g}s) covers ({span:.3g}s), '
+                               f'as ({size}) windows of the scale below.')
+        self.values = np.zeros(len(self.names))
+        self.updated = 0
+        # Centre of each histogram bin as an RMS level
+        self.bin_levels = 10 ** ((FLOOR_DB + BIN_DB * (np.arange(BINS) + 0.5)) / 20)
+        self.samples = np.zeros(0)
+        self.period_hist = np.zeros(BINS)
+        self.period_bin = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Adds a period of samples and returns the levels of every time
+        scale, of which the first `updated` have changed. The returned
+        array is reused by the next call.
+        """
+        n = len(samples)
+        self.updated = 0
+        if n == 0:
+            return self.values
+        if len(self.samples) < n:
+            self.samples = np.zeros(n)
+        period = self.samples[:n]
+        np.copyto(period, samples)
+        mean_square = float(np.dot(period, period)) / (n * FULL_SCALE ** 2)
+        db = 10 * math.log10(mean_square + EPSILON)
+        self.period_hist[self.period_bin] = 0
+        self.period_bin = min(BINS - 1, max(0, int((db - FLOOR_DB) / BIN_DB)))
+        self.period_hist[self.period_bin] = 1
+        total, count, peak, hist = mean_square, 1.0, mean_square, self.period_hist
+        for index, level in enumerate(self.levels):
+            complete = level.add(total, count, peak, hist)
+            self.publish(index, level)
+            self.updated += 1
+            if not complete:
+                break
+            total, count, peak, hist = level.sum, level.count, level.peaks.max(), level.hist
+        return self.values
+
+    def publish(self, index: int, level: LoudnessLevel):
+        """
+        Sets the values of a time scale from its running totals.
+        """
+        np.cumsum(level.hist, out=level.cumulative)
+        loudest = math.sqrt(level.peaks.max())
+        rank = int(np.searchsorted(level.cumulative, self.quantile * level.count))
+        values = self.values[index * 3:index * 3 + 3]
+        values[0] = math.sqrt(level.sum / level.count)
+        values[1] = loudest
+        values[2] = min(loudest, self.bin_levels[min(rank, BINS - 1)])
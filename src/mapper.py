@@ -11,14 +11,26 @@ Processes module source values and sends them to module destination parameters.
 
 from __future__ import annotations
 
+import os
 import time
 
-import multiprocessing as mp
-
-from src.utils import scale
-from src.utils import SmoothedValue
+from src.utils import SigLog
+from src.utils import Ticker
+from src.ruleset import RuleSet
+from src.histogram import Histogram
+from src.mappershard import MapperShard
+from src.mappershard import partition_rules
+from src.recording import SourceReplay
+from src.recording import SourceRecorder
+from src.recording import REPLAY_FINISHED
 from src.sigmodule import SigModule
 from src.sigprocess import ModuleProcess
+from src.valueids import TRACE_KEY
+
+
+# Most mapping ticks run per loop iteration while replaying a recording
+REPLAY_BATCH_TICKS = 500
+DEFAULT_PERIOD_MS = 10
 
 
 class Mapper(SigModule):
@@ -27,11 +39,11 @@ class Mapper(SigModule):
     Multi-threaded value mapping module for processing output values from
     modules and assigning the values to input parameters of other modules.
     """
+    hot_config = {"log_level", "rules", "period_ms", "recording"}
 
     def __init__(self, name: str, config: dict, *args, **kwargs) -> None:
         super().__init__(name, config, *args, **kwargs)
         self.pipes = kwargs.get("pipes")
-        self.period = kwargs.get("period", 10) / 1000
 
 
     def create_process(self):
@@ -39,10 +51,10 @@ class Mapper(SigModule):
         Called by the module's `initialise()` method to return a
         module-specific object.
         """
-        self.process =  MapperProcess(self)
+        self.process = self.hosted(MapperProcess)(self)
 
 
-class MapperProcess(ModuleProcess, mp.Process):
+class MapperProcess(ModuleProcess):
     """
     Perform audio analysis on an input device.
     """
@@ -51,10 +63,27 @@ class MapperProcess(ModuleProcess, mp.Process):
         super().__init__(parent)
         # Mapping
         self.sources = {}
+        self.source_reader = None
+        self.pending_traces = {}
         self.pipes = parent.pipes
-        self.rules = parent.rules_config.get("mapper")
-        self.period = parent.period
-        self.last_output_time = 0
+        self.rules = parent.rules_config.get("mapper", [])
+        self.rule_set = None
+        self.ticker = None
+        # Source recording, or replay of a recording with `signifier.py --replay`
+        self.recorder = None
+        self.recording = {}
+        self.replay_settings = parent.main_config["general"].get("replay") or {}
+        self.replay = None
+        self.replay_ticks = 0
+        self.replay_secs = 0
+        # Rules partitioned by destination module across worker processes, except
+        # while replaying a recording
+        self.shard_count = 1 if self.replay_settings else max(1, self.config.get("shards", 1))
+        self.shards = []
+        self.shard_sources = []
+        self.shard_stats = {}
+        self.tick_time = Histogram()
+        self.shard_stats_time = time.monotonic()
         if self.parent_pipe.writable:
             self.parent_pipe.send("initialised")
 
@@ -62,73 +91,320 @@ class MapperProcess(ModuleProcess, mp.Process):
         """
         Module-specific Process run preparation.
         """
-        self.prev_dest_values = dict.fromkeys(self.pipes, {})
-        self.new_destinations = dict.fromkeys(self.pipes, {})
-        self.last_output_time = time.time()
+        self.new_destinations = {module: {} for module in self.pipes}
+        self.ticker = Ticker(self.tick_period(DEFAULT_PERIOD_MS / 1000))
+        self.last_tick = None
+        try:
+            rule_sets = self.partition(self.rules, self.ticker.period)
+        except ValueError as exception:
+            self.failed(exception)
+            return False
+        self.rule_set = rule_sets[0]
+        if len(rule_sets) > 1:
+            self.logger.info(f"Mapping rules split across ({len(rule_sets)}) shards: "
+                             f"{[len(rule_set) for rule_set in rule_sets]}")
+        for i, rule_set in enumerate(rule_sets[1:], 1):
+            shard = MapperShard(i, rule_set.rules, self.ticker.period, list(self.pipes),
+                                self.value_ids, self.value_bus, self.stats_period)
+            shard.start()
+            self.shards.append(shard)
+        if self.value_bus is not None:
+            self.source_reader = self.value_bus.reader(
+                [name for module in self.pipes
+                 for name in self.value_bus.sources.get(module, [])])
+        if self.replay_settings:
+            self.replay = SourceReplay(self.replay_settings["path"],
+                                       self.replay_settings.get("speed", 1))
+        else:
+            self.set_recording(self.config.get("recording") or {})
         return True
 
+    def tick_period(self, fallback: float) -> float:
+        """
+        Returns the `period_ms` config in seconds, or logs an error and
+        returns `fallback` if it is not a positive number, which would make
+        the mapper tick on every loop iteration.
+        """
+        period_ms = self.config.get("period_ms", DEFAULT_PERIOD_MS)
+        if isinstance(period_ms, bool) or not isinstance(period_ms, (int, float)) or period_ms <= 0:
+            self.logger.error(f"Mapping period_ms must be a positive number, not ({period_ms}). "
+                              f"Using {fallback * 1000:g}ms.")
+            return fallback
+        return period_ms / 1000
+
+    def partition(self, rules: list, period: float) -> list:
+        """
+        Returns a compiled rule set for each shard, the first evaluated by
+        the mapper itself, and records the sources each worker shard needs.
+        Raises `ValueError` if any rule is invalid.
+        """
+        rule_sets = [RuleSet(part, period) for part in partition_rules(rules, self.shard_count)]
+        self.shard_sources = [set(rule_set.source_slots) for rule_set in rule_sets[1:]]
+        return rule_sets
+
+    def set_recording(self, settings: dict):
+        """
+        Starts, stops or restarts recording source values to apply changed
+        recording settings.
+        """
+        if settings == self.recording:
+            return
+        self.recording = settings
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+        if settings.get("enabled", False):
+            path = os.path.join(SigLog.LOG_PATH, settings.get("path", "recordings"))
+            try:
+                self.recorder = SourceRecorder(path, settings.get("segment_kb", 4096),
+                                               settings.get("max_segments", 16))
+                self.logger.info(f"Recording source values to [{path}].")
+            except OSError as exception:
+                self.logger.error(f"Could not record source values: {exception}")
+
+    def apply_hot_config(self, rules_config: dict):
+        """
+        Replaces the mapping rules and period without restarting the
+        process. Current source and destination values carry over to the
+        new rules, so smoothing and output limits continue from the last
+        output.
+        """
+        period = self.tick_period(DEFAULT_PERIOD_MS / 1000 if self.ticker is None
+                                  else self.ticker.period)
+        if self.ticker is not None:
+            self.ticker.set_period(period)
+        if self.replay is None:
+            self.set_recording(self.config.get("recording") or {})
+        try:
+            rule_sets = self.partition(rules_config.get("mapper", []), period)
+        except ValueError as exception:
+            self.logger.error(f"Keeping current mapping rules: {exception}")
+            return
+        # Shards are also sent the current values of their sources, as rules
+        # may have moved to them from other shards
+        for shard, shard_rule_set, names in zip(self.shards, rule_sets[1:], self.shard_sources):
+            shard.pipe.send(("rules", shard_rule_set.rules, period))
+            shard.pipe.send(("sources", self.value_ids.pack(
+                {k: v for k, v in self.sources.items() if k in names})))
+        rule_set = rule_sets[0]
+        rule_set.update_sources(self.sources)
+        if self.rule_set is not None:
+            rule_set.carry_state(self.rule_set)
+        self.rules = rules_config.get("mapper", [])
+        self.rule_set = rule_set
+        self.logger.debug(f"Applied ({len(self.rules)}) updated mapping rules.")
+
     def mid_run(self):
         """
         Module-specific Process run commands. Where the bulk of the module's
         computation occurs.
         """
         self.gather_source_values()
-        self.process_mappings()
-        # Send destinations through pipes and clear sent modules if successful
+        if self.replay is not None:
+            self.replay_mappings()
+        else:
+            self.process_mappings()
+        if self.shards:
+            self.gather_shard_outputs()
+        # Send destinations via the value bus or pipes and clear sent modules if successful
+        start = time.perf_counter()
         for module, destinations in self.new_destinations.items():
             if destinations is not None and destinations != {}:
+                self.stamp_traces(destinations)
+                if self.value_bus is not None:
+                    destinations = self.value_bus.write_destinations(destinations)
+                    self.new_destinations[module] = destinations
+                    if destinations == {}:
+                        continue
                 if self.pipes[module].writable:
-                    self.pipes[module].send(destinations)
+                    self.pipes[module].send(self.value_ids.pack_outputs(destinations))
                     self.new_destinations[module] = {}
+        self.observe_timing("ipc_send", start)
+        self.push_shard_stats()
+        if self.replay is not None:
+            return self.replay_delay()
+        return self.ticker.remaining()
+
+    def wait_objects(self) -> list:
+        """
+        Wakes the mapper as soon as any module sends new source values, or
+        any shard returns destinations.
+        """
+        return (super().wait_objects() + list(self.pipes.values())
+                + [shard.pipe for shard in self.shards])
 
     def gather_source_values(self):
         """
-        Gathers source value updates from each value pipe.
+        Gathers source value updates from the value bus and each value pipe.
         """
+        start = time.perf_counter()
+        traces = {}
+        updates = {}
+        if self.source_reader is not None:
+            updates = self.source_reader.poll()
+            self.sources.update(updates)
+            traces.update(self.source_reader.traces)
+            self.source_reader.traces = {}
+        pipe_updates = {}
         for pipe in self.pipes.values():
             if pipe.poll():
-                new_sources = pipe.recv()
+                new_sources = self.value_ids.unpack(pipe.recv())
+                traces.update(new_sources.pop(TRACE_KEY, {}))
                 for k, v in new_sources.items():
                     self.sources[k] = v
+                pipe_updates.update(new_sources)
+        updates.update(pipe_updates)
+        self.observe_timing("ipc_recv", start)
+        # Live values are discarded while replaying a recording
+        if self.replay is not None:
+            return
+        self.rule_set.update_sources(updates)
+        # Restamp traces with the time the mapper received them
+        gathered_time = time.monotonic()
+        if self.recorder is not None and updates:
+            self.recorder.write(updates, gathered_time)
+        for name, (trace_id, origin, sent_time) in traces.items():
+            self.latency.observe("to_mapper", gathered_time - sent_time)
+            self.pending_traces[name] = (trace_id, origin, gathered_time)
+        # Shards read the value bus themselves, but need sources sent over pipes
+        if self.shards and pipe_updates:
+            for shard, names in zip(self.shards, self.shard_sources):
+                if shard_updates := {k: v for k, v in pipe_updates.items() if k in names}:
+                    shard.pipe.send(("sources", self.value_ids.pack(shard_updates, {
+                        k: v for k, v in self.pending_traces.items() if k in shard_updates})))
+
+    def gather_shard_outputs(self):
+        """
+        Adds destinations returned by the shards to those the mapper sends
+        through the module pipes, and stores the shards' statistics.
+        """
+        for shard in self.shards:
+            while shard.pipe.poll():
+                message = shard.pipe.recv()
+                if message[0] == "destinations":
+                    for module, outputs in message[1].items():
+                        self.new_destinations[module].update(
+                            self.value_ids.unpack_outputs(outputs))
+                elif message[0] == "stats":
+                    self.shard_stats[shard.index] = message[1]
+                    for hop, seconds in message[1]["latency"]:
+                        self.latency.observe(hop, seconds)
+
+    def push_shard_stats(self):
+        """
+        Pushes each shard's tick time histogram every `loop_stats_secs`,
+        with shard 0 being the mapper itself, and fails the mapper if a
+        shard has exited.
+        """
+        if time.monotonic() < self.shard_stats_time + self.stats_period:
+            return
+        self.shard_stats_time = time.monotonic()
+        self.metrics_pusher.update(
+            f"{self.module_name}_shard0_tick_seconds", self.tick_time.snapshot())
+        for index, stats in self.shard_stats.items():
+            self.metrics_pusher.update(
+                f"{self.module_name}_shard{index}_tick_seconds", stats["tick_seconds"])
+        for shard in self.shards:
+            if not shard.is_alive():
+                self.failed(f"Mapper shard ({shard.index}) exited unexpectedly.")
+                return
+
+    def stamp_traces(self, destinations: dict):
+        """
+        Records the time traced destinations spent in the mapper and restamps
+        their traces with the time they are sent.
+        """
+        sent_time = time.monotonic()
+        for output in destinations.values():
+            if (trace := output.get("trace")) is not None:
+                self.latency.observe("mapper", sent_time - trace[2])
+                output["trace"] = (trace[0], trace[1], sent_time)
 
     def process_mappings(self):
         """
-        Iterates over mapping rules, processing source values and sends the
-        result to via destination pipes to the target module.
-        """
-        if time.time() > self.last_output_time + self.period:
-            self.last_output_time = time.time()
-            for r in self.rules:
-                rule_source = r["source"]
-                rule_dest = r["destination"]
-                if (source_value := self.sources.get(rule_source["name"])) is not None:
-                    source_value = scale(
-                        source_value,
-                        rule_source.get("range", [0, 1]),
-                        rule_dest.get("range", [0, 1]),
-                        "clamp" if rule_source.get("clamp", False) else None,
-                        "invert" if rule_source.get("invert", False) else None
-                    )
-                    prev_value = self.prev_dest_values[rule_dest["module"]].get(
-                        rule_dest["name"]
-                    )
-                    if prev_value is not None and prev_value == source_value:
-                        continue
-                    if (
-                        prev_value is not None
-                        and (smoothing := rule_dest.get("smoothing")) is not None
-                    ):
-                        output_value = SmoothedValue(
-                            init=prev_value, amount=tuple(smoothing)
-                        ).update(source_value)
-                    else:
-                        output_value = source_value
-                    rule_output = {"value": output_value}
-                    if (duration := rule_dest.get("duration")) is not None:
-                        rule_output.update({"duration": duration})
-                    self.prev_dest_values[rule_dest["module"]].update(
-                        {rule_dest["name"]: output_value}
-                    )
-                    self.new_destinations[rule_dest["module"]].update(
-                        {rule_dest["name"]: rule_output}
-                    )
+        Runs a mapping tick each time the ticker is due, smoothing over the
+        real time since the previous tick.
+        """
+        if self.ticker.due():
+            self.metrics_pusher.update(f"{self.module_name}_ticks_late", self.ticker.late)
+            self.metrics_pusher.update(f"{self.module_name}_ticks_missed", self.ticker.missed)
+            # Smooth over the real time since the last tick, not the nominal period
+            now = time.monotonic()
+            dt = self.ticker.period if self.last_tick is None else now - self.last_tick
+            self.last_tick = now
+            self.map_tick(now, dt)
+
+    def map_tick(self, now: float, dt: float):
+        """
+        Evaluates the mapping rules with changed sources or unsettled smoothing
+        and queues changed outputs for their destination modules.
+        """
+        start = time.perf_counter()
+        changed, outputs = self.rule_set.evaluate(dt)
+        changed, outputs = self.rule_set.limit(changed, outputs, now)
+        self.rule_set.queue_outputs(changed, outputs, self.pending_traces, self.new_destinations)
+        self.pending_traces = {}
+        self.tick_time.observe(time.perf_counter() - start)
+        # Totals include the counts last reported by each shard
+        shards = self.shard_stats.values()
+        self.metrics_pusher.update(
+            f"{self.module_name}_rules_evaluated",
+            self.rule_set.evaluated + sum(s["rules_evaluated"] for s in shards))
+        self.metrics_pusher.update(
+            f"{self.module_name}_updates_sent",
+            self.rule_set.sent + sum(s["updates_sent"] for s in shards))
+        self.metrics_pusher.update(
+            f"{self.module_name}_updates_suppressed",
+            self.rule_set.suppressed + sum(s["updates_suppressed"] for s in shards))
+
+    def replay_mappings(self):
+        """
+        Runs mapping ticks over the recording being replayed until it reaches
+        the replay's target time, at most `REPLAY_BATCH_TICKS` per call so
+        control messages are still handled when replaying at maximum speed.
+        """
+        if self.replay.finished:
+            return
+        period = self.ticker.period
+        target = self.replay.target()
+        start = time.perf_counter()
+        for _ in range(REPLAY_BATCH_TICKS):
+            if self.replay.finished or self.replay.time + period > target:
+                break
+            updates = self.replay.advance(period)
+            self.sources.update(updates)
+            self.rule_set.update_sources(updates)
+            self.map_tick(self.replay.time, period)
+            self.replay_ticks += 1
+        self.replay_secs += time.perf_counter() - start
+        if self.replay.finished:
+            wall_secs = time.monotonic() - self.replay.wall_start
+            self.logger.info(
+                f"Replayed {self.replay.recorded_secs():.1f}s of recorded sources "
+                f"({self.replay.count} values) in {wall_secs:.1f}s: "
+                f"{self.replay_ticks} ticks at "
+                f"{self.replay_secs / max(1, self.replay_ticks) * 1e6:.1f}us per tick, "
+                f"{self.rule_set.sent} updates sent, {self.rule_set.suppressed} suppressed.")
+            if self.parent_pipe.writable:
+                self.parent_pipe.send(REPLAY_FINISHED)
+
+    def replay_delay(self) -> float:
+        """
+        Returns the seconds until the replay is due to run its next tick.
+        """
+        if self.replay.finished:
+            return 1
+        if self.replay.speed <= 0:
+            return 0
+        return max(0, (self.replay.time + self.ticker.period - self.replay.target())
+                   / self.replay.speed)
+
+    def pre_shutdown(self):
+        """
+        Module-specific Process shutdown preparation.
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+        for shard in self.shards:
+            shard.stop()
+        self.shards = []
@@ -0,0 +1,196 @@
+#     _____                                        _________.__                     .___
+#    /     \ _____  ______ ______   ___________   /   _____/|  |__ _____ _______  __| _/
+#   /  \ /  \\__  \ \____ \\____ \_/ __ \_  __ \  \_____  \ |  |  \\__  \\_  __ \/ __ |
+#  /    Y    \/ __ \|  |_> >  |_> >  ___/|  | \/  /        \|   Y  \/ __ \|  | \/ /_/ |
+#  \____|__  (____  /   __/|   __/ \___  >__|    /_______  /|___|  (____  /__|  \____ |
+#          \/     \/|__|   |__|        \/                \/      \/     \/           \/
+
+"""
+Worker processes evaluating a partition of the mapping rules, so a mapper
+with many rules can spread them across CPU cores.
+
+Rules are partitioned by destination module, so every rule writing a
+destination is evaluated in order by the same shard and keeps its
+smoothing and output limit state. Shards read their sources directly from
+the value bus, with sources sent over pipes forwarded by the mapper, and
+write their destinations to the value bus, returning any that have no
+slot to the mapper to send through the module pipes.
+"""
+
+from __future__ import annotations
+
+import time
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+from src.utils import SigLog
+from src.utils import Ticker
+from src.ruleset import RuleSet
+from src.histogram import Histogram
+from src.valueids import TRACE_KEY
+
+logger = SigLog.get_logger('Sig.MapperShard', level='INFO')
+
+# Seconds to wait for a shard to close before terminating it
+SHARD_JOIN_SECS = 1
+
+
+def partition_rules(rules: list, shards: int) -> list:
+    """
+    Splits rules into `shards` lists by destination module, keeping each
+    module's rules together and in order while balancing the rule counts.
+    """
+    by_module = {}
+    for rule in rules:
+        try:
+            module = rule["destination"]["module"]
+        except (KeyError, TypeError):
+            module = None
+        by_module.setdefault(module, []).append(rule)
+    parts = [[] for _ in range(max(1, shards))]
+    for module_rules in sorted(by_module.values(), key=len, reverse=True):
+        min(parts, key=len).extend(module_rules)
+    return parts
+
+
+class MapperShard(mp.Process):
+    """
+    Process evaluating one partition of the mapping rules on its own
+    ticker.\n
+    The mapper sends `("sources", payload)` with the value payload of
+    source values it received over pipes, `("rules", rules, period)` with
+    updated rules and `("close",)`. The shard sends back
+    `("destinations", {module: payload})` with output payloads of values
+    that could not be written to the value bus, and `("stats", stats)`
+    every `stats_period` seconds.
+    """
+
+    def __init__(self, index: int, rules: list, period: float, modules: list,
+                 value_ids, value_bus=None, stats_period=1) -> None:
+        super().__init__(name=f'mapper_shard{index}', daemon=True)
+        self.index = index
+        self.rules = rules
+        self.period = period
+        self.modules = modules
+        self.value_ids = value_ids
+        self.value_bus = value_bus
+        self.stats_period = stats_period
+        self.pipe, self.shard_pipe = mp.Pipe()
+
+    def source_reader(self, rule_set: RuleSet):
+        """
+        Returns a value bus reader for the shard's sources that have slots.
+        """
+        if self.value_bus is None:
+            return None
+        on_bus = {name for names in self.value_bus.sources.values() for name in names}
+        return self.value_bus.reader(sorted(set(rule_set.source_slots) & on_bus))
+
+    def run(self):
+        """
+        Runs the shard's mapping ticks until the mapper closes it.
+        """
+        rule_set = RuleSet(self.rules, self.period)
+        reader = self.source_reader(rule_set)
+        ticker = Ticker(self.period)
+        sources, traces = {}, {}
+        destinations = {module: {} for module in self.modules}
+        tick_time = Histogram()
+        latency = []
+        ticks, evaluated = 0, 0
+        last_tick = None
+        stats_time = time.monotonic()
+        while True:
+            wait([self.shard_pipe], ticker.remaining())
+            while self.shard_pipe.poll():
+                message = self.shard_pipe.recv()
+                if message[0] == "close":
+                    return
+                if message[0] == "sources":
+                    updates = self.value_ids.unpack(message[1])
+                    traces.update(updates.pop(TRACE_KEY, {}))
+                    sources.update(updates)
+                    rule_set.update_sources(updates)
+                elif message[0] == "rules":
+                    try:
+                        new_rule_set = RuleSet(message[1], message[2])
+                    except ValueError as exception:
+                        logger.error(f'Shard ({self.index}) keeping current rules: {exception}')
+                        continue
+                    new_rule_set.update_sources(sources)
+                    new_rule_set.carry_state(rule_set)
+                    rule_set = new_rule_set
+                    reader = self.source_reader(rule_set)
+                    ticker.set_period(message[2])
+            gathered_time = time.monotonic()
+            if reader is not None and len(updates := reader.poll()) > 0:
+                sources.update(updates)
+                rule_set.update_sources(updates)
+                for name, (trace_id, origin, sent_time) in reader.traces.items():
+                    latency.append(("to_mapper", gathered_time - sent_time))
+                    traces[name] = (trace_id, origin, gathered_time)
+                reader.traces = {}
+            if ticker.due():
+                start = time.perf_counter()
+                now = time.monotonic()
+                dt = ticker.period if last_tick is None else now - last_tick
+                last_tick = now
+                changed, outputs = rule_set.evaluate(dt)
+                changed, outputs = rule_set.limit(changed, outputs, now)
+                rule_set.queue_outputs(changed, outputs, traces, destinations)
+                traces = {}
+                self.send_destinations(destinations, latency)
+                tick_time.observe(time.perf_counter() - start)
+                ticks += 1
+                evaluated += rule_set.evaluated
+            if time.monotonic() > stats_time + self.stats_period:
+                stats_time = time.monotonic()
+                self.shard_pipe.send(("stats", {
+                    "tick_seconds": tick_time.snapshot(),
+                    "rules_evaluated": round(evaluated / max(1, ticks), 1),
+                    "updates_sent": rule_set.sent,
+                    "updates_suppressed": rule_set.suppressed,
+                    "latency": latency}))
+                latency = []
+                ticks, evaluated = 0, 0
+
+    def send_destinations(self, destinations: dict, latency: list):
+        """
+        Writes queued destinations to the value bus, sending any without a
+        slot to the mapper, and records the time traced values spent in
+        the shard. Traces of values sent to the mapper are left for it to
+        record.
+        """
+        sent_time = time.monotonic()
+        unsent = {}
+        for module, outputs in destinations.items():
+            written = False
+            for name, output in outputs.items():
+                trace = output.get("trace")
+                if trace is not None:
+                    trace = (trace[0], trace[1], sent_time)
+                if self.value_bus is not None and self.value_bus.write(
+                        name, output["value"], output.get("duration"), trace):
+                    written = True
+                    if trace is not None:
+                        latency.append(("mapper", sent_time - output["trace"][2]))
+                else:
+                    unsent.setdefault(module, {})[name] = output
+            if written:
+                self.value_bus.wake(module)
+            destinations[module] = {}
+        if unsent:
+            self.shard_pipe.send(("destinations", {
+                module: self.value_ids.pack_outputs(outputs) for module, outputs in unsent.items()}))
+
+    def stop(self):
+        """
+        Asks the shard to finish, terminating it if it does not.
+        """
+        try:
+            self.pipe.send(("close",))
+        except (OSError, ValueError):
+            pass
+        self.join(SHARD_JOIN_SECS)
+        if self.is_alive():
+            self.terminate()
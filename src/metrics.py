@@ -11,23 +11,32 @@ Gathers Signifier metrics and exports to Prometheus push gateway.
 
 from __future__ import annotations
 
+import os
 import time
+import json
 import socket
 from queue import Empty
 from urllib.error import URLError
-import multiprocessing as mp
-
-from prometheus_client import CollectorRegistry, Gauge, Info, push_to_gateway
 
+from src.utils import SigLog
+from src.utils import LazyModule
 from src.sigmodule import SigModule
 from src.sigprocess import ModuleProcess
 
 
+# Seconds between draining the metrics queue
+QUEUE_DRAIN_SECS = 0.05
+
+prometheus = LazyModule("prometheus_client")
+
+
 class Metrics(SigModule):
     """# Metrics
 
     Process to send metrics to the Prometheus push gateway.
     """
+    hot_config = {"log_level", "push_period", "timeout",
+                  "target_gateway", "job_name"}
 
     def __init__(self, name: str, config: dict, *args, **kwargs) -> None:
         super().__init__(name, config, *args, **kwargs)
@@ -37,10 +46,10 @@ class Metrics(SigModule):
         Called by the module's `initialise()` method to return a
         module-specific object.
         """
-        self.process = MetricsProcess(self)
+        self.process = self.hosted(MetricsProcess)(self)
 
 
-class MetricsProcess(ModuleProcess, mp.Process):
+class MetricsProcess(ModuleProcess):
     """
     Multiprocessing Process to compute and deliver Signifier
     metrics to the push gateway.
@@ -53,11 +62,23 @@ class MetricsProcess(ModuleProcess, mp.Process):
         self.push_period = self.config["push_period"]
         self.metrics_q = parent.metrics_q
         self.metrics_dict = {}
-        self.registry = CollectorRegistry()
-        self.build_metrics()
+        self.id_metrics = []
+        self.sender_names = {}
+        self.histograms = {}
+        self.registry = None
+        # Running totals and counts of numeric metrics for the simulation report
+        self.value_totals = {}
+        self.start_time = time.time()
         if self.parent_pipe.writable:
             self.parent_pipe.send("initialised")
 
+    def apply_hot_config(self, rules_config: dict):
+        """
+        Gateway settings are read from the config on each push, so only the
+        push period needs resetting.
+        """
+        self.push_period = self.config["push_period"]
+
     def pre_run(self):
         """
         Module-specific Process run preparation.
@@ -67,6 +88,9 @@ class MetricsProcess(ModuleProcess, mp.Process):
             self.failed("No metrics_q assigned to module!")
             return False
         else:
+            self.registry = prometheus.CollectorRegistry()
+            self.registry.register(HistogramCollector(self.histograms, self.hostname))
+            self.build_metrics()
             return True
 
     def mid_run(self):
@@ -78,37 +102,28 @@ class MetricsProcess(ModuleProcess, mp.Process):
         loop_time = time.time()
         while time.time() < loop_time + 0.1:
             try:
-                input_metric = self.metrics_q.get_nowait()
+                batch = self.metrics_q.get_nowait()
             except Empty:
                 break
-
-            if (metric := self.metrics_dict.get(input_metric[0])) is not None:
-                if "gauge" in metric.keys():
-                    metric["gauge"].labels(self.hostname).set(input_metric[1])
-                    continue
-                if "info" in metric.keys():
-                    metric["info"].info(
-                        {"instance": self.hostname, "value": input_metric[1]}
-                    )
-                    continue
-            else:
-                name = input_metric[0]
-                self.metrics_dict[name] = self.create_metric(
-                    name, {"type": "gauge"}
-                )
-                self.metrics_dict[name]["gauge"].labels(self.hostname).set(
-                    input_metric[1]
-                )
-            # TODO Add array metrics
+            if len(batch) == 2:
+                # Single `(name, value)` metrics put by modules in the supervisor
+                self.set_metric(*batch)
+                continue
+            sender, declared, values = batch
+            names = self.sender_names.setdefault(sender, {})
+            names.update(declared)
+            for i, value in values.items():
+                self.set_metric_id(i, value, names)
         # Push current registry values if enough time has lapsed
-        if time.time() > self.prev_push + self.push_period:
+        if not self.simulate and time.time() > self.prev_push + self.push_period:
             try:
-                push_to_gateway(
+                prometheus.push_to_gateway(
                     self.config["target_gateway"],
                     self.config["job_name"],
                     self.registry,
                     timeout=self.config["timeout"],
                 )
+                self.prev_push = time.time()
             except (ConnectionResetError, ConnectionRefusedError, URLError, socket.error) as exception:
                 self.increase_push_time()
                 self.logger.warning(
@@ -116,8 +131,40 @@ class MetricsProcess(ModuleProcess, mp.Process):
                     f"{exception}. Retry in {self.push_period}s."
                 )
                 self.prev_push = time.time()
-                return None
+                return QUEUE_DRAIN_SECS
         self.push_period = self.config["push_period"]
+        return QUEUE_DRAIN_SECS
+
+    def set_metric_id(self, i: int, value, names: dict):
+        """
+        Sets a metric from a batch by its registry ID, or by the name its
+        sender declared for its local ID.
+        """
+        if i < len(self.id_metrics):
+            self.set_metric(self.value_ids.names[i], value, self.id_metrics[i])
+        elif (name := names.get(i)) is not None:
+            self.set_metric(name, value)
+
+    def set_metric(self, name: str, value, metric: dict = None):
+        """
+        Sets the Prometheus metric of a value, creating a gauge for metrics
+        not in `values.json`. Histogram snapshots are stored for the
+        `HistogramCollector`.
+        """
+        if isinstance(value, dict) and "buckets" in value:
+            self.histograms[name] = value
+            return
+        if self.simulate and isinstance(value, (int, float)):
+            total = self.value_totals.setdefault(name, [0, 0])
+            total[0] += value
+            total[1] += 1
+        if metric is None and (metric := self.metrics_dict.get(name)) is None:
+            metric = self.metrics_dict[name] = self.create_metric(name, {"type": "gauge"})
+        if "gauge" in metric:
+            metric["instance"].set(value)
+        elif "info" in metric:
+            metric["info"].info({"instance": self.hostname, "value": value})
+        # TODO Add array metrics
 
     def build_metrics(self):
         """
@@ -133,6 +180,7 @@ class MetricsProcess(ModuleProcess, mp.Process):
             if dest_metrics != {}:
                 for name, metric in dest_metrics.items():
                     self.metrics_dict[name] = self.create_metric(name, metric)
+        self.id_metrics = [self.metrics_dict.get(name) for name in self.value_ids.names]
 
     def create_metric(self, name: str, metric: dict) -> dict:
         """
@@ -143,17 +191,17 @@ class MetricsProcess(ModuleProcess, mp.Process):
         if metric.get("enabled", True):
             if (metric_type := metric.get("type", "")) == "gauge":
                 new_metric = {
-                    "gauge": Gauge(
+                    "gauge": prometheus.Gauge(
                         f"sig_{name}",
                         metric.get("description", ""),
                         labelnames=["instance"],
                         registry=self.registry,
                     )
                 }
-                new_metric["gauge"].labels(self.hostname)
+                new_metric["instance"] = new_metric["gauge"].labels(self.hostname)
             elif metric_type == "info":
                 new_metric = {
-                    "info": Info(
+                    "info": prometheus.Info(
                         f"sig_{name}",
                         metric.get("description", ""),
                         registry=self.registry,
@@ -161,6 +209,25 @@ class MetricsProcess(ModuleProcess, mp.Process):
                 }
             return new_metric
 
+    def pre_shutdown(self):
+        """
+        Module-specific Process shutdown preparation. Simulation runs write
+        a report of the mean module stats and latency histograms to the
+        Signifier log path.
+        """
+        if self.simulate and self.registry is not None:
+            from src.simulation import build_report
+            from src.simulation import format_report
+            self.mid_run()
+            means = {k: round(total / count, 3) for k, (total, count) in self.value_totals.items()}
+            report = build_report(means, self.histograms, time.time() - self.start_time)
+            self.logger.info(f'\n{format_report(report)}')
+            path = os.path.join(SigLog.LOG_PATH, self.simulation.get(
+                "report_file", "simulation_report.json"))
+            with open(path, 'w', encoding='utf8') as file:
+                json.dump(report, file, indent=4)
+            self.logger.info(f'Simulation report written to [{path}].')
+
     def increase_push_time(self):
         """
         Increases duration between push attempts if the gateway
@@ -171,6 +238,32 @@ class MetricsProcess(ModuleProcess, mp.Process):
             self.push_period = 30
 
 
+class HistogramCollector:
+    """
+    Custom Prometheus collector exporting the latest histogram snapshots
+    received from module processes, such as their loop timing histograms.
+    """
+
+    def __init__(self, histograms: dict, hostname: str) -> None:
+        self.histograms = histograms
+        self.hostname = hostname
+
+    def collect(self):
+        """
+        Yields a Prometheus histogram family for each received snapshot.
+        """
+        for name, snapshot in self.histograms.items():
+            family = prometheus.metrics_core.HistogramMetricFamily(
+                f"sig_{name}", f"Histogram of {name.replace('_', ' ')}",
+                labels=["instance"])
+            family.add_metric(
+                [self.hostname],
+                [("+Inf" if bound == float("inf") else str(bound), count)
+                 for bound, count in snapshot["buckets"]],
+                snapshot["sum"])
+            yield family
+
+
 # class ArrayMetric:
 #     """
 #     Object class to handle arrays of Prometheus metrics.
@@ -11,24 +11,38 @@ Provides module Process' a controlled method to push metrics to the gateway.
 import time
 from queue import Full
 
+# Seconds between redeclaring every local metric ID, so a restarted metrics
+# process learns the names of metrics that are not in `values.json`
+REDECLARE_SECS = 10
+
 
 class MetricsPusher:
     """
     Object for managing module-wide metrics updates to Prometheus push gateway.
     """
 
-    def __init__(self, metrics_q, period=0.1) -> None:
+    def __init__(self, metrics_q, value_ids, sender: str, period=0.1) -> None:
         """
         MetricsPusher is initialised with the metrics queue pointing to the
-        metrics module for collating updated metrics.
+        metrics module for collating updated metrics, the `ValueIds`
+        registry and a `sender` name unique to the pushing module.
 
-        Use `period=(float)` to define minimum second between pushes.
+        Use `period=(float)` to define minimum second between pushes.\n
+        Metrics are queued as `(sender, declared, {id: value})` batches.
+        Metrics in `values.json` use their registry ID, while other metrics
+        are given local IDs following the registry's, declared as
+        `{id: name}` in the first batch to use them.
         """
         self.metrics_q = metrics_q
+        self.value_ids = value_ids
+        self.sender = sender
         self.last_values = {}
         self.new_values = {}
         self.period = period
         self.prev_push_time = time.time()
+        self.local_ids = {}
+        self.declared = {}
+        self.declare_time = time.monotonic()
 
     def update_dict(self, dict):
         """
@@ -47,22 +61,35 @@ class MetricsPusher:
             self.new_values[name] = value
             self.last_values[name] = value
 
+    def metric_id(self, name: str) -> int:
+        """
+        Returns the registry ID of a metric, or a local ID for metrics that
+        are not in `values.json`.
+        """
+        if (i := self.value_ids.ids.get(name)) is not None:
+            return i
+        if (i := self.local_ids.get(name)) is None:
+            i = self.local_ids[name] = len(self.value_ids) + len(self.local_ids)
+            self.declared[i] = name
+        return i
+
     def queue(self):
         """
         Position the latest dictionary of data in the metrics push gateway
-        queue. Each dictionary item is unpacked, sent to the metrics queue.
-        Sent metrics are removed from the `new_values` dictionary, leaving
-        metrics unable to be sent due to a full queue to be sent in the
-        next queue attempt.
+        queue as a single batch. Sent metrics are removed from the
+        `new_values` dictionary, while a full queue leaves them to be sent
+        in the next queue attempt.
         """
-        if self.metrics_q is not None:
-            if self.new_values is not None or self.new_values != {}:
-                if self.period == 0 or time.time() > self.prev_push_time + self.period:
-                    if len(self.new_values) != 0:
-                        for k in list(self.new_values):
-                            try:
-                                self.metrics_q.put_nowait((k, self.new_values.pop(k)))
-
-                            except Full:
-                                pass
-                        self.prev_push_time = time.time()
+        if self.metrics_q is not None and self.new_values:
+            if self.period == 0 or time.time() > self.prev_push_time + self.period:
+                if time.monotonic() > self.declare_time + REDECLARE_SECS:
+                    self.declare_time = time.monotonic()
+                    self.declared = {i: name for name, i in self.local_ids.items()}
+                batch = {self.metric_id(name): value for name, value in self.new_values.items()}
+                try:
+                    self.metrics_q.put_nowait((self.sender, self.declared, batch))
+                except Full:
+                    return
+                self.new_values = {}
+                self.declared = {}
+                self.prev_push_time = time.time()
@@ -0,0 +1,248 @@
+#  __________                              .___.__
+#  \______   \ ____   ____  ___________  __| _/|__| ____    ____
+#   |       _// __ \_/ ___\/  _ \_  __ \/ __ | |  |/    \  / ___\
+#   |    |   \  ___/\  \__(  <_> )  | \/ /_/ | |  |   |  \/ /_/  >
+#   |____|_  /\___  >\___  >____/|__|  \____ | |__|___|  /\___  /
+#          \/     \/     \/                 \/         \//_____/
+
+"""
+Records the source values received by the mapper to a compact binary log,
+and replays recorded logs back into the mapper without the sensor modules.
+
+A recording is a directory of numbered segment files, each starting with
+`MAGIC` and holding a sequence of records. Name records assign a source
+name an ID for the rest of the segment, and value records hold an ID, the
+monotonic time the mapper received the value and the value itself. Segments
+are closed once they reach their size limit, and the oldest segments are
+deleted to keep the recording within its maximum number of segments.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import struct
+
+from src.utils import SigLog
+
+logger = SigLog.get_logger('Sig.Recording', level='INFO')
+
+MAGIC = b'SIGREC1\n'
+SEGMENT_PREFIX = 'sources-'
+SEGMENT_SUFFIX = '.rec'
+# Record type byte, followed by the name ID and either its encoded name's
+# length and bytes, or the received time and value
+NAME_RECORD = struct.Struct('<BHB')
+VALUE_RECORD = struct.Struct('<BHdd')
+NAME_TYPE, VALUE_TYPE = 1, 2
+# Seconds between flushes of buffered records to disk
+FLUSH_SECS = 1
+# Gaps between recorded values longer than this are skipped during replay
+REPLAY_GAP_SECS = 5
+# Message sent to the supervisor when a replay has finished
+REPLAY_FINISHED = 'replay finished'
+
+
+def segment_paths(path: str) -> list:
+    """
+    Returns the segment files of a recording in the order they were written,
+    or the file itself if `path` is a single segment.
+    """
+    if os.path.isfile(path):
+        return [path]
+    if not os.path.isdir(path):
+        return []
+    return sorted(os.path.join(path, file) for file in os.listdir(path)
+                  if file.startswith(SEGMENT_PREFIX) and file.endswith(SEGMENT_SUFFIX))
+
+
+class SourceRecorder:
+    """
+    Appends source value updates to the segments of a recording directory,
+    using at most `segment_kb * max_segments` kilobytes of disk.
+    """
+
+    def __init__(self, path: str, segment_kb=4096, max_segments=16) -> None:
+        self.path = path
+        self.segment_bytes = segment_kb * 1024
+        self.max_segments = max(1, max_segments)
+        os.makedirs(path, exist_ok=True)
+        existing = segment_paths(path)
+        self.index = 0 if not existing else int(
+            os.path.basename(existing[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1
+        self.file = None
+        self.names = {}
+        self.size = 0
+        self.flush_time = time.monotonic()
+        self.records = 0
+        self.open_segment()
+
+    def open_segment(self):
+        """
+        Closes the current segment, starts the next and removes the oldest
+        segments beyond the recording's limit.
+        """
+        if self.file is not None:
+            self.file.close()
+        segment = os.path.join(self.path, f'{SEGMENT_PREFIX}{self.index:06d}{SEGMENT_SUFFIX}')
+        self.index += 1
+        self.file = open(segment, 'wb')
+        self.file.write(MAGIC)
+        self.size = len(MAGIC)
+        self.names = {}
+        for old_segment in segment_paths(self.path)[:-self.max_segments]:
+            try:
+                os.remove(old_segment)
+            except OSError as exception:
+                logger.warning(f'Could not remove old recording segment: {exception}')
+
+    def write(self, values: dict, stamp: float):
+        """
+        Records each numeric value in `values` as received at monotonic time
+        `stamp`.
+        """
+        for name, value in values.items():
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                continue
+            if (name_id := self.names.get(name)) is None:
+                encoded = name.encode()[:255]
+                name_id = self.names[name] = len(self.names)
+                self.file.write(NAME_RECORD.pack(NAME_TYPE, name_id, len(encoded)) + encoded)
+                self.size += NAME_RECORD.size + len(encoded)
+            self.file.write(VALUE_RECORD.pack(VALUE_TYPE, name_id, stamp, value))
+            self.size += VALUE_RECORD.size
+            self.records += 1
+        if self.size >= self.segment_bytes:
+            self.open_segment()
+        elif stamp > self.flush_time + FLUSH_SECS:
+            self.flush_time = stamp
+            self.file.flush()
+
+    def close(self):
+        """
+        Flushes and closes the current segment.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_recording(path: str):
+    """
+    Yields the `(time, name, value)` records of a recording in order. Times
+    that go backwards, from recordings spanning restarts of the host, are
+    offset to continue from the previous record.
+    """
+    offset = 0
+    last_stamp = None
+    for segment in segment_paths(path):
+        with open(segment, 'rb') as file:
+            data = file.read()
+        if not data.startswith(MAGIC):
+            logger.warning(f'Skipping [{segment}], which is not a source recording.')
+            continue
+        names = {}
+        position = len(MAGIC)
+        while position < len(data):
+            record_type = data[position]
+            if record_type == VALUE_TYPE and position + VALUE_RECORD.size <= len(data):
+                _, name_id, stamp, value = VALUE_RECORD.unpack_from(data, position)
+                position += VALUE_RECORD.size
+                if last_stamp is not None and stamp + offset < last_stamp:
+                    offset = last_stamp - stamp
+                last_stamp = stamp + offset
+                if (name := names.get(name_id)) is not None:
+                    yield last_stamp, name, value
+            elif record_type == NAME_TYPE and position + NAME_RECORD.size <= len(data):
+                _, name_id, length = NAME_RECORD.unpack_from(data, position)
+                position += NAME_RECORD.size
+                names[name_id] = data[position:position + length].decode(errors='replace')
+                position += length
+            else:
+                # Truncated by a crash or power loss while writing
+                break
+
+
+class SourceReplay:
+    """
+    Feeds a recording back in recorded time, running `speed` times faster
+    than it was recorded, or as fast as possible if `speed` is 0.\n
+    `time` is the replay's position in recorded time, advanced by the
+    mapper one tick at a time with `advance()`.
+    """
+
+    def __init__(self, path: str, speed=1.0) -> None:
+        self.path = path
+        self.speed = speed
+        self.records = read_recording(path)
+        self.next_record = next(self.records, None)
+        self.time = 0 if self.next_record is None else self.next_record[0]
+        self.start_time = self.time
+        self.wall_start = time.monotonic()
+        self.count = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.next_record is None
+
+    def target(self) -> float:
+        """
+        Returns the recorded time the replay should have reached by now.
+        """
+        if self.speed <= 0:
+            return float('inf')
+        return self.start_time + (time.monotonic() - self.wall_start) * self.speed
+
+    def advance(self, period: float) -> dict:
+        """
+        Moves the replay on by `period` seconds, skipping long gaps between
+        recorded values, and returns the latest value of each source
+        recorded in that time.
+        """
+        if self.next_record is not None and self.next_record[0] - self.time > REPLAY_GAP_SECS:
+            skipped = self.next_record[0] - period - self.time
+            self.time += skipped
+            self.start_time += skipped
+        self.time += period
+        updates = {}
+        while self.next_record is not None and self.next_record[0] <= self.time:
+            updates[self.next_record[1]] = self.next_record[2]
+            self.count += 1
+            self.next_record = next(self.records, None)
+        return updates
+
+    def recorded_secs(self) -> float:
+        """
+        Returns the recorded time replayed so far, excluding skipped gaps.
+        """
+        return self.time - self.start_time
+
+
+class Replay:
+    """
+    Prepares the main Signifier process to replay a recording through the
+    mapper. The analysis and Bluetooth modules are disabled, and the mapper
+    replays the recording while `general.replay` is set.
+    """
+    sensor_modules = ('analysis', 'bluetooth')
+
+    def __init__(self, path: str, speed=1.0) -> None:
+        self.path = path
+        self.speed = speed
+        if not segment_paths(path):
+            raise FileNotFoundError(f'No source recording found at [{path}]')
+        logger.info(f'Replaying [{path}] at '
+                    f'{"maximum speed" if speed <= 0 else f"{speed}x speed"}.')
+
+    def apply(self, config: dict):
+        """
+        Applies the replay overrides to a loaded `config.json` dictionary.
+        """
+        config['general']['replay'] = {'path': self.path, 'speed': self.speed}
+        for settings in config.values():
+            if settings.get('module_type') in self.sensor_modules:
+                settings['enabled'] = False
+            elif settings.get('module_type') == 'mapper':
+                settings.setdefault('recording', {})['enabled'] = False
@@ -0,0 +1,51 @@
+#  __________              .__          __
+#  \______   \ ____   ____ |__| _______/  |________ ___.__.
+#   |       _// __ \ / ___\|  |/  ___/\   __\_  __ <   |  |
+#   |    |   \  ___// /_/  >  |\___ \  |  |  |  | \/\___  |
+#   |____|_  /\___  >___  /|__/____  > |__|  |__|   / ____|
+#          \/     \/_____/         \/               \/
+
+"""
+Resolves `module_type` names from config.json to Signifier module classes,
+importing each module file only when a module of that type is first created.
+"""
+
+from __future__ import annotations
+
+import time
+import importlib
+
+from src.utils import SigLog
+from src.utils import rss_mb
+
+logger = SigLog.get_logger('Sig.Registry', level='INFO')
+
+# Module type: (Python module path, class name)
+MODULE_TYPES = {
+    'leds': ('src.leds', 'Leds'),
+    'mapper': ('src.mapper', 'Mapper'),
+    'metrics': ('src.metrics', 'Metrics'),
+    'analysis': ('src.analysis', 'Analysis'),
+    'bluetooth': ('src.bluetooth', 'Bluetooth'),
+    'composition': ('src.composition', 'Composition')}
+
+loaded_types = {}
+
+
+def get_module_class(module_type: str):
+    """
+    Returns the module class registered for the supplied `module_type`,
+    importing it on first use. Returns `None` for unknown module types.
+    """
+    if (module_class := loaded_types.get(module_type)) is not None:
+        return module_class
+    if (entry := MODULE_TYPES.get(module_type)) is None:
+        return None
+    start_time = time.time()
+    start_rss = rss_mb()
+    module_class = getattr(importlib.import_module(entry[0]), entry[1])
+    loaded_types[module_type] = module_class
+    logger.info(f'Loaded [{module_type}] module type in '
+                f'{(time.time() - start_time) * 1000:.1f}ms '
+                f'(+{rss_mb() - start_rss:.1f}MB RSS).')
+    return module_class
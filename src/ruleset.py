@@ -0,0 +1,493 @@
+#  __________      .__             _________       __
+#  \______   \__ __|  |   ____    /   _____/ _____/  |_
+#   |       _/  |  \  | _/ __ \   \_____  \_/ __ \   __\
+#   |    |   \  |  /  |_\  ___/   /        \  ___/|  |
+#   |____|_  /____/|____/\___  > /_______  /\___  >__|
+#          \/                \/          \/     \/
+
+"""
+Compiles the mapper's `rules.json` rules into NumPy arrays, so the rules
+due each mapper tick are evaluated in a single vectorised pass.
+
+Destination smoothing is specified as attack and release time constants,
+`"smoothing": {"attack_ms": 15, "release_ms": 100}`, and applied using the
+real time between ticks. Legacy `[decay, rise]` per-tick factors are
+converted to the time constants that match them at the mapper's period.
+
+Destinations may also set a response `"curve"`, either a name or a dict
+such as `{"type": "gamma", "amount": 2.2}`, shaping the position within the
+source range before it is scaled to the destination range. Curves are
+sampled into lookup tables when rules are compiled and evaluated by linear
+interpolation, and keep outputs within the destination range.
+
+A rule's source may combine several sources instead of naming one, as
+`{"combine": "max", "inputs": [{"name": ..., "range": ...}, ...]}`. Each
+input is scaled to 0-1 within its range (and inverted if set), then the
+inputs are combined with `max`, `min`, `sum` (weighted by each input's
+`weight`), `product` or `crossfade` (the first input fading between the
+other two). Missing inputs are ignored by `max`, `min` and `product`, and
+count as 0 for `sum` and `crossfade`. The combined value is then mapped
+like any other source, using the combiner's own `range`, default 0-1.
+
+Destinations may limit their output with a `"deadband"`, either an absolute
+threshold or `{"absolute": ..., "relative": ...}`, below which changes from
+the last sent value are suppressed, and a `"max_rate"` in updates per
+second. Changes arriving faster are coalesced, and the latest value sent
+once the destination's interval has passed.
+"""
+
+from __future__ import annotations
+
+import json
+import numpy as np
+
+# Delta between smoothed and target values below which the output snaps to the target
+SMOOTHING_THRESHOLD = 9e-5
+# Number of samples in each response curve lookup table
+CURVE_POINTS = 257
+# Response curves over the range 0-1 with their default amounts
+CURVES = {
+    "linear": (lambda x, a: x, 1),
+    "exp": (lambda x, a: np.expm1(a * x) / np.expm1(a), 4),
+    "log": (lambda x, a: np.log1p(a * x) / np.log1p(a), 9),
+    "s_curve": (lambda x, a: 0.5 + np.tanh(a * (x - 0.5)) / (2 * np.tanh(a / 2)), 5),
+    "gamma": (lambda x, a: x ** a, 2.2),
+}
+# Operations combining multi-source rule inputs
+COMBINERS = ("max", "min", "sum", "product", "crossfade")
+
+
+def smoothing_rates(smoothing, period: float) -> tuple:
+    """
+    Returns the `(attack, release)` filter rates, the inverse of their time
+    constants in seconds, for a rule's smoothing setting. Legacy
+    `[decay, rise]` factors are applied once per `period` seconds.
+    """
+    if isinstance(smoothing, dict):
+        attack = smoothing.get("attack_ms", 0)
+        release = smoothing.get("release_ms", attack)
+        if attack < 0 or release < 0:
+            raise ValueError('smoothing times must not be negative')
+        return tuple(1000 / t if t > 0 else np.inf for t in (attack, release))
+    decay, rise = smoothing
+    if not (0 < decay < 1 and 0 < rise < 1):
+        raise ValueError('smoothing factors must be between 0 and 1')
+    return -np.log1p(-rise) / period, -np.log1p(-decay) / period
+
+
+def output_limits(dest: dict) -> tuple:
+    """
+    Returns the `(absolute, relative, interval)` deadband thresholds and
+    minimum seconds between updates of a destination's output limits.
+    """
+    deadband = dest.get("deadband", 0)
+    if not isinstance(deadband, dict):
+        deadband = {"absolute": deadband}
+    absolute, relative = deadband.get("absolute", 0), deadband.get("relative", 0)
+    max_rate = dest.get("max_rate")
+    if absolute < 0 or relative < 0 or (max_rate is not None and max_rate <= 0):
+        raise ValueError('deadband must not be negative and max_rate must be positive')
+    return absolute, relative, 0 if max_rate is None else 1 / max_rate
+
+
+def curve_table(curve) -> np.ndarray:
+    """
+    Returns the lookup table for a rule's curve setting, either a curve name
+    or a dict with a `type` and optional `amount`.
+    """
+    if isinstance(curve, str):
+        curve = {"type": curve}
+    if (curve_type := curve.get("type")) not in CURVES:
+        raise ValueError(f'unknown curve type "{curve_type}"')
+    function, amount = CURVES[curve_type]
+    amount = float(curve.get("amount", amount))
+    if amount <= 0:
+        raise ValueError('curve amount must be greater than 0')
+    with np.errstate(all="ignore"):
+        table = function(np.linspace(0, 1, CURVE_POINTS), amount)
+    if not np.all(np.isfinite(table)):
+        raise ValueError(f'curve {curve} is not finite')
+    return table
+
+
+class RuleSet:
+    """
+    Mapping rules compiled to arrays of source slots, ranges, flags,
+    smoothing rates and destination slots.\n
+    Source values are written into `source_values` with `update_sources()`,
+    which marks the rules reading any changed value as `dirty`. `evaluate()`
+    applies only dirty rules, keeping those still smoothing towards their
+    target dirty, and matches the results of scaling and smoothing every
+    rule in turn.
+    `dest_values` holds the filter state of each destination between ticks.
+    Rules sharing a destination are split into layers evaluated in rule
+    order, so later rules still see the output of earlier ones.
+    """
+
+    def __init__(self, rules: list, period=0.01) -> None:
+        self.rules = rules
+        self.period = period
+        self.source_slots = {}
+        self.dest_slots = {}
+        self.combiners = []
+        self.combiner_keys = {}
+        # Per-rule details needed to build destination messages
+        self.outputs = []
+        src_idx, dest_idx, ranges, flags, smoothing = [], [], [], [], []
+        curves, curve_keys, tables, limits = [], {}, [], []
+        for i, rule in enumerate(rules):
+            try:
+                source, dest = rule["source"], rule["destination"]
+                if "combine" in source:
+                    # Combined values are stored after the source slots, so
+                    # their slots are resolved once every source has one
+                    src_idx.append(-1 - self.add_combiner(source))
+                else:
+                    src_idx.append(self.source_slot(source["name"]))
+                dest_idx.append(self.dest_slots.setdefault(
+                    (dest["module"], dest["name"]), len(self.dest_slots)))
+                ranges.append([*source.get("range", [0, 1]), *dest.get("range", [0, 1])])
+                flags.append([source.get("clamp", False), source.get("invert", False),
+                              dest.get("smoothing") is not None])
+                smoothing.append(smoothing_rates(dest.get("smoothing") or (0.5, 0.5), period))
+                limits.append(output_limits(dest))
+                if (curve := dest.get("curve")) is not None:
+                    # Rules with the same curve share a table
+                    if (key := json.dumps(curve, sort_keys=True)) not in curve_keys:
+                        curve_keys[key] = len(tables)
+                        tables.append(curve_table(curve))
+                    curves.append(curve_keys[key])
+                else:
+                    curves.append(-1)
+            except (KeyError, TypeError, ValueError) as exception:
+                raise ValueError(f'Mapping rule ({i}) is invalid: {exception}') from exception
+            source_names = (tuple(i["name"] for i in source["inputs"])
+                            if "combine" in source else (source["name"],))
+            self.outputs.append((dest["module"], dest["name"], dest.get("duration"),
+                                 source_names))
+        self.src_idx = np.array(src_idx, dtype=np.intp)
+        self.src_idx = np.where(self.src_idx < 0, len(self.source_slots) - 1 - self.src_idx,
+                                self.src_idx)
+        self.dest_idx = np.array(dest_idx, dtype=np.intp)
+        s_min, s_max, d_min, d_max = np.array(ranges, dtype=np.float64).reshape(-1, 4).T
+        clamp, invert, self.smoothed = np.array(flags, dtype=bool).reshape(-1, 3).T
+        self.attack, self.release = np.array(smoothing, dtype=np.float64).reshape(-1, 2).T
+        # Scaling and inversion reduce to `value * gain + offset`, and ranges
+        # of zero width always output the destination maximum
+        fixed = ((s_max - s_min) == 0) | ((d_max - d_min) == 0)
+        self.gain = np.where(fixed, 0, (d_max - d_min) / np.where(fixed, 1, s_max - s_min))
+        self.offset = np.where(fixed, d_max, d_min - s_min * self.gain)
+        self.offset = np.where(invert & ~fixed, d_max + s_min * self.gain, self.offset)
+        self.gain = np.where(invert, -self.gain, self.gain)
+        self.lower = np.where(clamp & ~fixed, d_min, -np.inf)
+        self.upper = np.where(clamp & ~fixed, d_max, np.inf)
+        # Curved rules scale values to positions in their lookup table instead,
+        # and the interpolated table values to the destination range
+        curve_idx = np.array(curves, dtype=np.intp)
+        self.curved = (curve_idx >= 0) & ~fixed
+        self.curve_tables = np.concatenate(tables or [[]])
+        self.table_offset = np.maximum(curve_idx, 0) * CURVE_POINTS
+        self.curve_base, self.curve_span = d_min, d_max - d_min
+        to_position = np.where(self.curved, (CURVE_POINTS - 1) / np.where(fixed, 1, self.curve_span), 1)
+        self.gain = np.where(self.curved, self.gain * to_position, self.gain)
+        self.offset = np.where(self.curved, (self.offset - d_min) * to_position, self.offset)
+        self.source_values = np.full(len(self.source_slots) + len(self.combiners), np.nan)
+        self.combine_groups = self.compile_combiners()
+        self.dest_values = np.full(len(self.dest_slots), np.nan)
+        # Output limits of each destination, the strictest of its rules'
+        self.deadband = np.zeros((len(self.dest_slots), 3))
+        np.maximum.at(self.deadband, self.dest_idx, np.array(limits).reshape(-1, 3))
+        self.limited = bool(self.deadband.any())
+        self.sent_values = np.full(len(self.dest_slots), np.nan)
+        self.sent_times = np.full(len(self.dest_slots), -np.inf)
+        self.pending = np.zeros(len(self.dest_slots), dtype=bool)
+        self.pending_rules = np.zeros(len(self.dest_slots), dtype=np.intp)
+        self.sent = 0
+        self.suppressed = 0
+        self.layers = [self.compile_layer(rules) for rules in self.build_layers()]
+        # Rules reading each source slot, and the rules writing each destination
+        # slot (sorted by slot), which are reapplied when one of them changes it
+        self.source_rules = [np.flatnonzero(self.src_idx == slot)
+                             for slot in range(len(self.source_values))]
+        self.feeds_combiner = np.zeros(len(self.source_slots), dtype=bool)
+        for k, (_, inputs) in enumerate(self.combiners):
+            combined_slot = len(self.source_slots) + k
+            for slot in {i[0] for i in inputs}:
+                self.feeds_combiner[slot] = True
+                self.source_rules[slot] = np.union1d(
+                    self.source_rules[slot], self.source_rules[combined_slot])
+        self.combine_pending = bool(self.combiners)
+        self.dest_rules = np.argsort(self.dest_idx, kind="stable")
+        dest_counts = np.bincount(self.dest_idx, minlength=len(self.dest_slots))
+        self.dest_starts = np.cumsum(dest_counts) - dest_counts
+        self.dest_counts = dest_counts
+        self.shared = dest_counts[self.dest_idx] > 1
+        self.any_shared = bool(self.shared.any())
+        self.dirty = np.ones(len(rules), dtype=bool)
+        self.evaluated = 0
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def carry_state(self, previous: RuleSet):
+        """
+        Continues the filter and output state of destinations that were
+        also mapped by a previous rule set.
+        """
+        for key, slot in self.dest_slots.items():
+            if (prev_slot := previous.dest_slots.get(key)) is not None:
+                self.dest_values[slot] = previous.dest_values[prev_slot]
+                self.sent_values[slot] = previous.sent_values[prev_slot]
+                self.sent_times[slot] = previous.sent_times[prev_slot]
+        self.sent, self.suppressed = previous.sent, previous.suppressed
+
+    def source_slot(self, name: str) -> int:
+        """
+        Returns the slot of a named source, adding it if new.
+        """
+        return self.source_slots.setdefault(name, len(self.source_slots))
+
+    def add_combiner(self, source: dict) -> int:
+        """
+        Compiles a combiner source into its operation and the `(slot, gain,
+        offset, weight)` of each input scaling it to 0-1, returning its index
+        in `combiners`. Identical combiners are only compiled once.
+        """
+        operation, inputs = source["combine"], source["inputs"]
+        if operation not in COMBINERS:
+            raise ValueError(f'unknown combiner "{operation}"')
+        if len(inputs) == 0 or (operation == "crossfade" and len(inputs) != 3):
+            raise ValueError(f'wrong number of inputs for "{operation}" combiner')
+        key = json.dumps([operation, inputs], sort_keys=True)
+        if (index := self.combiner_keys.get(key)) is not None:
+            return index
+        compiled = []
+        for source_input in inputs:
+            low, high = source_input.get("range", [0, 1])
+            gain = 0 if high == low else 1 / (high - low)
+            offset = 1 if high == low else -low * gain
+            if source_input.get("invert", False) and gain != 0:
+                gain, offset = -gain, 1 - offset
+            compiled.append((self.source_slot(source_input["name"]), gain, offset,
+                             float(source_input.get("weight", 1))))
+        self.combiner_keys[key] = len(self.combiners)
+        self.combiners.append((operation, compiled))
+        return len(self.combiners) - 1
+
+    def compile_combiners(self) -> list:
+        """
+        Groups combiner inputs by operation into arrays, with each combiner's
+        inputs contiguous so every operation is reduced in one call.
+        """
+        groups = []
+        for operation in COMBINERS:
+            slots, inputs, starts = [], [], []
+            for k, (combiner_operation, combiner_inputs) in enumerate(self.combiners):
+                if combiner_operation == operation:
+                    slots.append(len(self.source_slots) + k)
+                    starts.append(len(inputs))
+                    inputs.extend(combiner_inputs)
+            if slots:
+                src_idx, gain, offset, weight = zip(*inputs)
+                groups.append((operation, np.array(slots, dtype=np.intp),
+                               np.array(starts, dtype=np.intp), np.array(src_idx, dtype=np.intp),
+                               np.array(gain), np.array(offset), np.array(weight)))
+        return groups
+
+    def combine(self):
+        """
+        Writes the combined value of every combiner to its source slot.
+        """
+        for operation, slots, starts, src_idx, gain, offset, weight in self.combine_groups:
+            values = np.clip(self.source_values[src_idx] * gain + offset, 0, 1)
+            missing = np.isnan(values)
+            if operation == "max":
+                combined = np.fmax.reduceat(values, starts)
+            elif operation == "min":
+                combined = np.fmin.reduceat(values, starts)
+            elif operation == "product":
+                combined = np.multiply.reduceat(np.where(missing, 1, values), starts)
+            elif operation == "sum":
+                combined = np.add.reduceat(np.where(missing, 0, values * weight), starts)
+            else:
+                position, a, b = np.where(missing, 0, values).reshape(-1, 3).T
+                combined = a + position * (b - a)
+            # Combiners with no input values have no value either
+            present = np.logical_or.reduceat(~missing, starts)
+            self.source_values[slots] = np.where(present, combined, np.nan)
+
+    def build_layers(self) -> list:
+        """
+        Splits rule indices into layers in which each destination appears at
+        most once. Most rule sets have a single layer.
+        """
+        layers = []
+        depth = {}
+        for i, slot in enumerate(self.dest_idx):
+            layer = depth.get(slot, -1) + 1
+            depth[slot] = layer
+            if layer == len(layers):
+                layers.append([])
+            layers[layer].append(i)
+        return [np.array(layer, dtype=np.intp) for layer in layers]
+
+    def compile_layer(self, rules: np.ndarray) -> tuple:
+        """
+        Gathers the per-rule arrays of a layer, so evaluation only indexes
+        the source and destination values.
+        """
+        smoothed, curved = self.smoothed[rules], self.curved[rules]
+        return (rules, self.src_idx[rules], self.dest_idx[rules],
+                self.gain[rules], self.offset[rules], self.lower[rules], self.upper[rules],
+                smoothed, self.attack[rules], self.release[rules],
+                curved, self.table_offset[rules], self.curve_base[rules], self.curve_span[rules],
+                bool(smoothed.any()), bool(curved.any()))
+
+    def update_sources(self, values: dict):
+        """
+        Writes updated source values to their slots, ignoring sources that
+        no rule uses, and marks the rules reading changed values as dirty.
+        """
+        for name, value in values.items():
+            if (slot := self.source_slots.get(name)) is not None:
+                prev = self.source_values[slot]
+                try:
+                    self.source_values[slot] = value
+                except (TypeError, ValueError):
+                    continue
+                if not self.source_values[slot] == prev:
+                    self.dirty[self.source_rules[slot]] = True
+                    self.combine_pending |= self.feeds_combiner[slot]
+
+    def mark_shared(self, rules: np.ndarray):
+        """
+        Marks every rule writing the destinations of `rules` as dirty, so
+        later layers reapply them this tick and earlier layers the next.
+        """
+        slots = self.dest_idx[rules[self.shared[rules]]]
+        if len(slots) == 0:
+            return
+        counts = self.dest_counts[slots]
+        ends = np.cumsum(counts)
+        positions = np.arange(ends[-1]) + np.repeat(self.dest_starts[slots] - ends + counts, counts)
+        self.dirty[self.dest_rules[positions]] = True
+
+    def lookup(self, positions: np.ndarray, table_offset: np.ndarray) -> np.ndarray:
+        """
+        Linearly interpolates curve tables at positions between 0 and the
+        last table index, clipping positions outside them.
+        """
+        positions = np.clip(np.nan_to_num(positions), 0, CURVE_POINTS - 1)
+        index = np.minimum(positions.astype(np.intp), CURVE_POINTS - 2)
+        fraction = positions - index
+        index += table_offset
+        lower = self.curve_tables[index]
+        return lower + fraction * (self.curve_tables[index + 1] - lower)
+
+    def evaluate(self, dt=None) -> tuple:
+        """
+        Applies the dirty rules with a source value, smoothing over `dt`
+        seconds since the previous evaluation (the period if not supplied).
+        Returns an array of the indices of rules whose output changed and an
+        array of those outputs.
+        """
+        dt = self.period if dt is None else dt
+        changed, outputs = [], []
+        self.evaluated = 0
+        if self.combine_pending:
+            self.combine()
+            self.combine_pending = False
+        for *arrays, any_smoothed, any_curved in self.layers:
+            active = self.dirty[arrays[0]]
+            if not active.any():
+                continue
+            if not active.all():
+                arrays = [a[active] for a in arrays]
+            (rules, src_idx, dest_idx, gain, offset, lower, upper, smoothed, attack, release,
+                curved, table_offset, curve_base, curve_span) = arrays
+            self.evaluated += len(rules)
+            values = self.source_values[src_idx]
+            out = values * gain + offset
+            if any_curved:
+                out = np.where(curved, self.lookup(out, table_offset) * curve_span + curve_base, out)
+            out = np.maximum(lower, np.minimum(upper, out))
+            prev = self.dest_values[dest_idx]
+            has_prev = ~np.isnan(prev)
+            emit = ~np.isnan(values) & ~(has_prev & (prev == out))
+            if any_smoothed:
+                # One-pole filter towards the target, attacking or releasing over dt
+                delta = out - prev
+                alpha = -np.expm1(-dt * np.where(delta > 0, attack, release))
+                smooth = smoothed & has_prev & (np.abs(delta) > SMOOTHING_THRESHOLD)
+                out = np.where(smooth, prev + alpha * delta, out)
+            if emit.all():
+                self.dest_values[dest_idx] = out
+                changed_rules = rules
+            else:
+                changed_rules, out = rules[emit], out[emit]
+                self.dest_values[dest_idx[emit]] = out
+            if self.any_shared:
+                self.mark_shared(changed_rules)
+            # Rules still converging on their target stay dirty
+            self.dirty[rules] = smooth if any_smoothed else False
+            changed.append(changed_rules)
+            outputs.append(out)
+        if len(changed) == 1:
+            return changed[0], outputs[0]
+        if len(changed) == 0:
+            return np.array([], dtype=np.intp), np.array([])
+        return np.concatenate(changed), np.concatenate(outputs)
+
+    def limit(self, rules: np.ndarray, values: np.ndarray, now: float) -> tuple:
+        """
+        Filters the changed outputs returned by `evaluate()` through each
+        destination's deadband and maximum rate at monotonic time `now`,
+        adding coalesced outputs whose interval has passed. Returns the rule
+        indices and values to send, and counts the sent and suppressed.
+        """
+        if not self.limited:
+            self.sent += len(rules)
+            return rules, values
+        changed = len(rules)
+        slots = self.dest_idx[rules]
+        if self.pending.any():
+            self.pending[slots] = False
+            waiting = np.flatnonzero(self.pending)
+            rules = np.concatenate([rules, self.pending_rules[waiting]])
+            values = np.concatenate([values, self.dest_values[waiting]])
+            slots = np.concatenate([slots, waiting])
+        absolute, relative, interval = self.deadband[slots].T
+        last = self.sent_values[slots]
+        within = np.abs(values - last) <= np.maximum(absolute, relative * np.abs(last))
+        # Allow half a tick early, so rates are rounded to the nearest tick
+        early = now - self.sent_times[slots] < interval - self.period / 2
+        send = ~within & ~early
+        self.pending[slots] = ~within & early
+        self.pending_rules[slots] = rules
+        self.sent_values[slots[send]] = values[send]
+        self.sent_times[slots[send]] = now
+        sent = int(np.count_nonzero(send))
+        self.sent += sent
+        self.suppressed += changed - int(np.count_nonzero(send[:changed]))
+        return rules[send], values[send]
+
+    def queue_outputs(self, rules: np.ndarray, values: np.ndarray, traces: dict,
+                      destinations: dict):
+        """
+        Adds rule outputs to `destinations`, a dictionary of each destination
+        module's `{name: {"value": v, "duration": d, "trace": t}}` messages,
+        skipping modules it does not contain. Outputs carry the trace of the
+        first of their sources found in `traces`.
+        """
+        for i, value in zip(rules.tolist(), values.tolist()):
+            module, name, duration, source_names = self.outputs[i]
+            if (module_destinations := destinations.get(module)) is None:
+                continue
+            output = {"value": value}
+            if duration is not None:
+                output["duration"] = duration
+            for source_name in source_names:
+                if (trace := traces.get(source_name)) is not None:
+                    output["trace"] = trace
+                    break
+            module_destinations[name] = output
@@ -16,15 +16,24 @@ import time
 from enum import Enum
 from queue import Full
 import multiprocessing as mp
+from threading import Thread
 
 from src.utils import SigLog
+from src.utils import queue_pipe
 from src.utils import FunctionHandler
+from src.valueids import ValueIds
 
 
 # Critical alerts from modules that should restart the Signifier service
 SIG_RESTART_MESSAGES = ['underrun']
 SIG_PATH = os.getenv('SIGNIFIER')
 SIG_SCRIPTS = os.path.join(SIG_PATH, 'scripts')
+# Seconds between liveness checks of modules hosted in threads, which have no sentinel
+THREAD_CHECK_SECS = 1
+# Longest wait for a process to be reaped after its sentinel is ready
+SENTINEL_JOIN_SECS = 0.1
+# Process classes built for each host type, keyed by (process class, host base class)
+HOSTED_CLASSES = {}
 
 
 class ModuleStatus(Enum):
@@ -42,12 +51,28 @@ class SigModule:
     """
     A generic module class for creating independent Signifier modules.
     """
+    # Config keys a running process can apply without restarting. The keys
+    # 'values' and 'rules' cover the module's sections of those config files.
+    hot_config = {'log_level'}
+    # Hot keys applied by every process, in addition to the class' hot_config
+    base_hot_config = {'log_level', 'loop_timing', 'latency_tracing'}
+    # General config keys every process falls back to when the module doesn't set them
+    general_process_keys = {'process_loop_sleep', 'loop_stats_secs', 'loop_timing',
+                            'latency_tracing'}
+    # Run the module's process as a separate 'process' or a 'thread' of the main
+    # Signifier process. Overridden by the module's 'host' config key.
+    default_host = 'process'
+
     def __init__(self, name: str, configs: dict, *args, **kwargs) -> None:
         # Signifier configuration
         self.module_name = name
         self.module_config = {}
         self.failed_count = 0
         self.last_failed_time = time.time()
+        self.died_time = None
+        self.reaction_time = None
+        # Monotonic time the process stopped, written by the process itself
+        self.exit_stamp = mp.Value('d', 0.0, lock=False)
         self.logger = SigLog.get_logger(
             f'Sig.{self.module_name.capitalize()}',
             level=self.module_config.get('log_level', 'INFO'))
@@ -57,8 +82,14 @@ class SigModule:
         self.status = ModuleStatus.empty if self.enabled else ModuleStatus.disabled
         # Process management
         self.process = None
+        self.host = self.module_config.get('host', self.default_host)
         self.metrics_q = kwargs.get("metrics", None)
-        self.parent_pipe, self.child_pipe = mp.Pipe()
+        self.value_bus = kwargs.get("value_bus", None)
+        self.value_ids = kwargs.get("value_ids") or ValueIds(self.main_values)
+        if self.host == 'thread':
+            self.parent_pipe, self.child_pipe = queue_pipe()
+        else:
+            self.parent_pipe, self.child_pipe = mp.Pipe()
         self.mapping_pipe, self.module_pipe = mp.Pipe()
         self.module_start_time = time.time()
         self.module_end_time = time.time()
@@ -83,6 +114,23 @@ class SigModule:
         pass
 
 
+    def hosted(self, process_class):
+        """
+        Returns the supplied module-specific Process class combined with
+        either `multiprocessing.Process` or `threading.Thread`, depending on
+        the module's host. The host is fixed for the lifetime of the module,
+        as other modules hold references to its pipes.
+        """
+        if (host := self.module_config.get('host', self.default_host)) != self.host:
+            self.logger.warning(f'Changing host from "{self.host}" to "{host}" '
+                                f'requires a Signifier restart.')
+        base = Thread if self.host == 'thread' else mp.Process
+        if (hosted_class := HOSTED_CLASSES.get((process_class, base))) is None:
+            hosted_class = type(process_class.__name__, (process_class, base), {})
+            HOSTED_CLASSES[(process_class, base)] = hosted_class
+        return hosted_class
+
+
     def initialise(self, *args):
         """
         (re)Creates the given Signifier module's Process.
@@ -91,6 +139,7 @@ class SigModule:
                             ModuleStatus.failed,
                             ModuleStatus.closed]
                             or 'force' in args):
+            self.exit_stamp.value = 0
             self.create_process()
             if self.process is None:
                 self.logger.error(
@@ -125,12 +174,54 @@ class SigModule:
     def update_config(self, configs: dict, **kwargs):
         """
         Updates the module's configuration based on supplied config dictionary.
+        Changes limited to the module's `hot_config` keys are sent to the
+        running process, otherwise the process is stopped and restarted with
+        the new config.
         """
         self.logger.debug(f"Pushing config update to [{self.module_name}]...")
         self.config_latest = configs
         self.config_dirty = True
         if self.status == ModuleStatus.running:
-            self.stop()
+            changes = self.config_changes(configs)
+            if not changes:
+                self.apply_config()
+                return
+            hot_config = self.hot_config | self.base_hot_config
+            if changes <= hot_config and self.send_to_process(
+                    'update_config',
+                    configs['config']['modules'][self.module_name],
+                    configs['values']['modules'].get(self.module_name, {}),
+                    configs['rules']['modules'],
+                    configs['config']['modules'].get('general', {})):
+                self.logger.info(f'Hot-applying config changes: {sorted(changes)}')
+                self.apply_config()
+            else:
+                self.logger.info(f'Restarting to apply config changes: '
+                                 f'{sorted(changes - hot_config)}')
+                self.stop()
+
+
+    def config_changes(self, configs: dict) -> set:
+        """
+        Returns the set of module config keys that differ between the applied
+        config and the supplied configs, including `values` and `rules` if the
+        module's sections of those files have changed. Changed `general` keys
+        the process falls back to count as changes of the module key of the
+        same name.
+        """
+        new_config = configs['config']['modules'].get(self.module_name, {})
+        changes = {k for k in set(new_config) | set(self.module_config)
+                   if new_config.get(k) != self.module_config.get(k)}
+        new_general = configs['config']['modules'].get('general', {})
+        general = self.main_config.get('general', {})
+        changes |= {k for k in self.general_process_keys
+                    if k not in new_config and new_general.get(k) != general.get(k)}
+        if configs['values']['modules'].get(self.module_name, {}) != self.module_values:
+            changes.add('values')
+        if (configs['rules']['modules'].get(self.module_name)
+                != self.rules_config.get(self.module_name)):
+            changes.add('rules')
+        return changes
 
 
     def start(self):
@@ -177,13 +268,18 @@ class SigModule:
                 self.logger.warning(f'{exception}')
 
 
-    def monitor_process(self):
+    def monitor_process(self, wait_times: tuple = None):
         """
         Generic monitoring tick call for module to check process statuses.
+        The supervisor loop supplies `wait_times` as the monotonic times its
+        blocking wait started and returned, with the list of ready handles,
+        so processes exiting are reaped and noticed in the same tick.
         """
         previous_status = self.status
-        # Retrieve and parse any pending messages from the child process
-        if self.child_pipe.poll():
+        if wait_times is not None:
+            self.check_sentinel(*wait_times)
+        # Retrieve and parse all pending messages from the child process
+        while self.child_pipe.poll():
             message = self.child_pipe.recv()
             self.logger.debug(f'Module received "{message}" from its process.')
             if message == "running":
@@ -206,6 +302,28 @@ class SigModule:
             except (ValueError, KeyError):
                 self.module_callback(self.module_name, message)
 
+        # Catch processes that exited without reporting back, i.e. crashed or killed
+        if (self.status in [
+                ModuleStatus.starting,
+                ModuleStatus.running,
+                ModuleStatus.closing]
+                and self.process is not None
+                and not self.process.is_alive()
+                and not self.child_pipe.poll()):
+            self.logger.error(f'Process exited unexpectedly while "{self.status.name}".')
+            self.module_end_time = time.time()
+            self.request_join()
+            self.status = ModuleStatus.failed
+            try:
+                self.metrics_q.put((f"{self.module_name}_active", 0), timeout=0.01)
+            except (Full, AttributeError):
+                pass
+        if self.status == ModuleStatus.failed and previous_status != ModuleStatus.failed:
+            self.died_time = time.monotonic()
+            # Processes killed outright leave no exit stamp, so the wait's return stands in
+            stopped = self.exit_stamp.value or (
+                self.died_time if wait_times is None else wait_times[1])
+            self.reaction_time = max(0.0, self.died_time - stopped)
 
         # Apply pending config
         if (self.status not in [
@@ -227,9 +345,9 @@ class SigModule:
             elif self.status == ModuleStatus.initialised:
                 self.start()
             elif self.status == ModuleStatus.failed:
-                if time.time() > self.last_failed_time + self.main_config.get(
-                        'module_fail_restart_secs', 5):
+                if time.time() > self.last_failed_time + self.restart_secs():
                     self.last_failed_time = time.time()
+                    self.report_restart_latency()
                     self.initialise('force')
         else:
             if self.status == ModuleStatus.disabled:
@@ -243,6 +361,92 @@ class SigModule:
             self.logger.info(f'Status changed to "{self.status.name}"')
 
 
+    def check_sentinel(self, wait_start: float, woken: float, ready: list):
+        """
+        Reaps the process if the supervisor's wait returned with its
+        sentinel ready, so this monitoring tick sees it has died.
+        """
+        # Processes exit on purpose while closing
+        if self.status not in [ModuleStatus.starting, ModuleStatus.running]:
+            return
+        try:
+            sentinel = self.process.sentinel
+        except (AttributeError, ValueError):
+            return
+        if sentinel in ready:
+            # The sentinel is ready as the process exits, slightly before it can be reaped
+            self.process.join(SENTINEL_JOIN_SECS)
+
+
+    def restart_secs(self) -> float:
+        """
+        Returns the minimum number of seconds between restarts of a failed module.
+        """
+        return self.main_config['general'].get('module_fail_restart_secs', 5)
+
+
+    def report_restart_latency(self):
+        """
+        Sends the supervisor's reaction and hold-off times for the module's
+        failed process to the metrics queue. The reaction time runs from the
+        process stopping, as stamped by the process itself, to the supervisor
+        noticing, and the hold-off from noticing the failure to issuing the
+        restart. Processes killed before stamping are timed from the
+        supervisor's wait returning.
+        """
+        if self.died_time is None:
+            return
+        holdoff = (time.monotonic() - self.died_time) * 1000
+        self.died_time = None
+        metrics = [(f"{self.module_name}_restart_holdoff_ms", round(holdoff, 1))]
+        if self.reaction_time is not None:
+            reaction = self.reaction_time * 1000
+            self.reaction_time = None
+            metrics.append((f"{self.module_name}_restart_reaction_ms", round(reaction, 1)))
+            self.logger.debug(f'Failure noticed {reaction:.1f}ms after the process stopped, '
+                              f'restarting after {holdoff:.1f}ms hold-off.')
+        for metric in metrics:
+            try:
+                self.metrics_q.put(metric, timeout=0.01)
+            except (Full, AttributeError):
+                pass
+
+
+    def wait_objects(self) -> list:
+        """
+        Returns the connections the supervisor should block on for this
+        module: the status pipe from its process and, while the process is
+        alive, the process sentinel so crashes are caught immediately.
+        """
+        objects = [self.child_pipe]
+        if self.status in [ModuleStatus.starting,
+                           ModuleStatus.running,
+                           ModuleStatus.closing]:
+            try:
+                objects.append(self.process.sentinel)
+            except (AttributeError, ValueError):
+                pass
+        return objects
+
+
+    def next_deadline(self):
+        """
+        Returns the number of seconds until the supervisor must monitor this
+        module regardless of messages or process exits, or `None` if the
+        module only needs to react to those.
+        """
+        if not self.enabled:
+            return None
+        if self.status == ModuleStatus.failed:
+            return max(0, self.last_failed_time + self.restart_secs() - time.time())
+        if self.status in [ModuleStatus.empty, ModuleStatus.closed]:
+            return self.restart_secs()
+        if (self.status in [ModuleStatus.starting, ModuleStatus.running]
+                and not hasattr(self.process, 'sentinel')):
+            return THREAD_CHECK_SECS
+        return None
+
+
     def module_call(self, *args):
         """
         Handles requests from remote locations to call internal module
@@ -12,10 +12,18 @@ A generic class defining processes controlled by Signifier modules.
 from __future__ import annotations
 
 import time
+import itertools
 import multiprocessing as mp
+from threading import Thread
+from threading import get_native_id
+from multiprocessing.connection import wait
 
 from src.pusher import MetricsPusher
+from src.histogram import StageTimer
+from src.histogram import LOOP_STAGES
+from src.histogram import TRACE_HOPS
 from src.sigmodule import SigModule
+from src.utils import rss_mb
 from src.utils import FunctionHandler
 
 
@@ -34,18 +42,38 @@ class ModuleProcess:
         self.logger = parent.logger
         # Process management
         self.parent_pipe = parent.parent_pipe
+        self.exit_stamp = parent.exit_stamp
         self.prev_process_time = time.time()
         self.event = mp.Event()
         self.start_delay = self.config.get("start_delay", 0)
-        self.loop_sleep = parent.main_config.get("process_loop_sleep", 0.001)
+        self.loop_sleep = parent.main_config["general"].get("process_loop_sleep", 0.001)
+        self.stats_period = parent.main_config["general"].get("loop_stats_secs", 1)
+        # Hardware stand-ins are used when running `signifier.py --simulate`
+        self.simulation = parent.main_config["general"].get("simulation") or {}
+        self.simulate = self.simulation.get("enabled", False)
+        self.loop_timer = None
+        self.set_loop_timing(self.config.get(
+            "loop_timing", parent.main_config["general"].get("loop_timing", False)))
+        # Latency tracing
+        self.tracing = self.config.get(
+            "latency_tracing", parent.main_config["general"].get("latency_tracing", False))
+        self.trace_ids = None
+        self.source_traces = {}
+        self.latency = StageTimer("latency", TRACE_HOPS)
         # Mapping and metrics
-        self.metrics_pusher = MetricsPusher(parent.metrics_q)
+        self.value_ids = parent.value_ids
+        self.metrics_pusher = MetricsPusher(parent.metrics_q, self.value_ids, self.module_name)
         self.mapping_pipe = parent.mapping_pipe
+        self.value_bus = parent.value_bus
+        self.dest_reader = None
         self.source_values = {}
         self.destinations = {}
         self.dest_values = {}
         # Remote function calls
-        self.remote_functions = {"close": self.shutdown}
+        self.remote_functions = {
+            "close": self.shutdown,
+            "update_config": self.update_config,
+            "loop_timing": self.set_loop_timing}
         self.function_handler = FunctionHandler(
             self.module_name, self.remote_functions)
 
@@ -53,26 +81,173 @@ class ModuleProcess:
     def run(self):
         """
         Generic run function for Signifier module processes.
-        Called by the multiprocessor `start()` function.
+        Called by the multiprocessor `start()` function. Stamps the time the
+        process stopped, however it stopped, for the parent module to
+        measure how quickly it reacted.
+        """
+        try:
+            self.run_loop()
+        finally:
+            self.stamp_exit()
+
+
+    def run_loop(self):
+        """
+        Runs the process until its event is set.\n
+        The loop blocks on the control pipe, the mapping pipe and any
+        module-specific objects from `wait_objects()` until the deadline
+        returned by the previous `mid_run()` call, rather than sleeping
+        for a fixed period between iterations.
         """
         if self.pre_run():
             time.sleep(self.start_delay)
             if self.parent_pipe.writable:
                 self.parent_pipe.send("running")
+            if self.value_bus is not None:
+                self.dest_reader = self.value_bus.reader(
+                    self.value_bus.destinations.get(self.module_name, []), destinations=True,
+                    module=self.module_name)
+            self.reset_loop_stats()
+            next_run = time.monotonic()
             while not self.event.is_set():
+                wait_start = time.monotonic()
+                timeout = max(0, next_run - wait_start)
+                ready = wait(self.wait_objects(), timeout)
+                wake_time = time.monotonic()
+                self.loop_idle += wake_time - wait_start
+                self.loop_wakeups += 1
+                start = time.perf_counter()
                 self.poll_control()
+                self.observe_timing("poll_control", start)
                 if self.event.is_set():
                     break
+                start = time.perf_counter()
                 self.dest_values = {}
+                if self.dest_reader is not None:
+                    self.dest_values = self.dest_reader.poll()
                 if self.mapping_pipe.poll():
-                    self.dest_values = self.mapping_pipe.recv()
-                self.mid_run()
+                    self.dest_values.update(
+                        self.value_ids.unpack_outputs(self.mapping_pipe.recv()))
+                self.observe_timing("ipc_recv", start)
+                if self.dest_values or ready or wake_time >= next_run:
+                    if wake_time >= next_run:
+                        self.observe_timing("jitter", next_run, wake_time)
+                    start = time.perf_counter()
+                    delay = self.mid_run()
+                    self.observe_timing("mid_run", start)
+                    next_run = time.monotonic() + (
+                        self.loop_sleep if delay is None else delay)
                 if self.source_values != {}:
-                    if self.mapping_pipe.writable:
-                        self.mapping_pipe.send(self.source_values)
-                        self.metrics_pusher.update_dict(self.source_values)
+                    self.send_source_values()
+                self.push_loop_stats()
                 self.metrics_pusher.queue()
-                time.sleep(self.loop_sleep)
+
+
+    def send_source_values(self):
+        """
+        Publishes the module's source values to the mapper. Values with a slot
+        on the shared memory value bus are written in place, while anything
+        else falls back to the module's mapping pipe as an ID-keyed payload.
+        """
+        start = time.perf_counter()
+        unsent = self.source_values
+        if self.value_bus is not None:
+            unsent = self.value_bus.write_sources(self.source_values, self.source_traces)
+        if unsent != {} and self.mapping_pipe.writable:
+            traces = {k: (*self.source_traces[k], time.monotonic())
+                      for k in unsent if k in self.source_traces}
+            self.mapping_pipe.send(self.value_ids.pack(unsent, traces))
+        self.observe_timing("ipc_send", start)
+        if self.source_traces:
+            sent_time = time.monotonic()
+            for _, origin in self.source_traces.values():
+                self.latency.observe("source", sent_time - origin)
+            self.source_traces = {}
+        self.metrics_pusher.update_dict(self.source_values)
+
+
+    def trace_source(self, name: str, origin: float):
+        """
+        Attaches a new trace id and the monotonic `origin` time of the data
+        it was computed from to a source value, if latency tracing is
+        enabled. The trace follows the value through the mapper to its
+        destinations, which record the latency of each hop.
+        """
+        if self.tracing:
+            if self.trace_ids is None:
+                # Prefixed with the thread id, so ids are unique across modules
+                self.trace_ids = itertools.count((get_native_id() & 0xFFFFFFFF) << 32)
+            self.source_traces[name] = (next(self.trace_ids), origin)
+
+
+    def wait_objects(self) -> list:
+        """
+        Returns the list of connections/file descriptors the run loop blocks
+        on between `mid_run()` calls. Modules override this to add their own
+        readable objects, such as serial ports or other module pipes.\n
+        Includes the value bus wake pipe, which the mapper writes after
+        publishing the module's destinations.
+        """
+        if self.dest_reader is not None and self.dest_reader.wake_fd is not None:
+            return [self.parent_pipe, self.mapping_pipe, self.dest_reader.wake_fd]
+        return [self.parent_pipe, self.mapping_pipe]
+
+
+    def reset_loop_stats(self):
+        """
+        Resets the run loop's wakeup, idle time and CPU time counters.
+        """
+        # Thread-hosted modules share the interpreter, so only count their own CPU time
+        self.cpu_clock = time.thread_time if isinstance(self, Thread) else time.process_time
+        self.loop_wakeups = 0
+        self.loop_idle = 0
+        self.stats_start = time.monotonic()
+        self.stats_cpu = self.cpu_clock()
+
+
+    def push_loop_stats(self):
+        """
+        Sends the run loop's wakeups per second, idle ratio, CPU usage and
+        the process' resident memory to the metrics pusher every
+        `loop_stats_secs` seconds.
+        """
+        elapsed = time.monotonic() - self.stats_start
+        if elapsed >= self.stats_period:
+            cpu = self.cpu_clock() - self.stats_cpu
+            self.metrics_pusher.update(
+                f"{self.module_name}_loop_wakeups", round(self.loop_wakeups / elapsed, 1))
+            self.metrics_pusher.update(
+                f"{self.module_name}_loop_idle", round(self.loop_idle / elapsed, 3))
+            self.metrics_pusher.update(
+                f"{self.module_name}_loop_cpu", round(cpu / elapsed * 100, 2))
+            self.metrics_pusher.update(f"{self.module_name}_rss_mb", round(rss_mb(), 1))
+            if self.loop_timer is not None:
+                self.metrics_pusher.update_dict(self.loop_timer.snapshots())
+            self.metrics_pusher.update_dict(self.latency.snapshots())
+            self.reset_loop_stats()
+
+
+    def set_loop_timing(self, enabled: bool):
+        """
+        Switches the run loop's timing histograms on or off. Histograms are
+        cleared when timing is switched back on.
+        """
+        enabled = bool(enabled)
+        if enabled and self.loop_timer is None:
+            self.loop_timer = StageTimer(f"{self.module_name}_loop", LOOP_STAGES)
+        elif not enabled:
+            self.loop_timer = None
+        self.logger.debug(f'Loop timing {"enabled" if enabled else "disabled"}.')
+
+
+    def observe_timing(self, stage: str, start: float, end: float = None):
+        """
+        Records the seconds since `start` in the named loop stage histogram,
+        if loop timing is enabled. Stages are listed in `LOOP_STAGES`.
+        """
+        if self.loop_timer is not None:
+            end = time.perf_counter() if end is None else end
+            self.loop_timer.observe(stage, end - start)
 
 
     def pre_run(self) -> bool:
@@ -85,7 +260,9 @@ class ModuleProcess:
     def mid_run(self):
         """
         Module-specific Process run commands. Where the bulk of the module's
-        computation occurs.
+        computation occurs.\n
+        Return the number of seconds until the module next needs to run, or
+        `None` to run again after the `process_loop_sleep` config value.
         """
         pass
 
@@ -114,7 +291,7 @@ class ModuleProcess:
         if block_for > 0:
             self.logger.debug(f'Blocking command poll for ({block_for}) seconds.')
             while time.time() < start_time + block_for and not abort_event():
-                time.sleep(0.01)
+                self.parent_pipe.poll(0.01)
                 poll()
             if time.time() > start_time + block_for:
                 self.logger.debug(f'Blocking command poll timed out.')
@@ -124,6 +301,31 @@ class ModuleProcess:
         return None
 
 
+    def update_config(self, module_config: dict, module_values: dict, rules_config: dict,
+                      general_config: dict = None):
+        """
+        Receives hot-applicable config changes from the parent module, applying
+        them to the running Process without restarting it. Loop timing and
+        latency tracing fall back to the `general` config, as at startup.
+        """
+        general_config = general_config or {}
+        self.config = module_config
+        self.module_values = module_values
+        self.logger.setLevel(module_config.get('log_level', 'INFO'))
+        self.set_loop_timing(module_config.get(
+            "loop_timing", general_config.get("loop_timing", False)))
+        self.tracing = module_config.get(
+            "latency_tracing", general_config.get("latency_tracing", False))
+        self.apply_hot_config(rules_config)
+
+
+    def apply_hot_config(self, rules_config: dict):
+        """
+        Module-specific application of updated config values to a running Process.
+        """
+        pass
+
+
     def pre_shutdown(self):
         """
         Module-specific Process shutdown preparation.
@@ -153,5 +355,15 @@ class ModuleProcess:
         self.logger.critical(f'{exception}')
         self.event.set()
         self.pre_shutdown()
+        self.stamp_exit()
         if self.parent_pipe.writable:
             self.parent_pipe.send("failed")
+
+
+    def stamp_exit(self):
+        """
+        Records the monotonic time the process stopped in the module's
+        shared exit stamp, unless already recorded.
+        """
+        if self.exit_stamp is not None and self.exit_stamp.value == 0:
+            self.exit_stamp.value = time.monotonic()
@@ -0,0 +1,455 @@
+#    _________.__              .__          __  .__
+#   /   _____/|__| _____  __ __|  | _____ _/  |_|__| ____   ____
+#   \_____  \ |  |/     \|  |  \  | \__  \\   __\  |/  _ \ /    \
+#   /        \|  |  Y Y  \  |  /  |__/ __ \|  | |  (  <_> )   |  \
+#  /_______  /|__|__|_|  /____/|____(____  /__| |__|\____/|___|  /
+#          \/          \/                \/                    \/
+
+"""
+Hardware stand-ins for running the full Signifier pipeline on a plain Linux
+machine, and the report summarising each simulation run.
+"""
+
+from __future__ import annotations
+
+import os
+import tty
+import math
+import time
+import wave
+import struct
+import select
+import tempfile
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from src.utils import SigLog
+from src.histogram import quantile
+
+logger = SigLog.get_logger('Sig.Simulation', level='INFO')
+
+SIM_AUDIO_PATH = os.path.join(tempfile.gettempdir(), 'signifier_sim_audio')
+# Clip lengths in seconds, covering each of the default composition categories
+SIM_CLIP_SECS = (1, 2, 6, 7, 12, 31)
+SIM_CLIP_RATE = 22050
+
+# SerialTransfer packet framing, as used by the Arduino firmware
+START_BYTE = 0x7E
+STOP_BYTE = 0x81
+MAX_PACKET_SIZE = 0xFE
+CRC_POLY = 0x9B
+PACKET_FORMAT = struct.Struct('<cll')
+
+
+def _crc_table(poly: int) -> list:
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) if crc & 0x80 else crc << 1
+        table.append(crc & 0xFF)
+    return table
+
+
+CRC_TABLE = _crc_table(CRC_POLY)
+
+
+def crc8(data: bytes) -> int:
+    """
+    Returns the SerialTransfer CRC8 checksum of the supplied bytes.
+    """
+    crc = 0
+    for byte in data:
+        crc = CRC_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_packet(payload: bytes, packet_id=0) -> bytes:
+    """
+    Frames a payload as a SerialTransfer packet. Start bytes within the
+    payload are replaced with the distance to the next one, with the index
+    of the first stored in the packet's overhead byte.
+    """
+    data = bytearray(payload)
+    starts = [i for i, byte in enumerate(data) if byte == START_BYTE]
+    overhead = starts[0] if starts else 0xFF
+    for i, j in zip(starts, starts[1:] + starts[-1:]):
+        data[i] = j - i
+    return bytes([START_BYTE, packet_id, overhead, len(data)]) + bytes(data) + bytes(
+        [crc8(data), STOP_BYTE])
+
+
+class PacketParser:
+    """
+    Incrementally decodes SerialTransfer packets from a byte stream.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data: bytes) -> list:
+        """
+        Adds received bytes and returns the payloads of any complete packets.
+        """
+        self.buffer += data
+        payloads = []
+        while True:
+            if (start := self.buffer.find(START_BYTE)) < 0:
+                self.buffer.clear()
+                return payloads
+            del self.buffer[:start]
+            if len(self.buffer) < 4:
+                return payloads
+            overhead, length = self.buffer[2], self.buffer[3]
+            end = 4 + length + 2
+            if len(self.buffer) < end:
+                return payloads
+            data = bytearray(self.buffer[4:4 + length])
+            crc, stop = self.buffer[end - 2], self.buffer[end - 1]
+            if stop != STOP_BYTE or crc != crc8(data):
+                # Not a valid packet, so resync from the next start byte
+                self.crc_errors += 1
+                del self.buffer[:1]
+                continue
+            del self.buffer[:end]
+            i = overhead
+            while i <= MAX_PACKET_SIZE and i < length:
+                delta = data[i]
+                data[i] = START_BYTE
+                if delta == 0:
+                    break
+                i += delta
+            payloads.append(bytes(data))
+
+
+class FakeArduino:
+    """
+    Pseudo-terminal standing in for the LED Arduino. The LED module opens
+    `port` as a normal serial port, and a background thread answers in the
+    SerialTransfer protocol: each command packet is echoed back as its
+    confirmation, and a ready (`r`) packet is sent every Arduino loop.
+    """
+
+    def __init__(self, loop_ms=30) -> None:
+        self.loop_ms = loop_ms
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.parser = PacketParser()
+        self.received = 0
+        self.dropped = 0
+        self.event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='FakeArduino', daemon=True)
+        self.thread.start()
+        logger.info(f'Fake Arduino listening on [{self.port}].')
+
+    def run(self):
+        """
+        Answers command packets and sends ready packets until closed.
+        """
+        next_ready = time.monotonic()
+        while not self.event.is_set():
+            readable, _, _ = select.select(
+                [self.master], [], [], max(0, next_ready - time.monotonic()))
+            loop_start = time.monotonic()
+            if readable:
+                try:
+                    data = os.read(self.master, 4096)
+                except (BlockingIOError, OSError):
+                    data = b''
+                for payload in self.parser.feed(data):
+                    self.handle(payload)
+            if loop_start >= next_ready:
+                rx_window = int((time.monotonic() - loop_start) * 1000)
+                self.write(PACKET_FORMAT.pack(b'r', self.loop_ms, rx_window))
+                next_ready = loop_start + self.loop_ms / 1000
+
+    def handle(self, payload: bytes):
+        """
+        Confirms a command packet by echoing it, applying loop length changes.
+        """
+        if len(payload) < PACKET_FORMAT.size:
+            return
+        self.received += 1
+        command, value, _ = PACKET_FORMAT.unpack_from(payload)
+        if command == b'l':
+            self.loop_ms = max(5, min(200, value))
+        self.write(payload[:PACKET_FORMAT.size])
+
+    def write(self, payload: bytes):
+        """
+        Sends a packet, dropping it if the LED module is not reading the port.
+        """
+        try:
+            os.write(self.master, encode_packet(payload))
+        except (BlockingIOError, OSError):
+            self.dropped += 1
+
+    def close(self):
+        """
+        Stops the responder thread and closes the pseudo-terminal.
+        """
+        self.event.set()
+        self.thread.join(timeout=1)
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        logger.info(f'Fake Arduino confirmed ({self.received}) packets, '
+                    f'dropped ({self.dropped}), CRC errors ({self.parser.crc_errors}).')
+
+
+class SimulatedPCM:
+    """
+    Stand-in for an `alsaaudio.PCM` capture device, returning one period of
+    audio per `read()` at the rate a sound card would deliver it. Plays a
+    looped mono 16-bit WAV file, or a synthetic beat if no file is supplied.
+    """
+
+    def __init__(self, sample_rate: int, periodsize: int, audio_file=None) -> None:
+        self.periodsize = periodsize
+        self.period_secs = periodsize / sample_rate
+        if audio_file is not None:
+            self.samples = load_wav(audio_file)
+            logger.info(f'Simulating audio input from [{audio_file}].')
+        else:
+            self.samples = synthetic_audio(sample_rate)
+        self.position = 0
+        self.next_read = time.monotonic()
+
+    def read(self) -> tuple:
+        """
+        Blocks until the next period is due, returning `(length, data)`.
+        """
+        self.next_read += self.period_secs
+        if (delay := self.next_read - time.monotonic()) > 0:
+            time.sleep(delay)
+        elif delay < -1:
+            # Like an overrun, drop the backlog rather than bursting to catch up
+            self.next_read = time.monotonic()
+        indices = np.arange(self.position, self.position + self.periodsize) % len(self.samples)
+        self.position = (self.position + self.periodsize) % len(self.samples)
+        return self.periodsize, self.samples[indices].tobytes()
+
+    def close(self):
+        pass
+
+
+def load_wav(path: str) -> np.ndarray:
+    """
+    Returns the samples of a 16-bit WAV file, mixed down to mono.
+    """
+    with wave.open(path, 'rb') as file:
+        if file.getsampwidth() != 2:
+            raise ValueError(f'Simulated audio input must be 16-bit: {path}')
+        channels = file.getnchannels()
+        samples = np.frombuffer(file.readframes(file.getnframes()), dtype='<i2')
+    return samples.reshape(-1, channels).mean(axis=1).astype('<i2')
+
+
+def synthetic_audio(sample_rate: int, seconds=8, bpm=120) -> np.ndarray:
+    """
+    Returns a loop of decaying kick drum hits over a slowly swelling tone
+    and noise, giving the analysis module peaks and quiet passages.
+    """
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    beat = (t % (60 / bpm))
+    kick = np.sin(2 * np.pi * 55 * t) * np.exp(-beat * 12)
+    swell = 0.5 - 0.5 * np.cos(2 * np.pi * t / seconds)
+    tone = np.sin(2 * np.pi * 220 * t) * swell * 0.3
+    noise = rng.normal(0, 0.02, len(t))
+    signal = np.clip((kick * 0.6 + tone + noise), -1, 1)
+    return (signal * 32767).astype('<i2')
+
+
+BLEAddress = namedtuple('BLEAddress', 'address')
+Advertisement = namedtuple('Advertisement', 'address rssi')
+
+
+class SimulatedAdapter:
+    """
+    Stand-in for a bleson BLE adapter.
+    """
+    _keep_running = True
+
+    def close(self):
+        pass
+
+
+class SimulatedObserver:
+    """
+    Stand-in for a `bleson.Observer`, calling `on_advertising_data` from a
+    background thread while started. A scripted set of devices drift in and
+    out of range, each advertising with a signal strength that rises and
+    falls over `period` seconds.
+    """
+    ADVERTISE_SECS = 0.1
+
+    def __init__(self, adapter: SimulatedAdapter, devices=6, period=30) -> None:
+        self.adapter = adapter
+        self.on_advertising_data = None
+        self.period = period
+        self.devices = [(BLEAddress(f'5A:1D:00:00:00:{i:02X}'), 2 * math.pi * i / max(1, devices))
+                        for i in range(devices)]
+        self.event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts advertising the scripted devices.
+        """
+        if self.thread is None:
+            self.event.clear()
+            self.thread = threading.Thread(target=self.run, name='SimulatedObserver', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.event.wait(self.ADVERTISE_SECS):
+            phase = 2 * math.pi * time.monotonic() / self.period
+            for address, offset in self.devices:
+                if (level := math.sin(phase + offset)) > 0 and self.on_advertising_data:
+                    self.on_advertising_data(Advertisement(address, int(-85 + 50 * level)))
+
+    def stop(self):
+        """
+        Stops advertising, waiting for the current callback to finish.
+        """
+        if self.thread is not None:
+            self.event.set()
+            self.thread.join(timeout=1)
+            self.thread = None
+
+
+def generate_library(path: str, collections=('sim_tones', 'sim_drones')) -> str:
+    """
+    Writes a small library of tone clips for the composition module,
+    returning its path. Existing clips are kept, so repeated simulations
+    reuse the library.
+    """
+    t_max = max(SIM_CLIP_SECS)
+    t = np.arange(SIM_CLIP_RATE * t_max) / SIM_CLIP_RATE
+    for c, collection in enumerate(collections):
+        os.makedirs(os.path.join(path, collection), exist_ok=True)
+        for i, seconds in enumerate(SIM_CLIP_SECS):
+            file = os.path.join(path, collection, f'{collection}_{seconds:02d}s.wav')
+            if os.path.isfile(file):
+                continue
+            n = SIM_CLIP_RATE * seconds
+            envelope = np.minimum(1, np.minimum(t[:n], t[:n][::-1]) * 10)
+            tone = np.sin(2 * np.pi * 110 * (c + 1) * (i + 2) / 2 * t[:n]) * envelope * 0.5
+            with wave.open(file, 'wb') as clip:
+                clip.setnchannels(1)
+                clip.setsampwidth(2)
+                clip.setframerate(SIM_CLIP_RATE)
+                clip.writeframes((tone * 32767).astype('<i2').tobytes())
+    return path
+
+
+class Simulation:
+    """
+    Prepares the main Signifier process to run without hardware. Config
+    overrides point the LED module at a fake Arduino and the composition
+    module at a generated library, while the analysis and Bluetooth modules
+    use their stand-ins when `general.simulation.enabled` is set.
+    """
+
+    def __init__(self, config: dict, duration=None) -> None:
+        self.settings = config['general'].get('simulation', {})
+        self.duration = duration or self.settings.get('duration', 60)
+        self.start_time = time.time()
+        # Must be set before the composition module imports PyGame
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        self.arduino = FakeArduino()
+        self.audio_path = generate_library(SIM_AUDIO_PATH)
+        logger.info(f'Simulating Signifier hardware for ({self.duration}) seconds.')
+
+    def apply(self, config: dict):
+        """
+        Applies the simulation overrides to a loaded `config.json` dictionary.
+        """
+        general = config['general']
+        general['simulation'] = {**self.settings, 'enabled': True}
+        general['loop_timing'] = True
+        general['latency_tracing'] = True
+        general['hostname'] = general.get('hostname') or 'simulation'
+        for settings in config.values():
+            if settings.get('module_type') == 'leds':
+                settings['port'] = settings['backup_port'] = self.arduino.port
+            elif settings.get('module_type') == 'composition':
+                settings['base_path'] = self.audio_path
+
+    def remaining(self) -> float:
+        """
+        Returns the seconds left in the simulation run.
+        """
+        return self.start_time + self.duration - time.time()
+
+    def close(self):
+        """
+        Shuts down the hardware stand-ins.
+        """
+        self.arduino.close()
+
+
+def quantile_ms(snapshot: dict, q: float):
+    """
+    Returns the `q` quantile of a histogram snapshot in milliseconds, a
+    `">1000"` style label if it lies above the largest bucket bound, or
+    `None` if the snapshot has no observations.
+    """
+    if (bound := quantile(snapshot, q)) is None:
+        return None
+    if math.isinf(bound):
+        finite = [b for b, _ in snapshot["buckets"] if not math.isinf(b)]
+        return f'>{finite[-1] * 1000:g}' if finite else None
+    return bound * 1000
+
+
+def build_report(values: dict, histograms: dict, elapsed: float) -> dict:
+    """
+    Summarises the metrics collected during a simulation into throughput,
+    latency and CPU usage per module.
+    """
+    modules = sorted(name[:-len('_loop_cpu')] for name in values if name.endswith('_loop_cpu'))
+    report = {'elapsed_secs': round(elapsed, 1), 'modules': {}, 'latency': {}}
+    for module in modules:
+        mid_run = histograms.get(f'{module}_loop_mid_run_seconds')
+        report['modules'][module] = {
+            'cpu_percent': values.get(f'{module}_loop_cpu'),
+            'rss_mb': values.get(f'{module}_rss_mb'),
+            'wakeups_per_sec': values.get(f'{module}_loop_wakeups'),
+            'idle_ratio': values.get(f'{module}_loop_idle'),
+            'runs_per_sec': None if mid_run is None else round(mid_run['count'] / elapsed, 1),
+            'mid_run_p95_ms': None if mid_run is None else quantile_ms(mid_run, 0.95)}
+    for name, snapshot in sorted(histograms.items()):
+        if name.startswith('latency_') and snapshot['count']:
+            report['latency'][name[len('latency_'):-len('_seconds')]] = {
+                'per_sec': round(snapshot['count'] / elapsed, 1),
+                'mean_ms': round(snapshot['sum'] / snapshot['count'] * 1000, 3),
+                'p50_ms': quantile_ms(snapshot, 0.5),
+                'p95_ms': quantile_ms(snapshot, 0.95)}
+    return report
+
+
+def format_report(report: dict) -> str:
+    """
+    Returns a simulation report as a plain text table.
+    """
+    lines = [f'Simulation report ({report["elapsed_secs"]}s)',
+             f'{"module":<14}{"cpu %":>8}{"rss MB":>9}{"wake/s":>9}{"runs/s":>9}{"p95 ms":>9}']
+    for module, stats in report['modules'].items():
+        lines.append(f'{module:<14}' + ''.join(
+            f'{"-" if (v := stats[k]) is None else v:>{w}}' for k, w in (
+                ('cpu_percent', 8), ('rss_mb', 9), ('wakeups_per_sec', 9),
+                ('runs_per_sec', 9), ('mid_run_p95_ms', 9))))
+    lines.append(f'{"latency hop":<14}{"per s":>8}{"mean ms":>9}{"p50 ms":>9}{"p95 ms":>9}')
+    for hop, stats in report['latency'].items():
+        lines.append(f'{hop:<14}{stats["per_sec"]:>8}{stats["mean_ms"]:>9}'
+                     f'{stats["p50_ms"]:>9}{stats["p95_ms"]:>9}')
+    return '\n'.join(lines)
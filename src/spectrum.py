@@ -0,0 +1,106 @@
+#    _________                     __
+#   /   _____/_____   ____   _____/  |________ __ __  _____
+#   \_____  \\____ \_/ __ \_/ ___\   __\_  __ \  |  \/     \
+#   /        \  |_> >  ___/\  \___|  |  |  | \/  |  /  Y Y  \
+#  /_______  /   __/ \___  >\___  >__|  |__|  |____/|__|_|  /
+#          \/|__|        \/     \/                        \/
+
+"""
+Spectral features of the audio input, computed from a windowed FFT of the
+latest `fft_size` samples each time the analysis module reads a period.
+
+The window, the FFT input and output buffers and the matrix summing bins
+into bands are all allocated when the analyser is created, so each period
+costs a copy into the frame, an `rfft` into the reused spectrum buffer and
+a few vector operations.
+"""
+
+from __future__ import annotations
+
+import inspect
+
+import numpy as np
+
+FULL_SCALE = 32768
+DEFAULT_FFT_SIZE = 2048
+# Frequency ranges in Hz of each band level, published as `<module>_<band>`
+DEFAULT_BANDS = {"bass": [20, 250], "mid": [250, 4000], "treble": [4000, 16000]}
+# numpy versions before 2.0 cannot write an `rfft` into an existing array
+RFFT_OUT = "out" in inspect.signature(np.fft.rfft).parameters
+EPSILON = 1e-9
+
+
+class Spectrum:
+    """
+    Computes the RMS level, band levels, spectral centroid and spectral
+    flux of a stream of audio periods, returned by `process()` in the
+    order of `names`.\n
+    Levels are the RMS amplitude relative to full scale, so a full scale
+    sine wave has a level of 0.707. The centroid is in Hz, and the flux is
+    the increase in the magnitude spectrum since the previous period,
+    relative to the current spectrum's total.
+    """
+
+    def __init__(self, sample_rate: int, fft_size=DEFAULT_FFT_SIZE, bands: dict = None) -> None:
+        if fft_size < 16 or fft_size & (fft_size - 1):
+            raise ValueError(f'FFT size ({fft_size}) must be a power of two of at least 16')
+        bands = DEFAULT_BANDS if bands is None else bands
+        self.fft_size = fft_size
+        self.names = ["rms", *bands, "centroid", "flux"]
+        self.level_count = 1 + len(bands)
+        self.values = np.zeros(len(self.names))
+        # Latest `fft_size` samples, oldest first
+        self.frame = np.zeros(fft_size)
+        self.window = np.hanning(fft_size)
+        self.windowed = np.zeros(fft_size)
+        bins = fft_size // 2 + 1
+        self.spectrum = np.zeros(bins, dtype=np.complex128)
+        self.magnitude = np.zeros(bins)
+        self.prev_magnitude = np.zeros(bins)
+        self.power = np.zeros(bins)
+        self.rise = np.zeros(bins)
+        self.freqs = np.fft.rfftfreq(fft_size, 1 / sample_rate)
+        # Scales the summed power of positive frequency bins to mean square
+        self.power_scale = 2 / (fft_size * np.sum(self.window ** 2) * FULL_SCALE ** 2)
+        self.band_matrix = np.zeros((len(bands), bins))
+        for row, (name, band) in zip(self.band_matrix, bands.items()):
+            try:
+                low, high = band
+            except (TypeError, ValueError):
+                raise ValueError(f'[{name}] band must be a [low, high] range in Hz') from None
+            if not 0 <= low < high:
+                raise ValueError(f'Invalid [{name}] band range: [{low}, {high}]')
+            row[(self.freqs >= low) & (self.freqs < high)] = 1
+        self.band_power = np.zeros(len(bands))
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Adds a period of samples to the frame and returns the features of
+        the updated frame. The returned array is reused by the next call.
+        """
+        n = min(len(samples), self.fft_size)
+        if n == 0:
+            return self.values
+        frame = self.frame
+        frame[:-n] = frame[n:]
+        frame[-n:] = samples[-n:]
+        np.multiply(frame, self.window, out=self.windowed)
+        if RFFT_OUT:
+            np.fft.rfft(self.windowed, out=self.spectrum)
+        else:
+            self.spectrum[:] = np.fft.rfft(self.windowed)
+        np.abs(self.spectrum, out=self.magnitude)
+        np.multiply(self.magnitude, self.magnitude, out=self.power)
+        np.dot(self.band_matrix, self.power, out=self.band_power)
+        values = self.values
+        period = frame[-n:]
+        values[0] = np.sqrt(np.dot(period, period) / n) / FULL_SCALE
+        values[1:self.level_count] = np.sqrt(self.band_power * self.power_scale)
+        power_total = self.power.sum()
+        values[-2] = np.dot(self.freqs, self.power) / power_total if power_total > EPSILON else 0
+        np.subtract(self.magnitude, self.prev_magnitude, out=self.rise)
+        np.maximum(self.rise, 0, out=self.rise)
+        magnitude_total = self.magnitude.sum()
+        values[-1] = self.rise.sum() / magnitude_total if magnitude_total > EPSILON else 0
+        self.magnitude, self.prev_magnitude = self.prev_magnitude, self.magnitude
+        return values
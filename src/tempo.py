@@ -0,0 +1,139 @@
+#  ___________
+#  \__    ___/___   _____ ______   ____
+#    |    |_/ __ \ /     \\____ \ /  _ \
+#    |    |\  ___/|  Y Y  \  |_> >  <_> )
+#    |____| \___  >__|_|  /   __/ \____/
+#               \/      \/|__|
+
+"""
+Onset detection and beat tracking from the spectral flux of each period
+read by the analysis module.
+
+Every step is updated once per period in a fixed number of operations.
+The onset threshold follows running sums over a ring of recent flux
+values, the tempo comes from an exponentially decaying autocorrelation of
+the onset envelope at each candidate beat length, and the beat phase is
+an oscillator at the tracked tempo pulled towards detected onsets.
+"""
+
+from __future__ import annotations
+
+import math
+
+import numpy as np
+
+DEFAULT_BPM_RANGE = [60, 180]
+# Tempo that half and double tempo candidates are weighed towards
+PRIOR_BPM = 120
+# Octaves from the prior tempo at which candidates' weight halves
+PRIOR_OCTAVES = 1
+# Seconds of flux the onset threshold is computed over
+THRESHOLD_SECS = 0.5
+# Seconds over which the onset envelope's autocorrelation decays
+HISTORY_SECS = 4
+# Share of the phase error to an onset corrected at each onset
+PHASE_GAIN = 0.2
+# Least flux above the threshold counted as an onset, ignoring silence
+FLUX_FLOOR = 0.02
+
+
+class BeatTracker:
+    """
+    Detects onsets and tracks the tempo and beat phase of a stream of
+    spectral flux values, one per period at `frame_rate` periods per
+    second. `process()` returns the onset, BPM and beat phase in the order
+    of `names`.\n
+    The onset is 1 for a period whose flux rises more than `sensitivity`
+    standard deviations above the recent mean, at least `min_onset_secs`
+    after the previous onset, and 0 otherwise. The BPM is 0 until the
+    onsets show a tempo, and the beat phase rises from 0 to 1 over each
+    beat.
+    """
+    names = ["onset", "bpm", "beat_phase"]
+
+    def __init__(self, frame_rate: float, bpm_range=DEFAULT_BPM_RANGE, sensitivity=1.5,
+                 min_onset_secs=0.1) -> None:
+        try:
+            low_bpm, high_bpm = bpm_range
+        except (TypeError, ValueError):
+            raise ValueError('Tempo bpm_range must be a [low, high] range') from None
+        if not 0 < low_bpm < high_bpm:
+            raise ValueError(f'Invalid tempo bpm_range: [{low_bpm}, {high_bpm}]')
+        self.frame_rate = frame_rate
+        self.sensitivity = sensitivity
+        self.min_onset_frames = min_onset_secs * frame_rate
+        self.values = np.zeros(len(self.names))
+        # Running sums of the flux ring, for the onset threshold
+        self.flux = np.zeros(max(2, round(THRESHOLD_SECS * frame_rate)))
+        self.flux_pos = 0
+        self.flux_sum = 0.0
+        self.flux_sum_sq = 0.0
+        self.prev_flux = 0.0
+        self.since_onset = math.inf
+        # Candidate beat lengths in periods, with their prior weights
+        self.lags = np.arange(max(1, math.floor(60 * frame_rate / high_bpm)),
+                              math.ceil(60 * frame_rate / low_bpm) + 1)
+        self.weights = 0.5 ** (np.abs(np.log2(60 * frame_rate / self.lags / PRIOR_BPM))
+                               / PRIOR_OCTAVES)
+        self.envelope = np.zeros(self.lags[-1] + 1)
+        self.env_pos = 0
+        self.indices = np.zeros(len(self.lags), dtype=np.intp)
+        self.past = np.zeros(len(self.lags))
+        self.acf = np.zeros(len(self.lags))
+        self.scores = np.zeros(len(self.lags))
+        self.decay = math.exp(-1 / (HISTORY_SECS * frame_rate))
+        self.bpm = 0.0
+        self.phase = 0.0
+
+    def process(self, flux: float) -> np.ndarray:
+        """
+        Adds the spectral flux of a period and returns the updated onset,
+        BPM and beat phase. The returned array is reused by the next call.
+        """
+        # Onset threshold from the flux of the preceding periods
+        count = len(self.flux)
+        mean = self.flux_sum / count
+        deviation = math.sqrt(max(0.0, self.flux_sum_sq / count - mean * mean))
+        threshold = mean + self.sensitivity * deviation
+        self.since_onset += 1
+        onset = (flux > threshold + FLUX_FLOOR and flux > self.prev_flux
+                 and self.since_onset >= self.min_onset_frames)
+        if onset:
+            self.since_onset = 0
+        old = self.flux[self.flux_pos]
+        self.flux[self.flux_pos] = flux
+        self.flux_pos = (self.flux_pos + 1) % count
+        self.flux_sum += flux - old
+        self.flux_sum_sq += flux * flux - old * old
+        self.prev_flux = flux
+        # Decaying autocorrelation of the onset envelope at each beat length
+        strength = max(0.0, flux - mean)
+        size = len(self.envelope)
+        np.subtract(self.env_pos, self.lags, out=self.indices)
+        np.mod(self.indices, size, out=self.indices)
+        np.take(self.envelope, self.indices, out=self.past)
+        self.envelope[self.env_pos] = strength
+        self.env_pos = (self.env_pos + 1) % size
+        self.acf *= self.decay
+        if strength > 0:
+            self.past *= strength
+            self.acf += self.past
+        np.multiply(self.acf, self.weights, out=self.scores)
+        best = int(np.argmax(self.scores))
+        if self.scores[best] > 0:
+            lag = float(self.lags[best])
+            if 0 < best < len(self.scores) - 1:
+                # Parabolic interpolation between neighbouring beat lengths
+                a, b, c = self.scores[best - 1:best + 2]
+                if (curve := a - 2 * b + c) < 0:
+                    lag += 0.5 * (a - c) / curve
+            self.bpm = 60 * self.frame_rate / lag
+        # Beat phase oscillator, pulled towards each onset
+        if self.bpm > 0:
+            self.phase = (self.phase + self.bpm / 60 / self.frame_rate) % 1
+            if onset:
+                self.phase = (self.phase - PHASE_GAIN * (self.phase - round(self.phase))) % 1
+        self.values[0] = 1.0 if onset else 0.0
+        self.values[1] = self.bpm
+        self.values[2] = self.phase
+        return self.values
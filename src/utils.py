@@ -9,10 +9,14 @@ import os
 import sys
 import json
 import time
+import select
 import signal
 import logging
+import importlib
 import logging.handlers
 import numpy as np
+from threading import Lock
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
@@ -80,6 +84,18 @@ def rms_flat(a):
     return rms
 
 
+def rss_mb() -> float:
+    """
+    Return the resident set size of the current process in megabytes.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
 def load_dict_from_json(file) -> dict:
     """
     Returns a valid dictionary from provided absolute path to JSON file. Returns
@@ -161,6 +177,89 @@ class FunctionHandler:
 
 
 
+class LazyModule:
+    """
+    Stands in for a module that is only imported on first attribute access.
+    Lets module files reference heavy dependencies at the top level, while
+    only the process that actually uses them pays for the import.
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            start_time = time.time()
+            self._module = importlib.import_module(self._name)
+            logger.debug(f'Imported [{self._name}] in '
+                         f'{(time.time() - start_time) * 1000:.1f}ms (pid {os.getpid()}).')
+        return getattr(self._module, attr)
+
+
+class QueueConnection:
+    """
+    In-process stand-in for a `multiprocessing` Connection, used between
+    modules hosted as threads in the same process. Messages are passed by
+    reference through a deque rather than pickled, while an OS pipe holds a
+    single wake byte whenever messages are queued, so `fileno()` works with
+    `connection.wait()`.\n
+    The lock keeps the wake byte in step with the deque, so the pipe is
+    never left readable with no messages behind it.
+    """
+
+    def __init__(self) -> None:
+        self.messages = deque()
+        self.lock = Lock()
+        self.signalled = False
+        self.read_fd, self.write_fd = os.pipe()
+        os.set_blocking(self.read_fd, False)
+        self.peer = None
+        self.writable = True
+        self.readable = True
+
+    def fileno(self) -> int:
+        return self.read_fd
+
+    def send(self, message):
+        peer = self.peer
+        with peer.lock:
+            peer.messages.append(message)
+            if not peer.signalled:
+                os.write(peer.write_fd, b'\0')
+                peer.signalled = True
+
+    def recv(self):
+        with self.lock:
+            message = self.messages.popleft()
+            if len(self.messages) == 0 and self.signalled:
+                os.read(self.read_fd, 1)
+                self.signalled = False
+        return message
+
+    def poll(self, timeout=0.0) -> bool:
+        if len(self.messages) > 0:
+            return True
+        if timeout is not None and timeout <= 0:
+            return False
+        select.select([self.read_fd], [], [], timeout)
+        return len(self.messages) > 0
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def queue_pipe() -> tuple:
+    """
+    Returns a pair of connected `QueueConnection` objects, matching the
+    interface of `multiprocessing.Pipe()` for modules hosted as threads.
+    """
+    a, b = QueueConnection(), QueueConnection()
+    a.peer, b.peer = b, a
+    return a, b
+
+
 class SmoothedValue:
     # https://gitlab.zenairo.6 com/led-projects/dancyPi-audio-reactive-led/-/raw/262206d35962b2383f2649d726ff9bc513095ec7/python/dsp.py
     """
@@ -256,3 +355,56 @@ class Stopwatch:
 
     def check(self, duration):
         return True if time.time() > self.start_time + duration else False
+
+
+class Ticker:
+    """
+    Fixed-rate deadline clock on the monotonic clock. Deadlines advance by
+    whole periods from the first tick, so the rate doesn't drift with the
+    time taken by each tick.\n
+    A tick more than `TICK_LATE_FRACTION` of a period after its deadline
+    counts as late. Ticks that fall a whole period or more behind are
+    skipped and counted as missed, rather than bursting to catch up.
+    """
+    TICK_LATE_FRACTION = 0.25
+
+    def __init__(self, period: float) -> None:
+        if period <= 0:
+            raise ValueError(f'Ticker period ({period}) must be positive')
+        self.period = period
+        self.next_tick = time.monotonic()
+        self.ticks = 0
+        self.late = 0
+        self.missed = 0
+
+    def due(self) -> bool:
+        """
+        Returns `True` and schedules the next deadline if a tick is due.
+        """
+        now = time.monotonic()
+        if now < self.next_tick:
+            return False
+        lateness = now - self.next_tick
+        skipped = int(lateness // self.period)
+        self.ticks += 1
+        self.missed += skipped
+        if lateness - skipped * self.period > self.period * self.TICK_LATE_FRACTION:
+            self.late += 1
+        self.next_tick += (skipped + 1) * self.period
+        return True
+
+    def remaining(self) -> float:
+        """
+        Returns the seconds until the next deadline.
+        """
+        return max(0, self.next_tick - time.monotonic())
+
+    def set_period(self, period: float):
+        """
+        Changes the period, with the next deadline one new period after the
+        previous tick.
+        """
+        if period <= 0:
+            raise ValueError(f'Ticker period ({period}) must be positive')
+        self.next_tick += period - self.period
+        self.period = period
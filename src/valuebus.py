@@ -0,0 +1,257 @@
+#  ____   ____      .__                  __________
+#  \   \ /   /____  |  |  __ __   ____   \______   \__ __  ______
+#   \   Y   /\__  \ |  | |  |  \_/ __ \   |    |  _/  |  \/  ___/
+#    \     /  / __ \|  |_|  |  /\  ___/   |    |   \  |  /\___ \
+#     \___/  (____  /____/____/  \___  >  |______  /____//____  >
+#                 \/                 \/          \/           \/
+
+"""
+Shared memory bus for passing numeric source and destination values
+between module processes without pickling them through pipes.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.utils import SigLog
+
+logger = SigLog.get_logger('Sig.ValueBus', level='INFO')
+
+# Each slot is guarded by a sequence counter, which is odd while being written.
+# Traced values also carry their trace id and monotonic origin timestamp.
+SLOT_DTYPE = np.dtype([
+    ("seq", "<u8"),
+    ("time", "<f8"),
+    ("value", "<f8"),
+    ("duration", "<f8"),
+    ("trace", "<u8"),
+    ("origin", "<f8")])
+READ_RETRIES = 5
+BUS_TYPES = ["gauge"]
+
+
+class ValueBus:
+    """
+    Shared memory block holding one slot per numeric value declared in
+    `values.json`. Created by the main Signifier process before any module
+    processes are forked, so every process maps the same memory.\n
+    Each slot has exactly one writer: sources are written by the module that
+    owns them, destinations are written by the mapper. Writes are wrapped in
+    a seqlock, so readers retry rather than use a half-written slot.\n
+    Each module with destinations on the bus has a wake pipe, written once
+    after each batch of destinations is published, so the module's run loop
+    can block on it rather than finding new values at its next deadline.
+    """
+
+    def __init__(self, values_config: dict) -> None:
+        self.slots = {}
+        self.sources = {}
+        self.destinations = {}
+        for module, config in values_config.items():
+            self.sources[module] = self.add_slots(config.get("sources", {}))
+            self.destinations[module] = self.add_slots(config.get("destinations", {}))
+        size = max(1, len(self.slots)) * SLOT_DTYPE.itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.array = np.ndarray((len(self.slots),), dtype=SLOT_DTYPE, buffer=self.shm.buf)
+        self.array[:] = 0
+        self.seq = self.array["seq"]
+        self.time = self.array["time"]
+        self.value = self.array["value"]
+        self.duration = self.array["duration"]
+        self.trace = self.array["trace"]
+        self.origin = self.array["origin"]
+        self.modules = {name: module for module, names in self.destinations.items()
+                        for name in names}
+        self.wakes = {}
+        for module, names in self.destinations.items():
+            if names:
+                self.wakes[module] = os.pipe()
+                for fd in self.wakes[module]:
+                    os.set_blocking(fd, False)
+        logger.debug(f'Value bus [{self.shm.name}] created with ({len(self.slots)}) slots.')
+
+    def add_slots(self, values: dict) -> list:
+        """
+        Assigns a slot index to each numeric value in the supplied dictionary
+        and returns the list of names given slots.
+        """
+        names = []
+        for name, metric in values.items():
+            if metric.get("type") in BUS_TYPES and name not in self.slots:
+                self.slots[name] = len(self.slots)
+                names.append(name)
+        return names
+
+    def write(self, name: str, value, duration=None, trace=None) -> bool:
+        """
+        Writes a value to its slot in place, along with an optional
+        `(trace id, origin time)` tuple. Returns `False` if the value has
+        no slot on the bus, so the caller can fall back to a pipe.
+        """
+        if (i := self.slots.get(name)) is None:
+            return False
+        try:
+            value = float(value)
+            duration = np.nan if duration is None else float(duration)
+        except (TypeError, ValueError):
+            return False
+        seq = self.seq[i]
+        self.seq[i] = seq + 1
+        self.time[i] = time.monotonic()
+        self.value[i] = value
+        self.duration[i] = duration
+        self.trace[i], self.origin[i] = (0, 0) if trace is None else trace[:2]
+        self.seq[i] = seq + 2
+        return True
+
+    def write_sources(self, values: dict, traces: dict = None) -> dict:
+        """
+        Writes each changed source value to the bus, along with any trace
+        in the supplied `traces` dictionary, returning a dictionary of the
+        values that could not be written.
+        """
+        unsent = {}
+        traces = {} if traces is None else traces
+        for name, value in values.items():
+            if (i := self.slots.get(name)) is not None and self.value[i] == value and self.seq[i]:
+                continue
+            if not self.write(name, value, trace=traces.get(name)):
+                unsent[name] = value
+        return unsent
+
+    def write_destinations(self, destinations: dict) -> dict:
+        """
+        Writes mapped destination values to the bus, returning a dictionary of
+        the destinations that could not be written.
+        """
+        unsent = {}
+        woken = set()
+        for name, output in destinations.items():
+            if not self.write(name, output.get("value"), output.get("duration"),
+                              output.get("trace")):
+                unsent[name] = output
+            else:
+                woken.add(self.modules.get(name))
+        for module in woken:
+            self.wake(module)
+        return unsent
+
+    def wake(self, module: str):
+        """
+        Wakes a module waiting on its destinations. Wakes are skipped while
+        the pipe is full, as the reader takes every changed slot on each
+        wake.
+        """
+        if (fds := self.wakes.get(module)) is None:
+            return
+        try:
+            os.write(fds[1], b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def read(self, i: int) -> tuple:
+        """
+        Returns a consistent `(seq, value, duration, time, trace, origin)`
+        snapshot of a slot, or `None` if the writer held the slot for every
+        retry.
+        """
+        for _ in range(READ_RETRIES):
+            seq = self.seq[i]
+            if seq & 1:
+                continue
+            value = self.value[i]
+            duration = self.duration[i]
+            stamp = self.time[i]
+            trace = self.trace[i]
+            origin = self.origin[i]
+            if self.seq[i] == seq:
+                return seq, value, duration, stamp, trace, origin
+        return None
+
+    def reader(self, names: list, destinations=False, module: str = None) -> BusReader:
+        """
+        Returns a reader object tracking changes to the supplied value names.
+        Readers of a `module`'s destinations are given its wake pipe.
+        """
+        wake_fd = self.wakes[module][0] if module in self.wakes else None
+        return BusReader(self, [n for n in names if n in self.slots], destinations, wake_fd)
+
+    def close(self, unlink=False):
+        """
+        Releases this process' view of the bus. The main process should also
+        `unlink` the shared memory block once all modules have closed.
+        """
+        self.array = self.seq = self.time = self.value = self.duration = None
+        self.trace = self.origin = None
+        for fds in self.wakes.values():
+            for fd in fds:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.wakes = {}
+        try:
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+        except (FileNotFoundError, BufferError) as exception:
+            logger.warning(f'Could not release value bus: {exception}')
+
+
+class BusReader:
+    """
+    Tracks the last sequence number seen for a set of value bus slots, so
+    each poll only returns values written since the previous poll.\n
+    Traces of source values are collected in `traces` as
+    `{name: (trace id, origin time, write time)}`. Readers given a `wake_fd`
+    clear its pending wakes on each poll, so the owner can wait on it.
+    """
+
+    def __init__(self, bus: ValueBus, names: list, destinations: bool, wake_fd=None) -> None:
+        self.bus = bus
+        self.wake_fd = wake_fd
+        self.names = names
+        self.destinations = destinations
+        self.indices = np.array([bus.slots[n] for n in names], dtype=np.intp)
+        self.last_seq = np.zeros(len(names), dtype=SLOT_DTYPE["seq"])
+        self.traces = {}
+
+    def poll(self) -> dict:
+        """
+        Returns a dictionary of values updated since the last poll. Source
+        readers return `{name: value}`, while destination readers return the
+        same `{name: {"value": v, "duration": d, "trace": t}}` format sent
+        over pipes, where `duration` and `trace` are only included if set.
+        """
+        updates = {}
+        if self.wake_fd is not None:
+            # Cleared before reading, so writes after this point wake the next wait
+            try:
+                while os.read(self.wake_fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+        if len(self.indices) == 0:
+            return updates
+        for j in np.flatnonzero(self.bus.seq[self.indices] != self.last_seq):
+            if (snapshot := self.bus.read(self.indices[j])) is None:
+                continue
+            seq, value, duration, stamp, trace, origin = snapshot
+            self.last_seq[j] = seq
+            if self.destinations:
+                output = {"value": float(value)}
+                if not np.isnan(duration):
+                    output["duration"] = int(duration)
+                if trace:
+                    output["trace"] = (int(trace), float(origin), float(stamp))
+                updates[self.names[j]] = output
+            else:
+                updates[self.names[j]] = float(value)
+                if trace:
+                    self.traces[self.names[j]] = (int(trace), float(origin), float(stamp))
+        return updates
@@ -0,0 +1,117 @@
+#  ____   ____      .__                  .___________
+#  \   \ /   /____  |  |  __ __   ____   |   \______ \   ______
+#   \   Y   /\__  \ |  | |  |  \_/ __ \  |   ||    |  \ /  ___/
+#    \     /  / __ \|  |_|  |  /\  ___/  |   ||    `   \\___ \
+#     \___/  (____  /____/____/  \___  > |___/_______  /____  >
+#                 \/                 \/              \/     \/
+
+"""
+Registry of small integer IDs for the source and destination values
+declared in `values.json`, so values can be sent between processes keyed
+by ID rather than by name.
+
+IDs are assigned in the order values are declared, module by module with
+sources before destinations, so every process compiling the same
+`values.json` agrees on them. The main Signifier process compiles the
+registry once at startup and hands it to every module. Values the registry
+does not know, such as those added to `values.json` while running, are
+still sent by name.
+"""
+
+from __future__ import annotations
+
+from collections import namedtuple
+
+# Key of the `{key: trace}` dictionary added to value payloads
+TRACE_KEY = "_traces"
+
+ValueInfo = namedtuple('ValueInfo', 'name module role type min max description enabled')
+
+
+class ValueIds:
+    """
+    Assigns each value in `values.json` a stable ID, holding its metadata
+    in `info` and its name in `names`, both indexed by ID.\n
+    Value payloads are `{key: value}` dictionaries keyed by ID, or by name
+    for values without one, with any traces under `TRACE_KEY`. Output
+    payloads hold `(value, duration, trace)` tuples instead of each
+    destination's message dictionary.
+    """
+
+    def __init__(self, values_config: dict) -> None:
+        self.ids = {}
+        self.info = []
+        for module, config in values_config.items():
+            for role in ("sources", "destinations"):
+                for name, metric in config.get(role, {}).items():
+                    if name in self.ids:
+                        continue
+                    self.ids[name] = len(self.info)
+                    self.info.append(ValueInfo(
+                        name, module, role, metric.get("type"), metric.get("min"),
+                        metric.get("max"), metric.get("description", ""),
+                        metric.get("enabled", True)))
+        self.names = [info.name for info in self.info]
+
+    def __len__(self) -> int:
+        return len(self.info)
+
+    def key(self, name: str):
+        """
+        Returns the ID of a registered value, or its name if it has none.
+        """
+        return self.ids.get(name, name)
+
+    def name(self, key) -> str:
+        """
+        Returns the name of a value from its `key()`.
+        """
+        return self.names[key] if type(key) is int else key
+
+    def pack(self, values: dict, traces: dict = None) -> dict:
+        """
+        Returns the value payload of a `{name: value}` dictionary, with any
+        `{name: trace}` traces.
+        """
+        ids = self.ids
+        payload = {ids.get(name, name): value for name, value in values.items()}
+        if traces:
+            payload[TRACE_KEY] = {ids.get(name, name): trace for name, trace in traces.items()}
+        return payload
+
+    def unpack(self, payload: dict) -> dict:
+        """
+        Returns the `{name: value}` dictionary of a value payload, with any
+        traces under `TRACE_KEY`.
+        """
+        name = self.name
+        values = {name(key): value for key, value in payload.items()}
+        if (traces := values.get(TRACE_KEY)) is not None:
+            values[TRACE_KEY] = {name(key): trace for key, trace in traces.items()}
+        return values
+
+    def pack_outputs(self, outputs: dict) -> dict:
+        """
+        Returns the output payload of mapped destinations in the
+        `{name: {"value": v, "duration": d, "trace": t}}` format.
+        """
+        ids = self.ids
+        return {ids.get(name, name): (output.get("value"), output.get("duration"),
+                                      output.get("trace"))
+                for name, output in outputs.items()}
+
+    def unpack_outputs(self, payload: dict) -> dict:
+        """
+        Returns the destinations of an output payload in the
+        `{name: {"value": v, "duration": d, "trace": t}}` format, where
+        `duration` and `trace` are only included if set.
+        """
+        outputs = {}
+        for key, (value, duration, trace) in payload.items():
+            output = {"value": value}
+            if duration is not None:
+                output["duration"] = duration
+            if trace is not None:
+                output["trace"] = trace
+            outputs[self.name(key)] = output
+        return outputs